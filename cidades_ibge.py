@@ -1,7 +1,14 @@
 from pathlib import Path
 import re
 import json
+import mmap
+import os
+import tempfile
 import unicodedata
+from collections.abc import Mapping
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Dict, Optional
 from rapidfuzz import process, fuzz
 import logging
 
@@ -11,11 +18,14 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("CodigoMunicipio")
 
 
-BASE_DIR = Path(__file__).resolve().parent.parent
+PASTA = Path(__file__).resolve().parent
+
+# municipios.json é a fonte; o índice compacto é gerado a partir dele com:
+# python cidades_ibge.py
+CAMINHO_MUNICIPIOS = PASTA / "municipios.json"
+CAMINHO_INDICE = PASTA / "cidades_ibge.idx"
 
 
-with open("municipios.json", encoding="utf-8") as f:
-    municipios_raw = json.load(f)
 # Mapeamento UF por código IBGE
 UF_POR_CODIGO = {
     11: ["RO", "RONDONIA"],
@@ -48,14 +58,184 @@ UF_POR_CODIGO = {
 }
 
 
-# Monta o dicionário com as chaves normalizadas
-CIDADES_IBGE = {}
-for m in municipios_raw:
-    cod_uf = m["codigo_uf"]
-    nomes_uf = UF_POR_CODIGO.get(cod_uf, [])
-    for uf in (nomes_uf if isinstance(nomes_uf, list) else [nomes_uf]):
-        chave = f"{unicodedata.normalize('NFD', m['nome']).encode('ascii', 'ignore').decode().upper().strip()}-{uf}"
-        CIDADES_IBGE[chave] = str(m["codigo_ibge"])
+def gerar_indice(origem=CAMINHO_MUNICIPIOS, destino=CAMINHO_INDICE):
+    """
+    Gera o índice compacto a partir de municipios.json: uma linha por (UF, município),
+    "UF<TAB>NOME<TAB>codigo_ibge<TAB>latitude<TAB>longitude<TAB>ddd<TAB>ordem", com os nomes já
+    normalizados e as linhas ordenadas, para busca binária direto no arquivo mapeado.
+    Cada município aparece com a sigla e com o nome da UF, como em CIDADES_IBGE; "ordem" é a
+    posição da chave no antigo dict CIDADES_IBGE (ordem de municipios.json), usada para iterar
+    as chaves na mesma ordem e manter o desempate dos buscadores fuzzy.
+    """
+    with open(origem, encoding="utf-8") as f:
+        municipios_raw = json.load(f)
+
+    # Como no dict CIDADES_IBGE: a chave fica na posição da primeira ocorrência, com os dados da última
+    registros = {}
+    for m in municipios_raw:
+        nome = unicodedata.normalize("NFD", m["nome"]).encode("ascii", "ignore").decode().upper().strip()
+        for uf in UF_POR_CODIGO.get(m["codigo_uf"], []):
+            registros[(uf, nome)] = m
+
+    linhas = [
+        f"{uf}\t{nome}\t{m['codigo_ibge']}\t{m['latitude']}\t{m['longitude']}\t{m['ddd']}\t{ordem}\n"
+        for ordem, ((uf, nome), m) in enumerate(registros.items())
+    ]
+    # TAB é menor que qualquer caractere dos nomes: a ordem das linhas é a ordem de (UF, nome)
+    linhas.sort()
+
+    temporario = Path(f"{destino}.tmp")
+    temporario.write_bytes("".join(linhas).encode("ascii"))
+    os.replace(temporario, destino)
+    logger.info(f"Índice de municípios gerado em {destino}: {len(linhas)} chaves")
+    return destino
+
+
+class IndiceMunicipios(Mapping):
+    """
+    Chaves "NOME-UF" -> código IBGE, lidas do índice compacto sem carregá-lo em objetos Python.
+    O arquivo é mapeado em memória (somente leitura): os processos do gunicorn e do Celery
+    compartilham as mesmas páginas pelo cache do sistema, e a busca é binária sobre as linhas.
+    """
+
+    def __init__(self, dados):
+        self._dados = dados
+        self._tamanho = None
+
+    def _primeira_linha(self, prefixo: bytes) -> int:
+        """Início da primeira linha >= prefixo (ou o fim dos dados)."""
+        dados = self._dados
+        inicio, fim = 0, len(dados)
+        while inicio < fim:
+            meio = (inicio + fim) // 2
+            linha = dados.rfind(b"\n", 0, meio) + 1
+            fim_linha = dados.find(b"\n", linha)
+            if dados[linha:fim_linha] < prefixo:
+                inicio = fim_linha + 1
+            else:
+                fim = linha
+        return inicio
+
+    def _linhas(self, inicio: int = 0, fim: Optional[int] = None):
+        """Campos de cada linha no intervalo [inicio, fim)."""
+        fim = len(self._dados) if fim is None else fim
+        for linha in self._dados[inicio:fim].decode("ascii").splitlines():
+            yield linha.split("\t")
+
+    @staticmethod
+    def _prefixo(chave: str) -> bytes:
+        nome, _, uf = chave.rpartition("-")
+        return f"{uf}\t{nome}\t".encode("ascii", "ignore")
+
+    def dados_municipio(self, chave: str) -> Optional[dict]:
+        """Código IBGE, latitude, longitude e DDD da chave "NOME-UF", ou None."""
+        prefixo = self._prefixo(chave)
+        inicio = self._primeira_linha(prefixo)
+        if self._dados[inicio:inicio + len(prefixo)] != prefixo:
+            return None
+        fim = self._dados.find(b"\n", inicio)
+        _, _, codigo, latitude, longitude, ddd, _ = self._dados[inicio:fim].decode("ascii").split("\t")
+        return {"codigo_ibge": codigo, "latitude": float(latitude), "longitude": float(longitude), "ddd": int(ddd)}
+
+    def particao(self, uf: Optional[str] = None) -> Dict[str, str]:
+        """
+        {chave: codigo} dos municípios da UF (vazio se a UF não existe), ou de todo o índice com
+        uf=None, na ordem de municipios.json (a mesma do antigo dict CIDADES_IBGE).
+        """
+        inicio, fim = 0, None
+        if uf is not None:
+            inicio = self._primeira_linha(f"{uf}\t".encode("ascii", "ignore"))
+            # Os nomes só têm caracteres abaixo de 0x7f
+            fim = self._primeira_linha(f"{uf}\t\x7f".encode("ascii", "ignore"))
+        linhas = sorted(self._linhas(inicio, fim), key=lambda campos: int(campos[6]))
+        return {f"{nome}-{uf_linha}": codigo for uf_linha, nome, codigo, *_ in linhas}
+
+    def __getitem__(self, chave):
+        dados = self.dados_municipio(chave) if isinstance(chave, str) else None
+        if dados is None:
+            raise KeyError(chave)
+        return dados["codigo_ibge"]
+
+    def __iter__(self):
+        return iter(self.particao())
+
+    def __len__(self):
+        if self._tamanho is None:
+            self._tamanho = sum(1 for _ in self._linhas())
+        return self._tamanho
+
+
+@lru_cache(maxsize=None)
+def _indice() -> IndiceMunicipios:
+    """Abre o índice no primeiro uso. Sem o arquivo gerado, monta o mesmo conteúdo em memória."""
+    try:
+        with open(CAMINHO_INDICE, "rb") as f:
+            # O mmap continua válido depois de fechar o arquivo
+            return IndiceMunicipios(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    except (FileNotFoundError, ValueError) as e:
+        logger.warning(f"[CodigoMunicipio] Índice {CAMINHO_INDICE} indisponível ({e}), "
+                       f"gerando em memória a partir de {CAMINHO_MUNICIPIOS}")
+    with tempfile.TemporaryDirectory() as pasta:
+        destino = gerar_indice(destino=Path(pasta) / CAMINHO_INDICE.name)
+        return IndiceMunicipios(destino.read_bytes())
+
+
+def __getattr__(nome):
+    # CIDADES_IBGE continua disponível como antes, mas só é aberto quando alguém o usa
+    if nome == "CIDADES_IBGE":
+        return _indice()
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
+
+
+# Similaridade mínima (difflib) para aceitar a sugestão de um município parecido
+SIMILARIDADE_MINIMA = 0.80
+
+
+@lru_cache(maxsize=None)
+def _particao(uf: Optional[str]) -> Dict[str, str]:
+    """{chave: codigo} da UF (ou de todas as UFs, com None), montado uma vez por processo."""
+    return _indice().particao(uf)
+
+
+def _mais_similar(chave, candidatos):
+    """
+    Mesmo resultado de difflib.get_close_matches(chave, candidatos, n=1, cutoff=SIMILARIDADE_MINIMA).
+    O rapidfuzz pré-filtra: a razão de Indel é sempre >= a razão do difflib, então nenhuma chave
+    que passaria no difflib fica de fora, e o difflib só confirma os poucos candidatos restantes.
+    """
+    pre_filtrados = process.extract(chave, candidatos, scorer=fuzz.ratio,
+                                    score_cutoff=SIMILARIDADE_MINIMA * 100 - 0.01, limit=None)
+    melhor = None
+    for candidato, _, _ in pre_filtrados:
+        razao = SequenceMatcher(None, candidato, chave).ratio()
+        if razao >= SIMILARIDADE_MINIMA and (melhor is None or (razao, candidato) > melhor):
+            melhor = (razao, candidato)
+    return melhor[1] if melhor else None
+
+
+@lru_cache(maxsize=4096)
+def resolver_codigo_municipio(nome, uf):
+    """
+    Resolve o código IBGE a partir do nome e da UF já normalizados (sem acentos, maiúsculas).
+    Busca exata pela chave, depois correspondência parcial do nome e por fim o município
+    mais parecido, sempre dentro da partição da UF. UFs fora da tabela usam todas as chaves.
+    Memoizada por (nome, uf): a mesma nota consulta o mesmo município várias vezes.
+    :return: (codigo, chave encontrada, tipo: "exata", "parcial" ou "similar"), ou ("", None, None)
+    """
+    chave_exata = f"{nome}-{uf}"
+    codigo = _indice().get(chave_exata)
+    if codigo:
+        return codigo, chave_exata, "exata"
+
+    particao = _particao(uf) or _particao(None)
+    for chave, codigo in particao.items():
+        if nome in chave and f"-{uf}" in chave:
+            return codigo, chave, "parcial"
+
+    sugestao = _mais_similar(chave_exata, list(particao))
+    if sugestao:
+        return particao[sugestao], sugestao, "similar"
+    return "", None, None
 
         
 # Função limpar_texto (mantemos)
@@ -95,22 +275,22 @@ def buscar_codigo_municipio(texto_ocr):
 
     chave = f"{municipio}-{uf}"
     # Busca direta
-    if chave in CIDADES_IBGE:
-        return CIDADES_IBGE[chave]
+    codigo = _indice().get(chave)
+    if codigo:
+        return codigo
 
     # Matching fuzzy
+    cidades = _particao(None)
     melhor, score, _ = process.extractOne(
-        chave, CIDADES_IBGE.keys(), scorer=fuzz.WRatio
+        chave, cidades.keys(), scorer=fuzz.WRatio
     )
     if score > 85:
         logger.warning(f"[CodigoMunicipio] Fuzzy Match aplicado: '{melhor}' para '{chave}' (Score: {score})")
-        return CIDADES_IBGE[melhor]
+        return cidades[melhor]
 
     logger.error(f"[CodigoMunicipio] Município NÃO encontrado: '{municipio}-{uf}' extraído de '{texto_ocr}'")
     return ""
 
 
-
-UF_POR_CODIGO = {
-    42: ["SC", "SANTA CATARINA"]
-}
\ No newline at end of file
+if __name__ == "__main__":
+    gerar_indice()
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from .models import (
-    UserCredits, PaymentOrder, CreditTransaction, CreditPackage, SupportTicket, ProcessedFileCount
+    UserCredits, PaymentOrder, CreditTransaction, CreditPackage, SupportTicket, ProcessedFileCount,
+    LayoutTemplate
 )
 
 @admin.register(UserCredits)
@@ -89,4 +90,12 @@ class ProcessedFileCountAdmin(admin.ModelAdmin):
     list_display = ['user', 'count', 'last_updated']
     list_filter = ['last_updated']
     search_fields = ['user__username']
-    readonly_fields = ['last_updated']
\ No newline at end of file
+    readonly_fields = ['last_updated']
+
+
+@admin.register(LayoutTemplate)
+class LayoutTemplateAdmin(admin.ModelAdmin):
+    list_display = ['prefeitura', 'ativo', 'amostras', 'usos', 'falhas', 'falhas_consecutivas', 'updated_at']
+    list_filter = ['ativo']
+    search_fields = ['prefeitura']
+    readonly_fields = ['created_at', 'updated_at']
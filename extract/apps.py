@@ -1,6 +1,23 @@
+import os
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 
 class ExtractConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'extract'
+
+    def ready(self):
+        # Validação de XSD pedida para uma versão sem esquema: falha ao subir, em vez de
+        # gerar todos os XMLs sem validação (xml_valido vazio) sem ninguém perceber
+        versao = settings.XSD_VERSAO_GERADOR
+        if versao:
+            caminho = settings.ABRASF_XSD_VERSOES.get(versao)
+            if not caminho or not os.path.exists(caminho):
+                raise ImproperlyConfigured(
+                    f"XSD_VERSAO_GERADOR={versao}, mas não há XSD configurado para essa versão "
+                    f"(ABRASF_XSD_VERSOES: {caminho or 'vazio'}). Aponte ABRASF_XSD_2_04 para o "
+                    f"arquivo ou deixe XSD_VERSAO_GERADOR vazio para desligar a validação."
+                )
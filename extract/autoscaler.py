@@ -0,0 +1,168 @@
+import json
+import logging
+import math
+import time
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+from .redis_service import get_redis_client
+
+
+logger = logging.getLogger(__name__)
+
+
+class MetricasFilas:
+    """
+    Métricas das filas do Celery lidas direto do Redis (broker):
+    - profundidade: mensagens esperando na lista da fila
+    - idade da mensagem mais antiga: pelo cabeçalho enfileirado_em (sinal before_task_publish)
+    - duração média das tarefas de cada fila: amostras gravadas no task_postrun
+    """
+
+    PREFIXO_DURACAO = "autoscaler:duracao"
+    AMOSTRAS_DURACAO = 100
+
+    @classmethod
+    def registrar_duracao(cls, fila: Optional[str], segundos: float):
+        if not fila:
+            return
+        try:
+            pipe = get_redis_client().pipeline()
+            pipe.lpush(f"{cls.PREFIXO_DURACAO}:{fila}", round(segundos, 3))
+            pipe.ltrim(f"{cls.PREFIXO_DURACAO}:{fila}", 0, cls.AMOSTRAS_DURACAO - 1)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"[Autoscaler] Não foi possível registrar a duração da tarefa: {e}")
+
+    @classmethod
+    def duracao_media(cls, fila: str) -> Optional[float]:
+        amostras = get_redis_client().lrange(f"{cls.PREFIXO_DURACAO}:{fila}", 0, -1)
+        if not amostras:
+            return None
+        return sum(float(a) for a in amostras) / len(amostras)
+
+    @staticmethod
+    def profundidade(fila: str) -> int:
+        return int(get_redis_client().llen(fila))
+
+    @staticmethod
+    def idade_mais_antiga(fila: str) -> Optional[float]:
+        """Segundos desde a publicação da mensagem mais antiga (o kombu consome pelo fim da lista)."""
+        mensagem = get_redis_client().lindex(fila, -1)
+        if mensagem is None:
+            return None
+        try:
+            enfileirado_em = json.loads(mensagem).get("headers", {}).get("enfileirado_em")
+        except (ValueError, AttributeError):
+            return None
+        return max(0.0, time.time() - float(enfileirado_em)) if enfileirado_em else None
+
+
+class CeleryAutoscaler:
+    """
+    Ajusta o tamanho dos pools dos workers de cada fila (pool_grow/pool_shrink) conforme a demanda.
+    Para cada fila em AUTOSCALER_FILAS ({fila: [mínimo, máximo]} processos somando todos os
+    workers que a consomem), o alvo é o necessário para manter as tarefas em execução e esvaziar
+    a fila em AUTOSCALER_ALVO_SEGUNDOS, pela duração média medida das tarefas. Mensagens mais
+    velhas que AUTOSCALER_IDADE_MAX forçam crescimento; a redução só acontece depois de
+    AUTOSCALER_CICLOS_OCIOSOS amostras seguidas pedindo menos processos.
+    Pools do tipo threads não aceitam pool_grow/pool_shrink e são apenas reportados.
+    Um worker que consome várias filas entra na conta de cada uma: use um worker por fila (Procfile).
+    """
+
+    def __init__(self, app, dry_run: bool = False, timeout: float = 2.0):
+        self.app = app
+        self.dry_run = dry_run
+        self.timeout = timeout
+        self.limites = settings.AUTOSCALER_FILAS
+        self._ciclos_ociosos: Dict[str, int] = {}
+
+    def _workers_por_fila(self) -> Dict[str, Dict[str, Dict]]:
+        """{fila: {worker: {"processos": n, "ativos": n, "ajustavel": bool}}} pelos comandos de inspect."""
+        inspect = self.app.control.inspect(timeout=self.timeout)
+        filas_ativas = inspect.active_queues() or {}
+        estatisticas = inspect.stats() or {}
+        ativas = inspect.active() or {}
+
+        resultado: Dict[str, Dict[str, Dict]] = {}
+        for worker, filas in filas_ativas.items():
+            pool = estatisticas.get(worker, {}).get("pool", {})
+            processos = pool.get("processes")
+            info = {
+                "processos": len(processos) if isinstance(processos, list) else int(pool.get("max-concurrency", 0)),
+                "ativos": len(ativas.get(worker, [])),
+                "ajustavel": isinstance(processos, list),
+            }
+            for fila in filas:
+                resultado.setdefault(fila["name"], {})[worker] = info
+        return resultado
+
+    def amostrar(self) -> Dict[str, Dict]:
+        """Profundidade, idade, duração média e pools atuais de cada fila configurada."""
+        workers = self._workers_por_fila()
+        amostras = {}
+        for fila in self.limites:
+            workers_fila = workers.get(fila, {})
+            amostras[fila] = {
+                "profundidade": MetricasFilas.profundidade(fila),
+                "idade": MetricasFilas.idade_mais_antiga(fila),
+                "duracao_media": MetricasFilas.duracao_media(fila),
+                "processos": sum(w["processos"] for w in workers_fila.values()),
+                "ativos": sum(w["ativos"] for w in workers_fila.values()),
+                "workers": workers_fila,
+            }
+        return amostras
+
+    def calcular_alvo(self, fila: str, amostra: Dict) -> int:
+        minimo, maximo = self.limites[fila]
+        atual = amostra["processos"]
+        duracao = amostra["duracao_media"] or settings.AUTOSCALER_ALVO_SEGUNDOS
+
+        # Processos para as tarefas em execução mais os que esvaziam a fila no prazo alvo
+        alvo = amostra["ativos"] + math.ceil(amostra["profundidade"] * duracao / settings.AUTOSCALER_ALVO_SEGUNDOS)
+        if amostra["idade"] is not None and amostra["idade"] > settings.AUTOSCALER_IDADE_MAX:
+            alvo = max(alvo, atual + 1)
+        alvo = max(minimo, min(maximo, alvo))
+
+        if alvo < atual:
+            # Histerese: só reduz depois de algumas amostras seguidas com sobra
+            self._ciclos_ociosos[fila] = self._ciclos_ociosos.get(fila, 0) + 1
+            if self._ciclos_ociosos[fila] < settings.AUTOSCALER_CICLOS_OCIOSOS:
+                return atual
+        self._ciclos_ociosos[fila] = 0
+        return alvo
+
+    def ajustar(self) -> List[str]:
+        """Executa um ciclo: amostra as filas e distribui o ajuste entre os workers ajustáveis."""
+        acoes = []
+        for fila, amostra in self.amostrar().items():
+            alvo = self.calcular_alvo(fila, amostra)
+            delta = alvo - amostra["processos"]
+            logger.info(
+                f"[Autoscaler] {fila}: profundidade={amostra['profundidade']} idade={amostra['idade']} "
+                f"duração média={amostra['duracao_media']} processos={amostra['processos']} "
+                f"ativos={amostra['ativos']} alvo={alvo}"
+            )
+            ajustaveis = sorted(w for w, info in amostra["workers"].items() if info["ajustavel"])
+            if delta == 0 or not ajustaveis:
+                continue
+
+            # Reparte o ajuste entre os workers da fila (o primeiro recebe o resto da divisão)
+            passo, resto = divmod(abs(delta), len(ajustaveis))
+            for indice, worker in enumerate(ajustaveis):
+                quantidade = passo + (1 if indice < resto else 0)
+                if delta < 0:
+                    # Não reduz um worker abaixo de 1 processo
+                    quantidade = min(quantidade, amostra["workers"][worker]["processos"] - 1)
+                if quantidade <= 0:
+                    continue
+                comando = "pool_grow" if delta > 0 else "pool_shrink"
+                acoes.append(f"{comando}({quantidade}) em {worker} ({fila})")
+                if self.dry_run:
+                    continue
+                try:
+                    getattr(self.app.control, comando)(quantidade, destination=[worker])
+                except Exception as e:
+                    logger.error(f"[Autoscaler] Falha em {comando} para {worker}: {e}")
+        return acoes
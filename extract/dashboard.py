@@ -614,7 +614,7 @@ def process_pdfs_and_send_to_api(uploaded_pdfs: list) -> tuple[bool, str]:
         polling_attempts = 0
         max_polling_attempts = 60 # 60 * 5 segundos = 5 minutos de espera max
         
-        while status in ["PENDING", "STARTED", "RETRY"] and polling_attempts < max_polling_attempts:
+        while status in ["PENDING", "STARTED", "RETRY", "PROGRESS"] and polling_attempts < max_polling_attempts:
             status_placeholder.info(f"Status da tarefa {task_id}: **{status}**. Tentativa {polling_attempts + 1}/{max_polling_attempts}")
             time.sleep(5) # Espera 5 segundos
             polling_attempts += 1
@@ -711,6 +711,26 @@ def get_zip_from_backend(task_id: str):
         return None
 
 
+# --- FUNÇÃO PARA BUSCAR OS XMLs DE UMA TAREFA (paginado) ---
+def fetch_task_xmls(task_id: str, page_size: int = 50) -> dict:
+    """
+    Busca os XMLs gerados por uma tarefa no endpoint paginado /task-files/<task_id>/.
+    Retorna {nome_arquivo: xml} (para arquivos com erro, o XML de erro).
+    """
+    xmls = {}
+    page = 1
+    while True:
+        data = call_django_backend(f"/task-files/{task_id}/?page={page}&page_size={page_size}", method="GET")
+        if not data:
+            break
+        for arquivo in data.get("arquivos", []):
+            xmls[arquivo["nome_arquivo"]] = arquivo.get("xml") or ""
+        if page >= data.get("num_pages", 1):
+            break
+        page += 1
+    return xmls
+
+
 # --- Função para enviar XML para a API via Backend Django ---
 def send_xml_via_django_backend(xml_content: str, file_name: str) -> tuple[str, str]:
     """
@@ -1012,7 +1032,8 @@ with tab2:
                 st.success("✅ Processamento concluído com sucesso!")
                 
                 meta = status_response.get("meta", {})
-                arquivos_resultado = meta.get("arquivos_resultado", {})
+                # O status traz só as referências; os XMLs vêm do endpoint paginado
+                arquivos_resultado = meta.get("arquivos_resultado") or fetch_task_xmls(task_id)
                 zip_id = meta.get("zip_id")
                 erros = meta.get("erros", [])
                 
@@ -1061,6 +1082,31 @@ with tab2:
                 # Limpa o status da tarefa
                 del st.session_state.task_status
                 
+            elif state == "PROGRESS":
+                meta = status_response.get("meta", {})
+                processados = meta.get("processed_files", 0)
+                total = meta.get("total_files", 0) or 1
+                st.progress(min(processados / total, 1.0))
+
+                eta = meta.get("eta_segundos")
+                texto_eta = f" - restam ~{int(eta) // 60}min {int(eta) % 60}s" if eta is not None else ""
+                st.info(f"⏳ {processados}/{meta.get('total_files', 0)} arquivo(s) processado(s){texto_eta}")
+                if meta.get("arquivo_atual"):
+                    st.caption(f"Arquivo atual: {meta['arquivo_atual']}")
+                if meta.get("latencia_media"):
+                    st.caption(f"Tempo médio por arquivo: {meta['latencia_media']}s")
+
+                # Últimos arquivos concluídos, com o motivo das falhas
+                for item in meta.get("ultimos_arquivos", []):
+                    if item.get("status") == "ERRO":
+                        st.write(f"❌ {item.get('arquivo')}: {item.get('erro')}")
+                    elif item.get("reaproveitado"):
+                        st.write(f"♻️ {item.get('arquivo')} (reaproveitado do checkpoint)")
+                    else:
+                        st.write(f"✅ {item.get('arquivo')} ({item.get('duracao')}s)")
+
+                time.sleep(2)
+                st.rerun()
             elif state in ["PENDING", "STARTED"]:
                 st.info(f"⏳ Status: {state} - Processando arquivos...")
                 time.sleep(2)
@@ -0,0 +1,203 @@
+import hashlib
+import logging
+import math
+import random
+import threading
+import time
+from concurrent import futures
+from typing import Dict, List, Optional
+
+import grpc
+from google.cloud import documentai_v1 as documentai
+
+
+logger = logging.getLogger(__name__)
+
+
+SERVICO = "google.cloud.documentai.v1.DocumentProcessorService"
+
+# Entidades no formato do processador customizado (tipos usados por mapear_campos),
+# com os valores das notas de exemplo abrasf_1_0.xml e bluepay.xml
+AMOSTRAS: List[Dict[str, str]] = [
+    {
+        "numero-nota-fiscal": "201690000000011",
+        "cod_verificacao": "sBMEvhYG",
+        "data_da_emissao": "06/10/2016 14:04:30",
+        "prefeitura_nota": "PREFEITURA MUNICIPAL DE SETE LAGOAS",
+        "cpf_cnpj_prestador": "18.747.794/0001-17",
+        "inscricao_municipal_prestador": "204266",
+        "razao_social_prestador": "R&W TESTE LTDA",
+        "nome_fantasia": "r&w TESTE",
+        "endereco_prestador": "Rua ALBERTO BARBOSA DA SILVA(ANTIGA RUA 21)",
+        "numero_lograd_prestador": "66",
+        "bairro_prestador": "TESTE",
+        "cep_prestador": "33925-430",
+        "municipio_prestador": "Sete Lagoas",
+        "uf_prestador": "MG",
+        "telefone_prestador": "(00)0000-3131",
+        "email_prestador": "teste@teste.com.br",
+        "cpf_cnpj_tomador": "17.245.986/0001-62",
+        "razao_social_tomador": "TOMADOR TESTE",
+        "endereco_tomador": "Estrada de Acesso a Colonia Maria Custodia",
+        "numero_lograd_tomador": "150",
+        "bairro_tomador": "Distrito Indl Simao da Cunha",
+        "cep_tomador": "33010-970",
+        "municipio_tomador": "Sabará",
+        "uf_tomador": "MG",
+        "telefone_tomador": "(31)2105-6237",
+        "valor_servico": "R$ 12.456,88",
+        "base_calculo": "R$ 12.456,88",
+        "aliquota": "2,00",
+        "iss": "R$ 249,14",
+        "imposto_renda": "R$ 186,85",
+        "valor_liquido": "R$ 12.270,03",
+        "deducoes": "R$ 0,00",
+        "item_lista_servico": "10.09",
+        "cnae": "4619200",
+        "discriminacao": "Comissão referente à prestação de serviço no mês",
+        "exigibilidade_iss": "1",
+        "simples_nacional": "Não",
+    },
+    {
+        "numero-nota-fiscal": "87041",
+        "cod_verificacao": "C40TMBKCV",
+        "data_da_emissao": "01/08/2025 14:57:00",
+        "prefeitura_nota": "PREFEITURA MUNICIPAL DE SANTOS",
+        "cpf_cnpj_prestador": "41.356.863/0001-83",
+        "razao_social_prestador": "BLUE PAY SOLUTIONS LTDA",
+        "endereco_prestador": "AVENIDA CONSELHEIRO NEBIAS",
+        "numero_lograd_prestador": "444",
+        "bairro_prestador": "ENCRUZILHADA",
+        "cep_prestador": "11045-000",
+        "municipio_prestador": "Santos",
+        "uf_prestador": "SP",
+        "telefone_prestador": "(31) 3197-5030",
+        "cpf_cnpj_tomador": "13.029.909/0001-14",
+        "razao_social_tomador": "IT'S Soluções LTDA",
+        "endereco_tomador": "R ARGEMIRO AGUILAR",
+        "numero_lograd_tomador": "498",
+        "bairro_tomador": "CENTRO",
+        "cep_tomador": "39900-000",
+        "municipio_tomador": "Almenara",
+        "uf_tomador": "MG",
+        "telefone_tomador": "(31) 3197-5030",
+        "email_tomador": "MARCILIO@CREDFRANCO.COM.BR",
+        "valor_servico": "R$ 1.862,64",
+        "base_calculo": "R$ 1.862,64",
+        "aliquota": "3,0",
+        "iss": "R$ 55,88",
+        "pis": "R$ 0,00",
+        "cofins": "R$ 0,00",
+        "inss": "R$ 0,00",
+        "csll": "R$ 0,00",
+        "imposto_renda": "R$ 0,00",
+        "valor_liquido": "R$ 1.862,64",
+        "item_lista_servico": "17.19",
+        "discriminacao": "Gerenciamento de pagamento conforme campanha de incentivo 2025.",
+        "exigibilidade_iss": "1",
+    },
+]
+
+
+class DocumentAIStandIn:
+    """
+    Substituto local do DocumentProcessorService do DocumentAI para testes de carga.
+    Responde ProcessDocument com entidades realistas (escolhidas pelo hash do PDF, então o
+    mesmo arquivo recebe sempre a mesma nota) depois de uma latência sorteada, e injeta
+    erros INTERNAL/UNAVAILABLE e RESOURCE_EXHAUSTED nas taxas configuradas.
+    Com qps > 0 também simula a cota do projeto: o excedente recebe RESOURCE_EXHAUSTED.
+    """
+
+    def __init__(self, latencia_ms: float = 1500, desvio_ms: float = 500, distribuicao: str = "lognormal",
+                 taxa_erro: float = 0.0, taxa_quota: float = 0.0, qps: float = 0.0, semente: Optional[int] = None):
+        self.latencia_ms = latencia_ms
+        self.desvio_ms = desvio_ms
+        self.distribuicao = distribuicao
+        self.taxa_erro = taxa_erro
+        self.taxa_quota = taxa_quota
+        self.qps = qps
+        self._random = random.Random(semente)
+        self._lock = threading.Lock()
+        self._tokens = qps
+        self._ultimo_abastecimento = time.monotonic()
+        self.contadores = {"requisicoes": 0, "sucesso": 0, "erros": 0, "quota": 0}
+
+    def sortear_latencia(self) -> float:
+        """Latência em segundos conforme a distribuição configurada (fixa, normal ou lognormal)."""
+        with self._lock:
+            if self.distribuicao == "fixa" or self.desvio_ms <= 0:
+                latencia = self.latencia_ms
+            elif self.distribuicao == "normal":
+                latencia = self._random.gauss(self.latencia_ms, self.desvio_ms)
+            else:
+                # Lognormal com a média e o desvio pedidos: cauda longa como a da API real
+                sigma2 = math.log(1 + (self.desvio_ms / self.latencia_ms) ** 2)
+                mu = math.log(self.latencia_ms) - sigma2 / 2
+                latencia = self._random.lognormvariate(mu, math.sqrt(sigma2))
+        return max(0.0, latencia) / 1000
+
+    def _consumir_cota(self) -> bool:
+        """Token bucket local de `qps` requisições por segundo (burst de 1 segundo)."""
+        if self.qps <= 0:
+            return True
+        with self._lock:
+            agora = time.monotonic()
+            self._tokens = min(self.qps, self._tokens + (agora - self._ultimo_abastecimento) * self.qps)
+            self._ultimo_abastecimento = agora
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _contar(self, chave: str):
+        with self._lock:
+            self.contadores[chave] += 1
+
+    @staticmethod
+    def montar_documento(conteudo: bytes) -> documentai.Document:
+        """Escolhe a amostra pelo hash do PDF e varia o número da nota para não colidir no cache."""
+        digest = hashlib.sha256(conteudo or b"").hexdigest()
+        amostra = dict(AMOSTRAS[int(digest[:8], 16) % len(AMOSTRAS)])
+        amostra["numero-nota-fiscal"] = str(int(digest[8:16], 16) % 1000000)
+
+        entidades = []
+        for tipo, valor in amostra.items():
+            entidade = documentai.Document.Entity(type_=tipo, mention_text=valor, confidence=0.98)
+            if tipo == "data_da_emissao":
+                entidade.normalized_value = documentai.Document.Entity.NormalizedValue(text=valor)
+            entidades.append(entidade)
+        return documentai.Document(mime_type="application/pdf", entities=entidades)
+
+    def process_document(self, request: documentai.ProcessRequest, context) -> documentai.ProcessResponse:
+        self._contar("requisicoes")
+
+        if not self._consumir_cota() or self._random.random() < self.taxa_quota:
+            self._contar("quota")
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Quota exceeded for ProcessDocument requests (stand-in)")
+
+        time.sleep(self.sortear_latencia())
+
+        if self._random.random() < self.taxa_erro:
+            self._contar("erros")
+            codigo = self._random.choice([grpc.StatusCode.INTERNAL, grpc.StatusCode.UNAVAILABLE])
+            context.abort(codigo, "Injected failure (stand-in)")
+
+        self._contar("sucesso")
+        return documentai.ProcessResponse(document=self.montar_documento(request.raw_document.content))
+
+    def criar_servidor(self, endereco: str, threads: int) -> grpc.Server:
+        """Servidor gRPC sem TLS com o método ProcessDocument registrado por handler genérico."""
+        handler = grpc.method_handlers_generic_handler(SERVICO, {
+            "ProcessDocument": grpc.unary_unary_rpc_method_handler(
+                self.process_document,
+                request_deserializer=documentai.ProcessRequest.deserialize,
+                response_serializer=documentai.ProcessResponse.serialize,
+            ),
+        })
+        servidor = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=threads),
+            options=[("grpc.max_receive_message_length", -1)],
+        )
+        servidor.add_generic_rpc_handlers((handler,))
+        servidor.add_insecure_port(endereco)
+        return servidor
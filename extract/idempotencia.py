@@ -0,0 +1,118 @@
+import hashlib
+import json
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+from celery.result import AsyncResult
+from django.conf import settings
+
+from .models import TaskStatusModel
+from .redis_service import get_redis_client
+
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotenciaEnvio:
+    """
+    Deduplica envios ao UploadEProcessarPDFView.
+    A chave vem do cabeçalho Idempotency-Key ou é derivada do usuário e do SHA-256 de cada PDF,
+    e é reservada no Redis com SET NX: um reenvio (ex.: timeout do dashboard seguido de nova
+    tentativa) recebe a tarefa já criada em vez de novo upload, nova tarefa e nova cobrança.
+    Se essa tarefa terminou em erro, a chave é liberada e o reenvio vira um envio novo.
+    Se o Redis estiver indisponível, não bloqueia o envio (falha aberta).
+    """
+
+    PREFIXO = "idempotencia:upload"
+    PENDENTE = "PENDENTE"
+
+    # Só apaga a chave se ela ainda aponta para a tarefa que falhou (outro reenvio pode tê-la reservado)
+    SCRIPT_LIBERAR_SE_IGUAL = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    @staticmethod
+    def calcular_chave(user_id: int, arquivos: Iterable, chave_cliente: Optional[str] = None,
+                       merge: bool = False) -> str:
+        """
+        Chave do envio. Os arquivos são lidos em blocos e voltam para o início,
+        prontos para o upload.
+        """
+        if chave_cliente:
+            return f"{user_id}:cliente:{chave_cliente}"
+
+        hashes = []
+        for arquivo in arquivos:
+            sha = hashlib.sha256()
+            for bloco in arquivo.chunks():
+                sha.update(bloco)
+            arquivo.seek(0)
+            hashes.append(sha.hexdigest())
+
+        # A ordem dos arquivos não muda o lote
+        conteudo = f"{user_id}|{int(merge)}|{'|'.join(sorted(hashes))}"
+        return f"{user_id}:{hashlib.sha256(conteudo.encode()).hexdigest()}"
+
+    @classmethod
+    def reservar(cls, chave: str) -> Tuple[bool, Optional[Dict]]:
+        """
+        Reserva a chave para este envio.
+        :return: (True, None) se o envio é novo; (False, dados) para duplicatas, com os dados
+                 da tarefa já criada ou None se o envio original ainda está em andamento
+        """
+        try:
+            cliente = get_redis_client()
+            if cliente.set(f"{cls.PREFIXO}:{chave}", cls.PENDENTE, nx=True,
+                           ex=settings.IDEMPOTENCIA_TTL_SEGUNDOS):
+                return True, None
+            valor = cliente.get(f"{cls.PREFIXO}:{chave}")
+        except Exception as e:
+            logger.warning(f"[Idempotência] Redis indisponível, seguindo sem deduplicação: {e}")
+            return True, None
+
+        if valor is None:
+            # A reserva expirou entre o SET e o GET: trata como envio novo
+            return cls.reservar(chave)
+        valor = valor.decode() if isinstance(valor, bytes) else valor
+        if valor == cls.PENDENTE:
+            return False, None
+
+        dados = json.loads(valor)
+        if cls._tarefa_falhou(dados.get("task_id")):
+            logger.info(f"[Idempotência] Tarefa {dados['task_id']} terminou em erro; reenvio tratado como novo")
+            try:
+                cliente.eval(cls.SCRIPT_LIBERAR_SE_IGUAL, 1, f"{cls.PREFIXO}:{chave}", valor)
+            except Exception as e:
+                logger.warning(f"[Idempotência] Não foi possível liberar a chave {chave}: {e}")
+                return True, None
+            return cls.reservar(chave)
+        return False, dados
+
+    @staticmethod
+    def _tarefa_falhou(task_id: Optional[str]) -> bool:
+        """Se a tarefa terminou em erro (ERRO no TaskStatusModel ou FAILURE no Celery, caso do merge)."""
+        if not task_id:
+            return False
+        if TaskStatusModel.objects.filter(task_id=task_id, status="ERRO").exists():
+            return True
+        return AsyncResult(task_id).state == "FAILURE"
+
+    @classmethod
+    def confirmar(cls, chave: str, dados: Dict):
+        """Associa a chave à tarefa criada, devolvida aos reenvios até IDEMPOTENCIA_TTL_SEGUNDOS."""
+        try:
+            get_redis_client().set(f"{cls.PREFIXO}:{chave}", json.dumps(dados),
+                                   ex=settings.IDEMPOTENCIA_TTL_SEGUNDOS)
+        except Exception as e:
+            logger.warning(f"[Idempotência] Não foi possível confirmar a chave {chave}: {e}")
+
+    @classmethod
+    def liberar(cls, chave: str):
+        """Remove a reserva de um envio que falhou, para que o cliente possa tentar de novo."""
+        try:
+            get_redis_client().delete(f"{cls.PREFIXO}:{chave}")
+        except Exception as e:
+            logger.warning(f"[Idempotência] Não foi possível liberar a chave {chave}: {e}")
@@ -0,0 +1,346 @@
+import logging
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import LayoutTemplate
+from .text_layer import (
+    CAMPOS_CRITICOS, CNPJ_CPF, DATA, SEPARADOR, VALOR,
+    TextLayerExtractor, normalizar_mantendo_posicoes,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Padrão do valor por tipo inferido das amostras
+PADROES_TIPO = {
+    "cnpj_cpf": CNPJ_CPF,
+    "data": DATA,
+    "valor": VALOR,
+    "numero": r"(\d[\d./\-]*)",
+}
+
+# Campos que não viram âncora: identificam o layout ou ocupam várias linhas
+CAMPOS_IGNORADOS = {"prefeituraNota", "Discriminacao"}
+
+TAMANHO_MAXIMO_ROTULO = 60
+
+
+def normalizar_prefeitura(valor: str) -> str:
+    """Chave do template: nome da prefeitura sem acentos, em maiúsculas e com espaços simples."""
+    return re.sub(r"\s+", " ", normalizar_mantendo_posicoes(valor or "")).strip()
+
+
+def inferir_tipo(valor: str) -> str:
+    """Classifica o valor extraído para escolher o padrão usado na extração local."""
+    for tipo, padrao in PADROES_TIPO.items():
+        if re.fullmatch(padrao, valor.strip()):
+            return tipo
+    return "texto"
+
+
+class LayoutTemplateStore:
+    """
+    Templates de layout por prefeitura, aprendidos a partir dos resultados do DocumentAI.
+
+    Para cada extração bem-sucedida do DocumentAI de um PDF com camada de texto, registra
+    onde cada campo de mapear_campos aparece no texto: o rótulo que o antecede, qual ocorrência
+    desse rótulo, se o valor está na mesma linha e o tipo do valor. Depois de
+    LAYOUT_TEMPLATE_MIN_AMOSTRAS amostras concordantes o template é ativado e os próximos
+    PDFs da mesma prefeitura são extraídos localmente. Um template que produz dados inválidos
+    em LAYOUT_TEMPLATE_MAX_FALHAS_CONSECUTIVAS arquivos seguidos é desativado, mas mantém as
+    âncoras: as próximas extrações do DocumentAI da prefeitura o reavaliam, e ele volta a ser
+    ativado se as âncoras reproduzirem LAYOUT_TEMPLATE_MIN_AMOSTRAS amostras, ou reaprende do
+    zero se o layout tiver mudado.
+    """
+
+    _lock = threading.Lock()
+    _ativos: Optional[List[Tuple[str, int, Dict]]] = None
+    _carregado_em = 0.0
+
+    # ------------------------------------------------------------------ aprendizado
+
+    @staticmethod
+    def _ocorrencias_antes(texto_normalizado: str, rotulo: str, limite: int) -> int:
+        """Quantas vezes o rótulo aparece antes da posição limite (mesma busca usada na extração)."""
+        total = 0
+        posicao = texto_normalizado.find(rotulo)
+        while 0 <= posicao < limite:
+            total += 1
+            posicao = texto_normalizado.find(rotulo, posicao + 1)
+        return total
+
+    @classmethod
+    def _localizar_ancoras(cls, texto_normalizado: str, valor: str) -> List[str]:
+        """
+        Procura o valor no texto e descreve as âncoras candidatas que levam até ele.
+        Cada sufixo do rótulo (em palavras) vira um candidato; na consolidação fica o que
+        se repete entre as amostras, descartando palavras que são valores de outros campos.
+        :return: chaves "rótulo|ocorrência|mesma_linha|tipo|terminador"
+        """
+        tokens = normalizar_mantendo_posicoes(valor).split()
+        if not tokens:
+            return []
+        match = re.search(r"(?<!\w)" + r"\s+".join(re.escape(t) for t in tokens) + r"(?!\w)", texto_normalizado)
+        if not match:
+            return []
+
+        inicio_linha = texto_normalizado.rfind("\n", 0, match.start()) + 1
+        fim_rotulo = len(texto_normalizado[:match.start()].rstrip(" \t:.-="))
+        mesma_linha = fim_rotulo > inicio_linha
+        if not mesma_linha:
+            # Valor no início da linha: o rótulo é o fim da linha anterior não vazia
+            fim_rotulo = len(texto_normalizado[:max(inicio_linha - 1, 0)].rstrip(" \t\n:.-="))
+            inicio_linha = texto_normalizado.rfind("\n", 0, fim_rotulo) + 1
+        trecho = texto_normalizado[inicio_linha:fim_rotulo]
+
+        tipo = inferir_tipo(valor)
+        terminador = ""
+        if tipo == "texto":
+            # Texto livre: guarda o que vem depois do valor na linha para saber onde ele termina
+            fim_linha = texto_normalizado.find("\n", match.end())
+            restante = texto_normalizado[match.end():fim_linha if fim_linha >= 0 else None]
+            terminador = " ".join(restante.split()[:1]).rstrip(":").replace("|", "")
+
+        chaves = []
+        for palavra in reversed(list(re.finditer(r"\S+", trecho))):
+            # Para em números (valores de outros campos) e no ':' do rótulo anterior
+            if re.search(r"\d", palavra.group()) or palavra.group().endswith(":") or "|" in palavra.group():
+                break
+            rotulo = trecho[palavra.start():]
+            if len(rotulo) > TAMANHO_MAXIMO_ROTULO:
+                break
+            ocorrencia = cls._ocorrencias_antes(texto_normalizado, rotulo, inicio_linha + palavra.start())
+            chaves.append(f"{rotulo}|{ocorrencia}|{int(mesma_linha)}|{tipo}|{terminador}")
+        return chaves
+
+    @classmethod
+    def _consolidar(cls, template: LayoutTemplate):
+        """Escolhe, por campo, a âncora observada em pelo menos LAYOUT_TEMPLATE_MIN_CONCORDANCIA das amostras."""
+        ancoras = {}
+        for campo, contagem in template.candidatos.items():
+            # Mais frequente; no empate, o rótulo mais longo (mais específico)
+            chave, vezes = max(contagem.items(), key=lambda item: (item[1], len(item[0].split("|")[0])))
+            if vezes / template.amostras < settings.LAYOUT_TEMPLATE_MIN_CONCORDANCIA:
+                continue
+            rotulo, ocorrencia, mesma_linha, tipo, terminador = chave.split("|")
+            ancoras[campo] = {
+                "rotulo": rotulo,
+                "ocorrencia": int(ocorrencia),
+                "mesma_linha": mesma_linha == "1",
+                "tipo": tipo,
+                "terminador": terminador,
+            }
+        template.ancoras = ancoras
+        template.ativo = all(campo in ancoras for campo in CAMPOS_CRITICOS)
+
+    @staticmethod
+    def _em_reavaliacao(template: LayoutTemplate) -> bool:
+        """Template desativado por falhas que ainda guarda as âncoras aprendidas."""
+        return (not template.ativo and bool(template.ancoras)
+                and template.falhas_consecutivas >= settings.LAYOUT_TEMPLATE_MAX_FALHAS_CONSECUTIVAS)
+
+    @classmethod
+    def _reproduz_amostra(cls, texto: str, texto_normalizado: str, ancoras: Dict, dados: Dict) -> bool:
+        """Se as âncoras extraem do texto os mesmos campos críticos que o DocumentAI."""
+        for campo in CAMPOS_CRITICOS:
+            esperado = dados.get(campo)
+            if campo not in ancoras or not isinstance(esperado, str):
+                return False
+            valor = cls._aplicar_ancora(texto, texto_normalizado, ancoras[campo])
+            if not valor or normalizar_prefeitura(valor) != normalizar_prefeitura(esperado):
+                return False
+        return True
+
+    @classmethod
+    def aprender(cls, texto: str, dados: Dict):
+        """
+        Registra uma extração bem-sucedida do DocumentAI como amostra do layout da prefeitura.
+        :param texto: camada de texto do PDF
+        :param dados: saída de mapear_campos para o mesmo PDF
+        """
+        prefeitura = normalizar_prefeitura(dados.get("prefeituraNota"))
+        if not prefeitura:
+            return
+
+        texto_normalizado = normalizar_mantendo_posicoes(texto)
+        observadas = {}
+        for campo, valor in dados.items():
+            if campo in CAMPOS_IGNORADOS or not isinstance(valor, str) or len(valor.strip()) < 2:
+                continue
+            chaves = cls._localizar_ancoras(texto_normalizado, valor)
+            if chaves:
+                observadas[campo] = chaves
+
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    template, _ = LayoutTemplate.objects.select_for_update().get_or_create(prefeitura=prefeitura[:255])
+            except IntegrityError:
+                # Outro worker criou o template da mesma prefeitura ao mesmo tempo
+                template = LayoutTemplate.objects.select_for_update().get(prefeitura=prefeitura[:255])
+            if template.ativo:
+                return
+
+            if cls._em_reavaliacao(template):
+                if cls._reproduz_amostra(texto, texto_normalizado, template.ancoras, dados):
+                    template.reavaliacoes += 1
+                    if template.reavaliacoes >= settings.LAYOUT_TEMPLATE_MIN_AMOSTRAS:
+                        template.ativo = True
+                        template.falhas_consecutivas = 0
+                        template.reavaliacoes = 0
+                    template.save()
+                    if template.ativo:
+                        cls._limpar_cache()
+                        logger.info(f"[LayoutTemplate] Template de '{prefeitura}' reativado após reavaliação")
+                    return
+
+                # As âncoras não reproduzem mais o DocumentAI: o layout mudou e o template reaprende
+                logger.warning(f"[LayoutTemplate] Layout de '{prefeitura}' mudou, reaprendendo o template")
+                template.ancoras = {}
+                template.candidatos = {}
+                template.amostras = 0
+                template.reavaliacoes = 0
+                template.falhas_consecutivas = 0
+
+            candidatos = template.candidatos or {}
+            for campo, chaves in observadas.items():
+                contagem = candidatos.setdefault(campo, {})
+                for chave in chaves:
+                    contagem[chave] = contagem.get(chave, 0) + 1
+            template.candidatos = candidatos
+            template.amostras += 1
+
+            if template.amostras >= settings.LAYOUT_TEMPLATE_MIN_AMOSTRAS:
+                cls._consolidar(template)
+            template.save()
+
+        if template.ativo:
+            cls._limpar_cache()
+            logger.info(f"[LayoutTemplate] Template ativado para '{prefeitura}' "
+                        f"com {len(template.ancoras)} campo(s) após {template.amostras} amostra(s)")
+
+    # ------------------------------------------------------------------ extração
+
+    @classmethod
+    def _limpar_cache(cls):
+        with cls._lock:
+            cls._ativos = None
+
+    @classmethod
+    def _templates_ativos(cls) -> List[Tuple[str, int, Dict]]:
+        """Templates ativos, mantidos em memória por LAYOUT_TEMPLATE_CACHE_SEGUNDOS."""
+        with cls._lock:
+            if cls._ativos is None or time.monotonic() - cls._carregado_em > settings.LAYOUT_TEMPLATE_CACHE_SEGUNDOS:
+                registros = LayoutTemplate.objects.filter(ativo=True).values_list("prefeitura", "id", "ancoras")
+                # Nomes mais longos primeiro: "SANTOS" não deve casar com o template de "SANTO"
+                cls._ativos = sorted(registros, key=lambda r: len(r[0]), reverse=True)
+                cls._carregado_em = time.monotonic()
+            return cls._ativos
+
+    @staticmethod
+    def _aplicar_ancora(texto: str, texto_normalizado: str, ancora: Dict) -> Optional[str]:
+        """Localiza a N-ésima ocorrência do rótulo e lê o valor logo após (ou na linha seguinte)."""
+        posicao = -1
+        for _ in range(ancora["ocorrencia"] + 1):
+            posicao = texto_normalizado.find(ancora["rotulo"], posicao + 1)
+            if posicao < 0:
+                return None
+        inicio = posicao + len(ancora["rotulo"])
+
+        if ancora["tipo"] != "texto":
+            padrao_valor = PADROES_TIPO[ancora["tipo"]]
+        elif ancora["terminador"]:
+            padrao_valor = rf"([^\n]+?)(?=\s*{re.escape(ancora['terminador'])})"
+        else:
+            padrao_valor = r"([^\n]+)"
+
+        if ancora["mesma_linha"]:
+            padrao = re.compile(f"{SEPARADOR}{padrao_valor}")
+        else:
+            fim_linha = texto_normalizado.find("\n", inicio)
+            if fim_linha < 0:
+                return None
+            inicio = fim_linha + 1
+            padrao = re.compile(rf"[ \t]*{padrao_valor}")
+
+        match = padrao.match(texto_normalizado, inicio)
+        if not match:
+            return None
+        return texto[match.start(1):match.end(1)].strip() or None
+
+    @staticmethod
+    def _cabecalho(texto_normalizado: str) -> str:
+        """Primeiras LAYOUT_TEMPLATE_CABECALHO_LINHAS linhas não vazias, onde fica o emissor da nota."""
+        linhas = [linha for linha in texto_normalizado.splitlines() if linha.strip()]
+        return re.sub(r"\s+", " ", " ".join(linhas[:settings.LAYOUT_TEMPLATE_CABECALHO_LINHAS]))
+
+    @classmethod
+    def extrair(cls, texto: str) -> Tuple[Optional[Dict], Optional[int], float]:
+        """
+        Extrai a nota com o template da prefeitura cujo nome aparece no cabeçalho do texto.
+        Menções à prefeitura no corpo (ex.: discriminação do serviço) não selecionam o template.
+        :return: (dados, id do template, confiança); dados é None se nenhum template se aplica
+        """
+        texto_normalizado = normalizar_mantendo_posicoes(texto)
+        cabecalho = cls._cabecalho(texto_normalizado)
+
+        for prefeitura, template_id, ancoras in cls._templates_ativos():
+            if not re.search(rf"(?<!\w){re.escape(prefeitura)}(?!\w)", cabecalho):
+                continue
+
+            dados = {"prefeituraNota": prefeitura}
+            for campo, ancora in ancoras.items():
+                valor = cls._aplicar_ancora(texto, texto_normalizado, ancora)
+                if valor:
+                    dados[campo] = valor
+
+            discriminacao = TextLayerExtractor._discriminacao(texto, texto_normalizado)
+            if discriminacao:
+                dados["Discriminacao"] = discriminacao
+
+            confianca = TextLayerExtractor.calcular_confianca(dados)
+            logger.info(f"[LayoutTemplate] Template '{prefeitura}': {len(dados)} campo(s), confiança {confianca:.2f}")
+            return dados, template_id, confianca
+
+        return None, None, 0.0
+
+    @classmethod
+    def registrar_uso(cls, template_id: int):
+        LayoutTemplate.objects.filter(pk=template_id).update(usos=F("usos") + 1, falhas_consecutivas=0)
+
+    @classmethod
+    def registrar_falha(cls, template_id: int, motivo: str):
+        """
+        Conta uma extração com confiança insuficiente. O template só é desativado depois de
+        LAYOUT_TEMPLATE_MAX_FALHAS_CONSECUTIVAS falhas seguidas, e as âncoras são mantidas
+        para a reavaliação com as próximas extrações do DocumentAI.
+        """
+        with transaction.atomic():
+            template = LayoutTemplate.objects.select_for_update().filter(pk=template_id).first()
+            if template is None:
+                return
+            template.falhas += 1
+            template.falhas_consecutivas += 1
+            template.motivo_invalidacao = motivo
+            desativado = (template.ativo
+                          and template.falhas_consecutivas >= settings.LAYOUT_TEMPLATE_MAX_FALHAS_CONSECUTIVAS)
+            if desativado:
+                template.ativo = False
+                template.reavaliacoes = 0
+            template.save(update_fields=["falhas", "falhas_consecutivas", "motivo_invalidacao", "ativo",
+                                         "reavaliacoes", "updated_at"])
+
+        if desativado:
+            cls._limpar_cache()
+            logger.warning(f"[LayoutTemplate] Template {template_id} desativado após "
+                           f"{template.falhas_consecutivas} falha(s) seguida(s): {motivo}")
+        else:
+            logger.info(f"[LayoutTemplate] Falha do template {template_id} "
+                        f"({template.falhas_consecutivas} seguida(s)): {motivo}")
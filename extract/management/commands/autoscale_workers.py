@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from extract.autoscaler import CeleryAutoscaler
+from nfse_abrasf.celery_config import app
+
+
+class Command(BaseCommand):
+    help = 'Ajusta o tamanho dos pools dos workers Celery conforme profundidade, idade e duração das filas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=None,
+                            help='segundos entre as amostras (padrão: AUTOSCALER_INTERVALO)')
+        parser.add_argument('--uma-vez', action='store_true', help='executa um único ciclo e sai')
+        parser.add_argument('--dry-run', action='store_true', help='apenas mostra os ajustes, sem aplicá-los')
+
+    def handle(self, *args, **options):
+        from django.conf import settings
+
+        intervalo = options['intervalo'] or settings.AUTOSCALER_INTERVALO
+        autoscaler = CeleryAutoscaler(app, dry_run=options['dry_run'])
+        self.stdout.write(self.style.SUCCESS(f"Autoscaler das filas {list(autoscaler.limites)} a cada {intervalo}s"))
+
+        while True:
+            try:
+                acoes = autoscaler.ajustar()
+                for acao in acoes:
+                    self.stdout.write(f"{'[dry-run] ' if options['dry_run'] else ''}{acao}")
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"Erro no ciclo do autoscaler: {e}"))
+
+            if options['uma_vez']:
+                break
+            time.sleep(intervalo)
+
+
+# Comando para rodar o autoscaler dos workers (processo contínuo, ex.: no Procfile):
+# python manage.py autoscale_workers --dry-run --uma-vez
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from extract.documentai_standin import DocumentAIStandIn
+
+
+class Command(BaseCommand):
+    help = 'Sobe um servidor gRPC local que imita o DocumentAI (ProcessDocument) para testes de carga'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endereco', default='0.0.0.0:50051', help='host:porta do servidor')
+        parser.add_argument('--threads', type=int, default=64, help='requisições atendidas em paralelo')
+        parser.add_argument('--latencia-ms', type=float, default=1500, help='latência média por documento')
+        parser.add_argument('--desvio-ms', type=float, default=500, help='desvio padrão da latência')
+        parser.add_argument('--distribuicao', choices=['lognormal', 'normal', 'fixa'], default='lognormal')
+        parser.add_argument('--taxa-erro', type=float, default=0.0, help='fração de respostas INTERNAL/UNAVAILABLE')
+        parser.add_argument('--taxa-quota', type=float, default=0.0, help='fração de respostas RESOURCE_EXHAUSTED')
+        parser.add_argument('--qps', type=float, default=0.0, help='cota simulada em requisições/segundo (0 = sem cota)')
+        parser.add_argument('--semente', type=int, default=None, help='semente dos sorteios, para execuções reproduzíveis')
+
+    def handle(self, *args, **options):
+        standin = DocumentAIStandIn(
+            latencia_ms=options['latencia_ms'],
+            desvio_ms=options['desvio_ms'],
+            distribuicao=options['distribuicao'],
+            taxa_erro=options['taxa_erro'],
+            taxa_quota=options['taxa_quota'],
+            qps=options['qps'],
+            semente=options['semente'],
+        )
+        servidor = standin.criar_servidor(options['endereco'], options['threads'])
+        servidor.start()
+
+        self.stdout.write(self.style.SUCCESS(f"Stand-in do DocumentAI ouvindo em {options['endereco']}"))
+        self.stdout.write("Aponte os workers para ele com DOCUMENTAI_API_ENDPOINT=<host:porta> e DOCUMENTAI_INSECURE=True")
+
+        try:
+            while True:
+                time.sleep(10)
+                self.stdout.write(f"Contadores: {standin.contadores}")
+        except KeyboardInterrupt:
+            servidor.stop(grace=5)
+            self.stdout.write(self.style.WARNING(f"Servidor encerrado. Contadores finais: {standin.contadores}"))
+
+
+# Comando para subir o stand-in do DocumentAI:
+# python manage.py documentai_standin --latencia-ms 2000 --taxa-erro 0.02 --qps 10
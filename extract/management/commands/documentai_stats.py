@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from extract.ocr_cache import DocumentAICache, OCRSingleFlight
+from extract.rate_limiter import DocumentAIRateLimiter
+from extract.pdf_preflight import PDFPreflight
+
+
+class Command(BaseCommand):
+    help = 'Exibe as métricas do cache de resultados, do rate limiter e do preflight do DocumentAI'
+
+    def handle(self, *args, **options):
+        stats = DocumentAICache.estatisticas()
+
+        self.stdout.write(self.style.SUCCESS("Cache do DocumentAI:"))
+        self.stdout.write(f" - Hits: {stats['hits']}")
+        self.stdout.write(f" - Misses: {stats['misses']}")
+        self.stdout.write(f" - Taxa de acerto: {stats['hit_rate']:.1%}")
+        self.stdout.write(f" - Entradas: {stats['entradas']} / {stats['max_entradas']} (TTL {stats['ttl_dias']} dias)")
+        self.stdout.write(f" - Extrações compartilhadas entre jobs (single-flight): {OCRSingleFlight.compartilhados()}")
+
+        metricas = DocumentAIRateLimiter.metricas()
+
+        self.stdout.write(self.style.SUCCESS(f"Rate limiter do DocumentAI ({metricas['qps']} QPS, burst {metricas['burst']}):"))
+        self.stdout.write(f" - Esperas pela cota: {metricas['esperas_limiter']} ({metricas['espera_limiter_segundos']:.1f}s no total)")
+        self.stdout.write(f" - Erros RESOURCE_EXHAUSTED/UNAVAILABLE: {metricas['erros_quota']} ({metricas['backoff_segundos']:.1f}s em backoff)")
+
+        preflight = PDFPreflight.estatisticas()
+
+        self.stdout.write(self.style.SUCCESS("Preflight dos PDFs enviados ao OCR:"))
+        self.stdout.write(f" - Arquivos reduzidos: {preflight['arquivos']}")
+        self.stdout.write(f" - Bytes economizados: {preflight['bytes_economizados'] / (1024 * 1024):.1f} MB")
+
+
+# Comando para consultar as métricas do DocumentAI:
+# python manage.py documentai_stats
@@ -0,0 +1,63 @@
+import io
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from extract.minio_service import upload_result_archive
+from extract.models import ArquivoZip
+
+
+class Command(BaseCommand):
+    help = 'Move os ZIPs antigos do campo zip_bytes (Postgres) para o bucket, em lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=100, help='registros por lote')
+        parser.add_argument('--limite', type=int, default=None, help='máximo de registros migrados nesta execução')
+        parser.add_argument('--dry-run', action='store_true', help='apenas conta os registros pendentes')
+
+    def handle(self, *args, **options):
+        pendentes = ArquivoZip.objects.filter(s3_key__isnull=True, zip_bytes__isnull=False)
+        total = pendentes.count()
+        self.stdout.write(f"{total} ZIP(s) pendente(s) de migração")
+        if options['dry_run'] or not total:
+            return
+
+        limite = options['limite'] or total
+        migrados = 0
+        falhas = []
+
+        while migrados + len(falhas) < limite:
+            # Só os ids: os blobs são carregados um a um
+            tamanho_lote = min(options['lote'], limite - migrados - len(falhas))
+            ids = list(
+                pendentes.exclude(id__in=falhas)
+                .order_by('criado_em')
+                .values_list('id', flat=True)[:tamanho_lote]
+            )
+            if not ids:
+                break
+
+            for zip_id in ids:
+                registro = ArquivoZip.objects.only('id', 'nome_arquivo', 'zip_bytes').get(id=zip_id)
+                nome = registro.nome_arquivo or f"{zip_id}.zip"
+                s3_key = f"{settings.RESULTADOS_S3_PREFIXO}/{zip_id}_{nome}"
+                try:
+                    tamanho, checksum = upload_result_archive(io.BytesIO(bytes(registro.zip_bytes)), s3_key)
+                except Exception as e:
+                    falhas.append(zip_id)
+                    self.stderr.write(self.style.ERROR(f"Falha ao migrar {zip_id}: {e}"))
+                    continue
+
+                # Libera o blob do banco só depois que o objeto está no bucket
+                ArquivoZip.objects.filter(id=zip_id).update(
+                    s3_key=s3_key, tamanho=tamanho, checksum=checksum, zip_bytes=None
+                )
+                migrados += 1
+
+            self.stdout.write(f" - {migrados} migrado(s), {len(falhas)} falha(s)")
+
+        self.stdout.write(self.style.SUCCESS(f"Migração concluída: {migrados} migrado(s), {len(falhas)} falha(s)"))
+
+
+# Comando para migrar os ZIPs antigos (rode até não restar pendentes):
+# python manage.py migrar_zips_para_s3 --lote 100
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-16 18:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('extract', '0013_filesproccess'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filesproccess',
+            name='acessos',
+            field=models.IntegerField(default=0, help_text='Número de vezes que o cache foi aproveitado'),
+        ),
+        migrations.AddField(
+            model_name='filesproccess',
+            name='dados_extraidos',
+            field=models.JSONField(blank=True, help_text='Saída de mapear_campos para este PDF', null=True),
+        ),
+        migrations.AddField(
+            model_name='filesproccess',
+            name='ultimo_acesso',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text='Último uso do resultado em cache'),
+        ),
+    ]
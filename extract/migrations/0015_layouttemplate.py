@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-16 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('extract', '0014_filesproccess_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LayoutTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefeitura', models.CharField(help_text='Texto normalizado da entidade prefeitura_nota', max_length=255, unique=True)),
+                ('ancoras', models.JSONField(default=dict, help_text='Âncoras consolidadas: campo -> rótulo, ocorrência e tipo do valor')),
+                ('candidatos', models.JSONField(default=dict, help_text='Contagem das âncoras observadas em cada amostra')),
+                ('amostras', models.IntegerField(default=0, help_text='Extrações do DocumentAI usadas no aprendizado')),
+                ('ativo', models.BooleanField(db_index=True, default=False, help_text='Se o template já pode substituir o DocumentAI')),
+                ('usos', models.IntegerField(default=0, help_text='Arquivos extraídos localmente com este template')),
+                ('falhas', models.IntegerField(default=0, help_text='Número de invalidações do template')),
+                ('motivo_invalidacao', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Template de Layout',
+                'verbose_name_plural': 'Templates de Layout',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-16 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('extract', '0015_layouttemplate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='arquivozip',
+            name='checksum',
+            field=models.CharField(blank=True, help_text='SHA-256 do ZIP', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='arquivozip',
+            name='s3_key',
+            field=models.CharField(blank=True, help_text='Chave do ZIP no bucket', max_length=512, null=True),
+        ),
+        migrations.AddField(
+            model_name='arquivozip',
+            name='tamanho',
+            field=models.BigIntegerField(blank=True, help_text='Tamanho do ZIP em bytes', null=True),
+        ),
+    ]
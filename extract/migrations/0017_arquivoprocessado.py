@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-16 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('extract', '0016_arquivozip_s3'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArquivoProcessado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(db_index=True, help_text='ID da tarefa processar_pdfs', max_length=100)),
+                ('chave_arquivo', models.CharField(help_text='Chave do PDF no bucket', max_length=512)),
+                ('nome_arquivo', models.CharField(help_text='Nome do PDF enviado', max_length=255)),
+                ('status', models.CharField(choices=[('SUCESSO', 'Sucesso'), ('ERRO', 'Erro')], help_text='Resultado do processamento do arquivo', max_length=20)),
+                ('xml', models.TextField(blank=True, help_text='XML ABRASF gerado', null=True)),
+                ('erro', models.TextField(blank=True, help_text='Motivo da falha, se houver', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Arquivo Processado',
+                'verbose_name_plural': 'Arquivos Processados',
+                'ordering': ['id'],
+                'unique_together': {('task_id', 'chave_arquivo')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-16 21:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('extract', '0017_arquivoprocessado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='arquivoprocessado',
+            name='tentativas',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Tentativas usadas para processar o arquivo'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('extract', '0018_arquivoprocessado_tentativas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='arquivoprocessado',
+            name='erros_validacao',
+            field=models.JSONField(blank=True, help_text='Erros da validação XSD', null=True),
+        ),
+        migrations.AddField(
+            model_name='arquivoprocessado',
+            name='xml_valido',
+            field=models.BooleanField(blank=True, help_text='XML válido no XSD do ABRASF (vazio se não validado)', null=True),
+        ),
+    ]
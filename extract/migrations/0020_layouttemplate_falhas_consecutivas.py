@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-16 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('extract', '0019_arquivoprocessado_validacao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='layouttemplate',
+            name='falhas_consecutivas',
+            field=models.IntegerField(default=0, help_text='Falhas desde o último uso bem-sucedido'),
+        ),
+        migrations.AddField(
+            model_name='layouttemplate',
+            name='reavaliacoes',
+            field=models.IntegerField(default=0, help_text='Amostras do DocumentAI reproduzidas pelas âncoras desde a desativação'),
+        ),
+        migrations.AlterField(
+            model_name='layouttemplate',
+            name='falhas',
+            field=models.IntegerField(default=0, help_text='Extrações com confiança abaixo do mínimo'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-16 23:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('extract', '0020_layouttemplate_falhas_consecutivas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='arquivoprocessado',
+            name='reprocessado_em',
+            field=models.CharField(blank=True, help_text='ID da tarefa que reprocessou a falha', max_length=100, null=True),
+        ),
+    ]
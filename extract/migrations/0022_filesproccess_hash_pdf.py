@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-17 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('extract', '0021_arquivoprocessado_reprocessado_em'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filesproccess',
+            name='hash_pdf',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-256 dos bytes do PDF', max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name='filesproccess',
+            name='hash',
+            field=models.CharField(help_text='Chave do cache: SHA-256 do PDF, processador e opções do DocumentAI', max_length=64, unique=True),
+        ),
+    ]
@@ -1,3 +1,4 @@
+import hashlib
 import boto3
 from django.conf import settings
 from django.utils.timezone import now
@@ -6,8 +7,10 @@ from django.utils.timezone import now
 def get_s3_client():
     """
     Cria um cliente MinIO usando as configurações do Django.
+    Usa uma sessão própria porque a sessão padrão do boto3 não é thread-safe
+    (processar_pdfs baixa arquivos em paralelo).
     """
-    return boto3.client(
+    return boto3.session.Session().client(
         's3',
         aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
         aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
@@ -72,10 +75,40 @@ def download_file_from_minio(object_key):
 
 
 
-def generate_presigned_download_url(object_name, expires_in=3600):
+def generate_presigned_download_url(object_name, expires_in=3600, download_filename=None):
+    """
+    Gera uma URL pré-assinada para download direto do bucket.
+    :param download_filename: se informado, o navegador salva o arquivo com esse nome
+    """
     s3_client = get_s3_client()
+    params = {"Bucket": settings.AWS_STORAGE_BUCKET_NAME, "Key": object_name}
+    if download_filename:
+        params["ResponseContentDisposition"] = f'attachment; filename="{download_filename}"'
     return s3_client.generate_presigned_url(
         'get_object',
-        Params={"Bucket": settings.AWS_STORAGE_BUCKET_NAME, "Key": object_name},
+        Params=params,
         ExpiresIn=expires_in
-    )
\ No newline at end of file
+    )
+
+
+def upload_result_archive(file_obj, object_name):
+    """
+    Envia um arquivo de resultado (ZIP) para o bucket calculando tamanho e SHA-256 no caminho.
+    O upload_fileobj faz upload multipart em partes, sem carregar o arquivo inteiro em memória.
+    :return: (tamanho em bytes, checksum SHA-256)
+    """
+    sha = hashlib.sha256()
+    file_obj.seek(0)
+    for bloco in iter(lambda: file_obj.read(1024 * 1024), b""):
+        sha.update(bloco)
+    tamanho = file_obj.tell()
+
+    file_obj.seek(0)
+    s3_client = get_s3_client()
+    s3_client.upload_fileobj(
+        file_obj,
+        settings.AWS_STORAGE_BUCKET_NAME,
+        object_name,
+        ExtraArgs={"ContentType": "application/zip"},
+    )
+    return tamanho, sha.hexdigest()
\ No newline at end of file
@@ -189,6 +189,10 @@ class ArquivoZip(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     zip_bytes = models.BinaryField(null=True, blank=True)  # campo binário no PostgreSQL
     nome_arquivo = models.CharField(max_length=255, blank=True, null=True, help_text="Nome do arquivo ZIP")  # NOVO CAMPO
+    # ZIPs novos ficam no bucket; zip_bytes só existe em registros antigos (ver migrar_zips_para_s3)
+    s3_key = models.CharField(max_length=512, blank=True, null=True, help_text="Chave do ZIP no bucket")
+    tamanho = models.BigIntegerField(blank=True, null=True, help_text="Tamanho do ZIP em bytes")
+    checksum = models.CharField(max_length=64, blank=True, null=True, help_text="SHA-256 do ZIP")
     criado_em = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -337,10 +341,67 @@ class ProfileModel(models.Model):
 
 
 # modelo para persistir arquivos já processados e evitar duplicidades
+# também serve de cache do resultado do DocumentAI (ver extract/ocr_cache.py)
 class FilesProccess(models.Model):
-    hash = models.CharField(max_length=64, unique=True)
+    hash = models.CharField(max_length=64, unique=True, help_text="Chave do cache: SHA-256 do PDF, processador e opções do DocumentAI")
+    hash_pdf = models.CharField(max_length=64, null=True, blank=True, db_index=True, help_text="SHA-256 dos bytes do PDF")
     filename = models.CharField(max_length=255)
     proccess_data = models.DateTimeField(auto_now_add=True)
+    dados_extraidos = models.JSONField(blank=True, null=True, help_text="Saída de mapear_campos para este PDF")
+    ultimo_acesso = models.DateTimeField(default=timezone.now, db_index=True, help_text="Último uso do resultado em cache")
+    acessos = models.IntegerField(default=0, help_text="Número de vezes que o cache foi aproveitado")
 
 
-    
\ No newline at end of file
+    
+
+# modelo para os layouts de NFS-e aprendidos por prefeitura (ver extract/layout_templates.py)
+class LayoutTemplate(models.Model):
+    prefeitura = models.CharField(max_length=255, unique=True, help_text="Texto normalizado da entidade prefeitura_nota")
+    ancoras = models.JSONField(default=dict, help_text="Âncoras consolidadas: campo -> rótulo, ocorrência e tipo do valor")
+    candidatos = models.JSONField(default=dict, help_text="Contagem das âncoras observadas em cada amostra")
+    amostras = models.IntegerField(default=0, help_text="Extrações do DocumentAI usadas no aprendizado")
+    ativo = models.BooleanField(default=False, db_index=True, help_text="Se o template já pode substituir o DocumentAI")
+    usos = models.IntegerField(default=0, help_text="Arquivos extraídos localmente com este template")
+    falhas = models.IntegerField(default=0, help_text="Extrações com confiança abaixo do mínimo")
+    falhas_consecutivas = models.IntegerField(default=0, help_text="Falhas desde o último uso bem-sucedido")
+    reavaliacoes = models.IntegerField(default=0, help_text="Amostras do DocumentAI reproduzidas pelas âncoras desde a desativação")
+    motivo_invalidacao = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Template de Layout"
+        verbose_name_plural = "Templates de Layout"
+
+    def __str__(self):
+        return f"{self.prefeitura} - {'ativo' if self.ativo else 'aprendendo'} ({self.amostras} amostras)"
+
+
+# modelo para os XMLs de cada arquivo de um job: o resultado da tarefa guarda só os ids
+class ArquivoProcessado(models.Model):
+    STATUS_CHOICES = [
+        ('SUCESSO', 'Sucesso'),
+        ('ERRO', 'Erro'),
+    ]
+
+    task_id = models.CharField(max_length=100, db_index=True, help_text="ID da tarefa processar_pdfs")
+    chave_arquivo = models.CharField(max_length=512, help_text="Chave do PDF no bucket")
+    nome_arquivo = models.CharField(max_length=255, help_text="Nome do PDF enviado")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, help_text="Resultado do processamento do arquivo")
+    xml = models.TextField(blank=True, null=True, help_text="XML ABRASF gerado")
+    erro = models.TextField(blank=True, null=True, help_text="Motivo da falha, se houver")
+    tentativas = models.PositiveSmallIntegerField(default=1, help_text="Tentativas usadas para processar o arquivo")
+    xml_valido = models.BooleanField(null=True, blank=True, help_text="XML válido no XSD do ABRASF (vazio se não validado)")
+    erros_validacao = models.JSONField(null=True, blank=True, help_text="Erros da validação XSD")
+    reprocessado_em = models.CharField(max_length=100, null=True, blank=True, help_text="ID da tarefa que reprocessou a falha")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Arquivo Processado"
+        verbose_name_plural = "Arquivos Processados"
+        unique_together = ('task_id', 'chave_arquivo')
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.nome_arquivo} - {self.status}"
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import FilesProccess
+from .redis_service import get_redis_client
+
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentAICache:
+    """
+    Cache persistente do resultado de mapear_campos, indexado pelo SHA-256 dos bytes do PDF
+    combinado com o processador e as opções efetivas da requisição ao DocumentAI (field_mask,
+    paginas). Reenvios do mesmo PDF com o mesmo processador e as mesmas opções reaproveitam os
+    dados já extraídos e não chamam o DocumentAI; trocar o processador ou restringir as opções
+    em um job não contamina o cache dos demais. O SHA-256 do PDF fica em FilesProccess.hash_pdf.
+    """
+
+    CHAVE_HITS = "documentai_cache:hits"
+    CHAVE_MISSES = "documentai_cache:misses"
+
+    @staticmethod
+    def calcular_hash(pdf_bytes: bytes) -> str:
+        """Gera o hash SHA-256 que identifica o conteúdo do PDF."""
+        return hashlib.sha256(pdf_bytes).hexdigest()
+
+    @staticmethod
+    def calcular_chave(file_hash: str, processor_id: Optional[str], opcoes: Dict) -> str:
+        """
+        Chave do cache (e da trava do single-flight) para um PDF extraído pelo processador com as
+        opções informadas.
+        :param processor_id: processador do DocumentAI (pode incluir a versão, "id/processorVersions/v")
+        :param opcoes: opções efetivas da requisição (DocumentAIProcessor.opcoes_requisicao)
+        """
+        opcoes_json = json.dumps(opcoes, sort_keys=True, default=str)
+        return hashlib.sha256(f"{file_hash}:{processor_id or ''}:{opcoes_json}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _contar(chave: str):
+        """Incrementa um contador global (compartilhado entre workers) no Redis."""
+        try:
+            get_redis_client().incr(chave)
+        except Exception as e:
+            logger.warning(f"[Cache DocumentAI] Não foi possível atualizar o contador {chave}: {e}")
+
+    @staticmethod
+    def _limite_validade():
+        return timezone.now() - timedelta(days=settings.DOCUMENTAI_CACHE_TTL_DIAS)
+
+    @classmethod
+    def obter(cls, file_hash: str, contar: bool = True) -> Optional[Dict]:
+        """
+        Retorna os dados extraídos em cache para o hash informado, ou None se não houver
+        entrada válida (inexistente ou mais antiga que DOCUMENTAI_CACHE_TTL_DIAS).
+        :param contar: False para consultas repetidas (espera do single-flight) que não devem
+                       entrar nas métricas de hit/miss
+        """
+        if not settings.DOCUMENTAI_CACHE_ENABLED:
+            return None
+
+        registro = (
+            FilesProccess.objects
+            .filter(hash=file_hash, dados_extraidos__isnull=False, proccess_data__gte=cls._limite_validade())
+            .only("id", "dados_extraidos")
+            .first()
+        )
+        if registro is None:
+            if contar:
+                cls._contar(cls.CHAVE_MISSES)
+            return None
+
+        FilesProccess.objects.filter(pk=registro.pk).update(
+            ultimo_acesso=timezone.now(),
+            acessos=F("acessos") + 1,
+        )
+        if contar:
+            cls._contar(cls.CHAVE_HITS)
+        return registro.dados_extraidos
+
+    @classmethod
+    def salvar(cls, file_hash: str, filename: str, dados: Dict, hash_pdf: Optional[str] = None):
+        """
+        Grava (ou renova) o resultado de mapear_campos para a chave informada.
+        :param hash_pdf: SHA-256 dos bytes do PDF, para detectar PDFs repetidos entre chaves
+        """
+        if not settings.DOCUMENTAI_CACHE_ENABLED or not dados:
+            return
+
+        agora = timezone.now()
+        FilesProccess.objects.update_or_create(
+            hash=file_hash,
+            defaults={
+                "filename": filename,
+                "hash_pdf": hash_pdf,
+                "dados_extraidos": dados,
+                "proccess_data": agora,
+                "ultimo_acesso": agora,
+            },
+        )
+
+    @classmethod
+    def limpar(cls) -> int:
+        """
+        Aplica a política de expiração do cache:
+        - remove entradas mais antigas que DOCUMENTAI_CACHE_TTL_DIAS
+        - mantém no máximo DOCUMENTAI_CACHE_MAX_ENTRADAS, descartando as menos usadas recentemente
+        :return: número de entradas removidas
+        """
+        removidos, _ = FilesProccess.objects.filter(
+            dados_extraidos__isnull=False,
+            proccess_data__lt=cls._limite_validade(),
+        ).delete()
+
+        excedentes = (
+            FilesProccess.objects
+            .filter(dados_extraidos__isnull=False)
+            .order_by("-ultimo_acesso")
+            .values_list("id", flat=True)[settings.DOCUMENTAI_CACHE_MAX_ENTRADAS:]
+        )
+        ids_excedentes = list(excedentes)
+        if ids_excedentes:
+            removidos += FilesProccess.objects.filter(id__in=ids_excedentes).delete()[0]
+
+        logger.info(f"[Cache DocumentAI] {removidos} entrada(s) removida(s) do cache")
+        return removidos
+
+    @classmethod
+    def estatisticas(cls) -> Dict:
+        """Retorna os contadores de hit/miss e o tamanho atual do cache."""
+        try:
+            hits, misses = get_redis_client().mget(cls.CHAVE_HITS, cls.CHAVE_MISSES)
+        except Exception as e:
+            logger.warning(f"[Cache DocumentAI] Não foi possível ler os contadores: {e}")
+            hits, misses = None, None
+
+        hits = int(hits or 0)
+        misses = int(misses or 0)
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "entradas": FilesProccess.objects.filter(dados_extraidos__isnull=False).count(),
+            "max_entradas": settings.DOCUMENTAI_CACHE_MAX_ENTRADAS,
+            "ttl_dias": settings.DOCUMENTAI_CACHE_TTL_DIAS,
+        }
+
+
+class OCRSingleFlight:
+    """
+    Garante uma única extração em andamento por PDF (chave do DocumentAICache: SHA-256 + opções) em todo o cluster.
+    O primeiro job a encontrar o PDF fora do cache reserva a trava no Redis e faz a extração;
+    jobs concorrentes com o mesmo PDF esperam o resultado aparecer no DocumentAICache em vez
+    de chamar o DocumentAI de novo. Se a espera passar de OCR_SINGLEFLIGHT_ESPERA_MAX, ou se o
+    dono da trava falhar sem gravar o cache, o job segue e extrai por conta própria.
+    """
+
+    PREFIXO = "ocr:singleflight"
+    CHAVE_COMPARTILHADOS = "ocr:singleflight:compartilhados"
+
+    # Só apaga a trava se ela ainda pertence a quem a reservou (pode ter expirado e sido reservada por outro)
+    SCRIPT_LIBERAR = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    @classmethod
+    def adquirir_ou_aguardar(cls, file_hash: str) -> Tuple[Optional[str], Optional[Dict]]:
+        """
+        :return: (token, None) quando este job deve extrair (liberar com o token ao terminar);
+                 (None, dados) quando outro job extraiu o mesmo PDF durante a espera;
+                 (None, None) quando o single-flight está desativado ou indisponível
+        """
+        if not settings.DOCUMENTAI_CACHE_ENABLED or not settings.OCR_SINGLEFLIGHT_ENABLED:
+            return None, None
+
+        chave = f"{cls.PREFIXO}:{file_hash}"
+        token = uuid.uuid4().hex
+        limite = time.monotonic() + settings.OCR_SINGLEFLIGHT_ESPERA_MAX
+        while True:
+            try:
+                adquirida = get_redis_client().set(chave, token, nx=True, ex=settings.OCR_SINGLEFLIGHT_TTL)
+            except Exception as e:
+                logger.warning(f"[Single-flight OCR] Redis indisponível, seguindo sem trava: {e}")
+                return None, None
+            if adquirida:
+                # O dono anterior pode ter gravado o cache e liberado a trava depois da última consulta
+                dados = DocumentAICache.obter(file_hash, contar=False)
+                if dados is None:
+                    return token, None
+                cls.liberar(file_hash, token)
+                DocumentAICache._contar(cls.CHAVE_COMPARTILHADOS)
+                return None, dados
+
+            time.sleep(settings.OCR_SINGLEFLIGHT_INTERVALO)
+            dados = DocumentAICache.obter(file_hash, contar=False)
+            if dados is not None:
+                logger.info(f"[Single-flight OCR] Resultado de {file_hash} compartilhado com outro job")
+                DocumentAICache._contar(cls.CHAVE_COMPARTILHADOS)
+                return None, dados
+            if time.monotonic() > limite:
+                logger.warning(f"[Single-flight OCR] Espera por {file_hash} esgotada, extraindo sem trava")
+                return None, None
+
+    @classmethod
+    def liberar(cls, file_hash: str, token: Optional[str]):
+        if token is None:
+            return
+        try:
+            get_redis_client().eval(cls.SCRIPT_LIBERAR, 1, f"{cls.PREFIXO}:{file_hash}", token)
+        except Exception as e:
+            logger.warning(f"[Single-flight OCR] Não foi possível liberar a trava de {file_hash}: {e}")
+
+    @classmethod
+    def compartilhados(cls) -> int:
+        """Quantas extrações foram evitadas por esperar o resultado de outro job."""
+        try:
+            return int(get_redis_client().get(cls.CHAVE_COMPARTILHADOS) or 0)
+        except Exception as e:
+            logger.warning(f"[Single-flight OCR] Não foi possível ler as métricas: {e}")
+            return 0
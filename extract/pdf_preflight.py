@@ -0,0 +1,267 @@
+import hashlib
+import io
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+
+import PyPDF2
+from PIL import Image
+from PyPDF2.generic import DictionaryObject, NameObject, NumberObject
+from django.conf import settings
+
+from .redis_service import get_redis_client
+
+
+logger = logging.getLogger(__name__)
+
+
+# Chaves da página que não têm utilidade para o OCR
+CHAVES_PAGINA_DESCARTAVEIS = ("/Metadata", "/PieceInfo", "/Thumb")
+
+# Modos do Pillow para imagens FlateDecode de 8 bits por componente
+MODOS_FLATE = {"/DeviceGray": "L", "/DeviceRGB": "RGB"}
+
+# Operadores de objeto de texto e de exibição de texto no content stream
+OPERADORES_TEXTO = re.compile(rb"(?<![A-Za-z0-9_])(BT|Tj|TJ)(?![A-Za-z0-9_])")
+
+
+class PDFPreflight:
+    """
+    Otimiza o PDF antes do envio ao DocumentAI:
+    - remove páginas finais em branco ou duplicadas
+    - descarta metadados e, nas páginas sem nenhum operador de texto, as fontes embutidas
+    - reduz imagens acima de PREFLIGHT_MAX_DPI (0 desativa)
+    O PDF original continua sendo usado para hash, cache e camada de texto;
+    apenas o payload do OCR é reduzido.
+    """
+
+    CHAVE_BYTES_ECONOMIZADOS = "preflight:bytes_economizados"
+    CHAVE_ARQUIVOS = "preflight:arquivos"
+
+    @staticmethod
+    def _filtro(xobj) -> Optional[str]:
+        filtro = xobj.get("/Filter")
+        if isinstance(filtro, list):
+            filtro = filtro[0] if len(filtro) == 1 else None
+        return filtro
+
+    @classmethod
+    def _imagens(cls, page) -> List:
+        """Objetos de imagem (XObject /Image) usados diretamente pela página."""
+        recursos = page.get("/Resources")
+        if recursos is None:
+            return []
+        xobjects = recursos.get_object().get("/XObject")
+        if xobjects is None:
+            return []
+        imagens = []
+        for nome in xobjects.get_object():
+            xobj = xobjects.get_object()[nome].get_object()
+            if xobj.get("/Subtype") == "/Image":
+                imagens.append(xobj)
+        return imagens
+
+    @classmethod
+    def _abrir_imagem(cls, xobj) -> Optional[Image.Image]:
+        """
+        Abre a imagem com o Pillow quando o formato é suportado (JPEG ou Flate 8 bits cinza/RGB).
+        Imagens com /Decode não são abertas: o Pillow ignoraria o array e a imagem sairia invertida.
+        """
+        if "/Decode" in xobj:
+            return None
+        filtro = cls._filtro(xobj)
+        if filtro == "/DCTDecode":
+            return Image.open(io.BytesIO(xobj._data))
+        if filtro == "/FlateDecode" and xobj.get("/BitsPerComponent") == 8 and "/DecodeParms" not in xobj:
+            modo = MODOS_FLATE.get(xobj.get("/ColorSpace"))
+            if modo:
+                return Image.frombytes(modo, (int(xobj["/Width"]), int(xobj["/Height"])), xobj.get_data())
+        return None
+
+    @classmethod
+    def _pagina_em_branco(cls, page) -> bool:
+        """Sem texto e sem imagens com conteúdo (até 0,5% de pixels escuros na miniatura)."""
+        if (page.extract_text() or "").strip():
+            return False
+
+        imagens = cls._imagens(page)
+        if not imagens:
+            conteudo = page.get_contents()
+            return conteudo is None or len(conteudo.get_data().strip()) < 200
+
+        for xobj in imagens:
+            imagem = cls._abrir_imagem(xobj)
+            if imagem is None:
+                return False
+            imagem = imagem.convert("L")
+            imagem.thumbnail((200, 200))
+            histograma = imagem.histogram()
+            escuros = sum(histograma[:200])
+            if escuros / max(sum(histograma), 1) > 0.005:
+                return False
+        return True
+
+    @classmethod
+    def _assinatura_pagina(cls, page) -> str:
+        """Hash do conteúdo da página e das imagens, para detectar páginas repetidas."""
+        sha = hashlib.sha256()
+        conteudo = page.get_contents()
+        if conteudo is not None:
+            sha.update(conteudo.get_data())
+        for xobj in cls._imagens(page):
+            sha.update(xobj._data)
+        return sha.hexdigest()
+
+    @classmethod
+    def _paginas_finais_descartaveis(cls, paginas) -> int:
+        """Conta as páginas do fim que estão em branco ou repetem a página anterior (a primeira fica sempre)."""
+        descartar = 0
+        for indice in range(len(paginas) - 1, 0, -1):
+            page = paginas[indice]
+            if cls._pagina_em_branco(page) or cls._assinatura_pagina(page) == cls._assinatura_pagina(paginas[indice - 1]):
+                descartar += 1
+            else:
+                break
+        return descartar
+
+    @classmethod
+    def _reduzir_imagens(cls, page, max_dpi: int) -> int:
+        """Reamostra as imagens cuja resolução efetiva passa de max_dpi. Retorna quantas foram reduzidas."""
+        largura_pol = float(page.mediabox.width) / 72
+        altura_pol = float(page.mediabox.height) / 72
+        if largura_pol <= 0 or altura_pol <= 0:
+            return 0
+
+        reduzidas = 0
+        for xobj in cls._imagens(page):
+            largura, altura = int(xobj["/Width"]), int(xobj["/Height"])
+            # Considera a imagem ocupando a página inteira, o caso dos PDFs escaneados
+            escala = max_dpi / max(largura / largura_pol, altura / altura_pol)
+            if escala >= 1:
+                continue
+
+            imagem = cls._abrir_imagem(xobj)
+            if imagem is None:
+                continue
+            if imagem.mode not in ("L", "RGB"):
+                imagem = imagem.convert("RGB")
+            novo_tamanho = (max(1, int(largura * escala)), max(1, int(altura * escala)))
+            imagem = imagem.resize(novo_tamanho, Image.LANCZOS)
+
+            saida = io.BytesIO()
+            imagem.save(saida, format="JPEG", quality=settings.PREFLIGHT_JPEG_QUALIDADE, optimize=True)
+            dados = saida.getvalue()
+            if len(dados) >= len(xobj._data):
+                continue
+
+            xobj._data = dados
+            xobj[NameObject("/Filter")] = NameObject("/DCTDecode")
+            xobj[NameObject("/Width")] = NumberObject(novo_tamanho[0])
+            xobj[NameObject("/Height")] = NumberObject(novo_tamanho[1])
+            xobj[NameObject("/BitsPerComponent")] = NumberObject(8)
+            xobj[NameObject("/ColorSpace")] = NameObject("/DeviceGray" if imagem.mode == "L" else "/DeviceRGB")
+            xobj.pop("/DecodeParms", None)
+            reduzidas += 1
+        return reduzidas
+
+    @staticmethod
+    def _desenha_texto(page, recursos) -> bool:
+        """
+        Se a página pode desenhar texto: operadores de texto no content stream ou XObjects de
+        formulário (que podem usar as fontes da página). extract_text() não serve para isso:
+        fontes Type3 ou subconjuntos sem ToUnicode renderizam glifos visíveis sem texto extraível.
+        """
+        conteudo = page.get_contents()
+        if conteudo is not None and OPERADORES_TEXTO.search(conteudo.get_data()):
+            return True
+        xobjects = recursos.get("/XObject")
+        if xobjects is None:
+            return False
+        xobjects = xobjects.get_object()
+        return any(xobjects[nome].get_object().get("/Subtype") == "/Form" for nome in xobjects)
+
+    @classmethod
+    def _limpar_pagina(cls, page):
+        """Remove metadados da página e, se ela não desenha texto, as fontes declaradas nos recursos."""
+        for chave in CHAVES_PAGINA_DESCARTAVEIS:
+            page.pop(chave, None)
+        recursos = page.get("/Resources")
+        if recursos is None:
+            return
+        recursos = recursos.get_object()
+        if "/Font" not in recursos or cls._desenha_texto(page, recursos):
+            return
+        # /Resources costuma ser compartilhado entre páginas: a página recebe uma cópia sem /Font
+        page[NameObject("/Resources")] = DictionaryObject(
+            {chave: valor for chave, valor in recursos.items() if chave != "/Font"}
+        )
+
+    @classmethod
+    def _registrar(cls, economizados: int):
+        """Acumula os bytes economizados (compartilhado entre workers) no Redis."""
+        try:
+            cliente = get_redis_client()
+            cliente.incrby(cls.CHAVE_BYTES_ECONOMIZADOS, economizados)
+            cliente.incr(cls.CHAVE_ARQUIVOS)
+        except Exception as e:
+            logger.warning(f"[Preflight] Não foi possível atualizar as métricas: {e}")
+
+    @classmethod
+    def otimizar(cls, pdf_bytes: bytes) -> Tuple[bytes, Dict]:
+        """
+        Gera a versão reduzida do PDF para o OCR.
+        Em qualquer erro, ou se o resultado não ficar menor, devolve o PDF original.
+        :return: (bytes para o DocumentAI, relatório com os bytes economizados)
+        """
+        relatorio = {
+            "bytes_originais": len(pdf_bytes),
+            "bytes_otimizados": len(pdf_bytes),
+            "bytes_economizados": 0,
+            "paginas_removidas": 0,
+            "imagens_reduzidas": 0,
+        }
+        if not settings.PREFLIGHT_ENABLED:
+            return pdf_bytes, relatorio
+
+        try:
+            reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+            paginas = list(reader.pages)
+            relatorio["paginas_removidas"] = cls._paginas_finais_descartaveis(paginas)
+
+            # O writer começa sem /Info e sem /Metadata do documento original
+            writer = PyPDF2.PdfWriter()
+            for page in paginas[:len(paginas) - relatorio["paginas_removidas"]]:
+                cls._limpar_pagina(page)
+                if settings.PREFLIGHT_MAX_DPI:
+                    relatorio["imagens_reduzidas"] += cls._reduzir_imagens(page, settings.PREFLIGHT_MAX_DPI)
+                page.compress_content_streams()
+                writer.add_page(page)
+
+            saida = io.BytesIO()
+            writer.write(saida)
+            otimizado = saida.getvalue()
+        except Exception as e:
+            logger.warning(f"[Preflight] PDF enviado sem otimização: {e}")
+            relatorio["erro"] = str(e)
+            return pdf_bytes, relatorio
+
+        if len(otimizado) >= len(pdf_bytes):
+            return pdf_bytes, relatorio
+
+        relatorio["bytes_otimizados"] = len(otimizado)
+        relatorio["bytes_economizados"] = len(pdf_bytes) - len(otimizado)
+        cls._registrar(relatorio["bytes_economizados"])
+        return otimizado, relatorio
+
+    @classmethod
+    def estatisticas(cls) -> Dict:
+        """Total de bytes economizados e de arquivos otimizados desde o início da contagem."""
+        try:
+            economizados, arquivos = get_redis_client().mget(cls.CHAVE_BYTES_ECONOMIZADOS, cls.CHAVE_ARQUIVOS)
+        except Exception as e:
+            logger.warning(f"[Preflight] Não foi possível ler as métricas: {e}")
+            economizados, arquivos = None, None
+        return {
+            "bytes_economizados": int(economizados or 0),
+            "arquivos": int(arquivos or 0),
+        }
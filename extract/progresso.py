@@ -0,0 +1,160 @@
+import json
+import logging
+import time
+from typing import Dict, Optional
+
+from celery import current_app
+from django.conf import settings
+
+from .models import TaskStatusModel
+from .redis_service import get_redis_client
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressoJob:
+    """
+    Progresso por arquivo de um job de processar_pdfs, compartilhado entre threads e
+    entre os subtasks do modo chord via Redis.
+    Cada arquivo concluído incrementa os contadores; a publicação no result backend (estado
+    PROGRESS) e no TaskStatusModel é limitada a uma a cada PROGRESSO_INTERVALO_SEGUNDOS e
+    PROGRESSO_INTERVALO_DB_SEGUNDOS, quem conseguir a trava publica o agregado.
+    O ETA usa a vazão medida nas últimas PROGRESSO_JANELA conclusões.
+    """
+
+    TTL_SEGUNDOS = 24 * 3600
+    MAX_ULTIMOS = 10
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.chave = f"progresso:{task_id}"
+
+    def _redis(self):
+        return get_redis_client()
+
+    def iniciar(self, total: int, paralelismo: int = 1):
+        """Zera o progresso do job (também em reentregas da mesma tarefa)."""
+        try:
+            redis = self._redis()
+            pipe = redis.pipeline()
+            pipe.delete(self.chave, f"{self.chave}:latencias", f"{self.chave}:ultimos")
+            pipe.hset(self.chave, mapping={
+                "total": total, "processados": 0, "sucessos": 0, "erros": 0,
+                "paralelismo": paralelismo, "inicio": time.time(),
+            })
+            pipe.expire(self.chave, self.TTL_SEGUNDOS)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"[Progresso] Não foi possível iniciar o progresso de {self.task_id}: {e}")
+        self.publicar(forcar=True)
+
+    def arquivo_iniciado(self, nome_arquivo: str):
+        try:
+            self._redis().hset(self.chave, "arquivo_atual", nome_arquivo)
+        except Exception as e:
+            logger.warning(f"[Progresso] Não foi possível registrar o arquivo atual: {e}")
+
+    def arquivo_concluido(self, nome_arquivo: str, duracao: float, erro: Optional[str] = None,
+                          reaproveitado: bool = False):
+        """
+        Registra o fim de um arquivo (com o motivo, se falhou) e publica se o intervalo permitir.
+        Arquivos reaproveitados de um checkpoint contam como processados, mas não entram no ETA.
+        """
+        try:
+            redis = self._redis()
+            pipe = redis.pipeline()
+            pipe.hincrby(self.chave, "processados", 1)
+            pipe.hincrby(self.chave, "erros" if erro else "sucessos", 1)
+            if not reaproveitado:
+                pipe.lpush(f"{self.chave}:latencias", f"{time.time()}:{duracao}")
+                pipe.ltrim(f"{self.chave}:latencias", 0, settings.PROGRESSO_JANELA - 1)
+            pipe.lpush(f"{self.chave}:ultimos", json.dumps({
+                "arquivo": nome_arquivo,
+                "status": "ERRO" if erro else "SUCESSO",
+                "erro": erro,
+                "duracao": round(duracao, 2),
+                "reaproveitado": reaproveitado,
+            }))
+            pipe.ltrim(f"{self.chave}:ultimos", 0, self.MAX_ULTIMOS - 1)
+            for sufixo in ("", ":latencias", ":ultimos"):
+                pipe.expire(f"{self.chave}{sufixo}", self.TTL_SEGUNDOS)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"[Progresso] Não foi possível registrar a conclusão de {nome_arquivo}: {e}")
+            return
+        self.publicar()
+
+    def _calcular_eta(self, restantes: int, paralelismo: int, latencias) -> Dict:
+        amostras = []
+        for item in latencias:
+            instante, duracao = item.decode().split(":") if isinstance(item, bytes) else item.split(":")
+            amostras.append((float(instante), float(duracao)))
+        if not amostras:
+            return {"latencia_media": None, "eta_segundos": None}
+
+        latencia_media = sum(d for _, d in amostras) / len(amostras)
+        instantes = [t for t, _ in amostras]
+        janela = max(instantes) - min(instantes)
+        if len(amostras) > 1 and janela > 0:
+            # Vazão observada já embute o paralelismo real (threads ou workers do chord)
+            vazao = (len(amostras) - 1) / janela
+            eta = restantes / vazao
+        else:
+            eta = restantes * latencia_media / max(1, paralelismo)
+        return {"latencia_media": round(latencia_media, 2), "eta_segundos": round(eta)}
+
+    def obter(self) -> Dict:
+        """Estado agregado do job, no formato publicado como meta do estado PROGRESS."""
+        redis = self._redis()
+        pipe = redis.pipeline()
+        pipe.hgetall(self.chave)
+        pipe.lrange(f"{self.chave}:latencias", 0, -1)
+        pipe.lrange(f"{self.chave}:ultimos", 0, -1)
+        estado, latencias, ultimos = pipe.execute()
+        estado = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+                  for k, v in estado.items()}
+
+        total = int(estado.get("total", 0))
+        processados = int(estado.get("processados", 0))
+        meta = {
+            "total_files": total,
+            "processed_files": processados,
+            "sucessos": int(estado.get("sucessos", 0)),
+            "erros": int(estado.get("erros", 0)),
+            "arquivo_atual": estado.get("arquivo_atual"),
+            "percentual": round(100 * processados / total, 1) if total else 0.0,
+            "decorrido_segundos": round(time.time() - float(estado.get("inicio", time.time()))),
+            "ultimos_arquivos": [json.loads(item) for item in ultimos],
+            "arquivos_url": f"/api/task-files/{self.task_id}/",
+        }
+        meta.update(self._calcular_eta(max(0, total - processados), int(estado.get("paralelismo", 1)), latencias))
+        return meta
+
+    def publicar(self, forcar: bool = False):
+        """Publica o agregado no result backend e no TaskStatusModel, respeitando os intervalos."""
+        try:
+            redis = self._redis()
+            publicar_backend = forcar or redis.set(
+                f"{self.chave}:trava_backend", 1, nx=True, px=int(settings.PROGRESSO_INTERVALO_SEGUNDOS * 1000)
+            )
+            publicar_db = forcar or redis.set(
+                f"{self.chave}:trava_db", 1, nx=True, px=int(settings.PROGRESSO_INTERVALO_DB_SEGUNDOS * 1000)
+            )
+            if not (publicar_backend or publicar_db):
+                return
+            meta = self.obter()
+        except Exception as e:
+            logger.warning(f"[Progresso] Não foi possível publicar o progresso de {self.task_id}: {e}")
+            return
+
+        try:
+            if publicar_backend:
+                current_app.backend.store_result(self.task_id, meta, "PROGRESS")
+            if publicar_db:
+                # Não sobrescreve o status final caso uma atualização atrasada chegue depois do fim
+                TaskStatusModel.objects.filter(
+                    task_id=self.task_id, status__in=["AGUARDANDO", "PROCESSANDO"]
+                ).update(status="PROCESSANDO", result=json.dumps(meta))
+        except Exception as e:
+            logger.warning(f"[Progresso] Falha ao gravar o progresso de {self.task_id}: {e}")
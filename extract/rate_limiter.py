@@ -0,0 +1,146 @@
+import logging
+import random
+import time
+from typing import Dict
+
+from django.conf import settings
+
+from .redis_service import get_redis_client
+
+
+logger = logging.getLogger(__name__)
+
+
+def calcular_backoff(tentativa: int, base: float, maximo: float) -> float:
+    """
+    Backoff exponencial com "full jitter": espera aleatória entre 0 e base * 2^(tentativa-1),
+    limitada a `maximo`. Evita que vários workers retentem todos no mesmo instante.
+    """
+    return random.uniform(0, min(maximo, base * (2 ** (tentativa - 1))))
+
+
+class RedisTokenBucket:
+    """
+    Token bucket compartilhado entre todos os workers via Redis.
+    O script Lua é atômico e usa o relógio do próprio Redis, então workers em máquinas
+    diferentes enxergam o mesmo balde. Cada chamada reserva um token e devolve quanto
+    tempo o chamador deve esperar até que esse token esteja disponível.
+    """
+
+    SCRIPT_RESERVAR = """
+    redis.replicate_commands()
+    local chave = KEYS[1]
+    local taxa = tonumber(ARGV[1])
+    local capacidade = tonumber(ARGV[2])
+    local relogio = redis.call('TIME')
+    local agora = tonumber(relogio[1]) + tonumber(relogio[2]) / 1000000
+
+    local estado = redis.call('HMGET', chave, 'tokens', 'ts')
+    local tokens = tonumber(estado[1])
+    local ts = tonumber(estado[2])
+    if tokens == nil then
+        tokens = capacidade
+        ts = agora
+    end
+
+    tokens = math.min(capacidade, tokens + math.max(0, agora - ts) * taxa) - 1
+    redis.call('HSET', chave, 'tokens', tokens, 'ts', agora)
+    redis.call('EXPIRE', chave, math.ceil(capacidade / taxa) + 60)
+
+    if tokens >= 0 then
+        return '0'
+    end
+    return tostring(-tokens / taxa)
+    """
+
+    def __init__(self, chave: str, taxa_por_segundo: float, capacidade: float):
+        self.chave = chave
+        self.taxa = float(taxa_por_segundo)
+        self.capacidade = float(capacidade)
+        self._script = None
+
+    def reservar(self) -> float:
+        """Reserva um token e retorna o tempo de espera (segundos) até poder usá-lo."""
+        if self._script is None:
+            self._script = get_redis_client().register_script(self.SCRIPT_RESERVAR)
+        return float(self._script(keys=[self.chave], args=[self.taxa, self.capacidade]))
+
+
+class DocumentAIRateLimiter:
+    """
+    Limita as chamadas ao DocumentAI de todo o cluster à cota QPS do projeto
+    (DOCUMENTAI_QPS / DOCUMENTAI_BURST) e registra métricas de throttling no Redis.
+    """
+
+    CHAVE_ESPERA_SEGUNDOS = "documentai:metricas:espera_limiter_segundos"
+    CHAVE_ESPERAS = "documentai:metricas:esperas_limiter"
+    CHAVE_BACKOFF_SEGUNDOS = "documentai:metricas:backoff_segundos"
+    CHAVE_ERROS_QUOTA = "documentai:metricas:erros_quota"
+
+    _baldes: Dict[str, RedisTokenBucket] = {}
+
+    @classmethod
+    def _balde(cls, project_id: str, location: str) -> RedisTokenBucket:
+        chave = f"documentai:rate:{project_id}:{location}"
+        if chave not in cls._baldes:
+            cls._baldes[chave] = RedisTokenBucket(chave, settings.DOCUMENTAI_QPS, settings.DOCUMENTAI_BURST)
+        return cls._baldes[chave]
+
+    @staticmethod
+    def _registrar(chave_tempo: str, chave_contador: str, segundos: float):
+        try:
+            pipe = get_redis_client().pipeline()
+            pipe.incrbyfloat(chave_tempo, segundos)
+            pipe.incr(chave_contador)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"[RateLimiter] Não foi possível registrar métricas: {e}")
+
+    @classmethod
+    def aguardar_vez(cls, project_id: str, location: str) -> float:
+        """
+        Bloqueia até haver cota para uma chamada ao DocumentAI.
+        Se o Redis estiver indisponível, não bloqueia (falha aberta).
+        :return: segundos esperados
+        """
+        if not settings.DOCUMENTAI_RATE_LIMIT_ENABLED:
+            return 0.0
+
+        try:
+            espera = cls._balde(project_id, location).reservar()
+        except Exception as e:
+            logger.warning(f"[RateLimiter] Redis indisponível, seguindo sem limitação: {e}")
+            return 0.0
+
+        if espera > 0:
+            logger.info(f"[RateLimiter] Aguardando {espera:.2f}s pela cota do DocumentAI")
+            time.sleep(espera)
+            cls._registrar(cls.CHAVE_ESPERA_SEGUNDOS, cls.CHAVE_ESPERAS, espera)
+        return espera
+
+    @classmethod
+    def registrar_backoff(cls, segundos: float):
+        """Registra uma espera causada por RESOURCE_EXHAUSTED/UNAVAILABLE."""
+        cls._registrar(cls.CHAVE_BACKOFF_SEGUNDOS, cls.CHAVE_ERROS_QUOTA, segundos)
+
+    @classmethod
+    def metricas(cls) -> Dict:
+        """Retorna os totais acumulados de throttling do cluster."""
+        try:
+            valores = get_redis_client().mget(
+                cls.CHAVE_ESPERA_SEGUNDOS, cls.CHAVE_ESPERAS,
+                cls.CHAVE_BACKOFF_SEGUNDOS, cls.CHAVE_ERROS_QUOTA,
+            )
+        except Exception as e:
+            logger.warning(f"[RateLimiter] Não foi possível ler as métricas: {e}")
+            valores = [None] * 4
+
+        espera_segundos, esperas, backoff_segundos, erros_quota = valores
+        return {
+            "espera_limiter_segundos": float(espera_segundos or 0),
+            "esperas_limiter": int(esperas or 0),
+            "backoff_segundos": float(backoff_segundos or 0),
+            "erros_quota": int(erros_quota or 0),
+            "qps": settings.DOCUMENTAI_QPS,
+            "burst": settings.DOCUMENTAI_BURST,
+        }
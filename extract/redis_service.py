@@ -0,0 +1,23 @@
+import os
+import ssl
+import redis
+from django.conf import settings
+
+
+_redis_client = None
+
+
+def get_redis_client():
+    """
+    Retorna um cliente Redis compartilhado pelo processo.
+    Usa o mesmo servidor do broker do Celery (REDIS_TLS_URL / REDIS_URL).
+    O pool de conexões do redis-py é recriado automaticamente após o fork dos workers.
+    """
+    global _redis_client
+    if _redis_client is None:
+        redis_url = os.getenv('REDIS_TLS_URL', settings.REDIS_URL)
+        opcoes = {}
+        if redis_url.startswith("rediss://"):
+            opcoes["ssl_cert_reqs"] = ssl.CERT_NONE
+        _redis_client = redis.Redis.from_url(redis_url, **opcoes)
+    return _redis_client
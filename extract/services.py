@@ -3,7 +3,12 @@ import json
 import os
 from google.cloud import documentai_v1 as documentai
 from google.oauth2 import service_account
+from google.api_core import exceptions as google_exceptions
 from google.protobuf.json_format import MessageToJson
+from google.protobuf import field_mask_pb2
+import grpc
+from django.conf import settings
+import PyPDF2
 from dotenv import load_dotenv
 from lxml import etree
 from typing import Dict, Optional, List, Tuple
@@ -15,10 +20,12 @@ from dateutil.parser import parse
 import logging
 import cidades_ibge 
 import unicodedata
-from difflib import get_close_matches
 from decimal import Decimal, InvalidOperation
 from cidades_ibge import buscar_codigo_municipio
 import io
+import time
+import threading
+from .rate_limiter import DocumentAIRateLimiter, calcular_backoff
 import xml.etree.ElementTree as ET
 
 
@@ -84,10 +91,21 @@ class EmailSender:
 
 # define a classe de credenciais (conceito SOLID)
 class CredentialsLoader:
-    """Carrega as credenciais do Google a partir de um arquivo local ou de Base64"""
+    """
+    Carrega as credenciais do Google a partir de um arquivo local ou de Base64.
+    As credenciais ficam em memória no processo: são lidas/decodificadas uma única vez.
+    """
+
+    _credenciais: Optional[service_account.Credentials] = None
+
+    @classmethod
+    def loader_credentials(cls) -> Optional[service_account.Credentials]:
+        if cls._credenciais is None:
+            cls._credenciais = cls._carregar_credenciais()
+        return cls._credenciais
 
     @staticmethod
-    def loader_credentials() -> Optional[service_account.Credentials]:
+    def _carregar_credenciais() -> Optional[service_account.Credentials]:
         credentials_env = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
         
 
@@ -110,14 +128,6 @@ class CredentialsLoader:
         try:
             # print("Detectado formato Base64, decodificando credenciais...")
             credentials_json = base64.b64decode(credentials_env).decode("utf-8")
-
-            # Salva temporariamente no sistema de arquivos
-            temp_credentials_path = "/tmp/google_credentials.json"
-            with open(temp_credentials_path, "w") as temp_file:
-                temp_file.write(credentials_json)
-
-            print(f"Credenciais salvas temporariamente em: {temp_credentials_path}")
-
             credentials_data = json.loads(credentials_json)
             return service_account.Credentials.from_service_account_info(credentials_data)
 
@@ -126,14 +136,74 @@ class CredentialsLoader:
             return None
 
 
+class DocumentAIClientPool:
+    """
+    Pool de clientes do DocumentAI por processo.
+    Nos workers é criado uma vez no worker_process_init (depois do fork); as tarefas
+    pegam clientes emprestados em round-robin em vez de abrir um canal gRPC novo
+    (com handshake TLS) a cada job. Os clientes gRPC são thread-safe.
+    """
+
+    _clientes: List[documentai.DocumentProcessorServiceClient] = []
+    _proximo = 0
+    _lock = threading.RLock()
+
+    @staticmethod
+    def opcoes_canal() -> List[Tuple[str, int]]:
+        """Keepalive do canal: evita que conexões ociosas sejam derrubadas entre jobs."""
+        return [
+            ("grpc.keepalive_time_ms", settings.DOCUMENTAI_KEEPALIVE_TIME_MS),
+            ("grpc.keepalive_timeout_ms", settings.DOCUMENTAI_KEEPALIVE_TIMEOUT_MS),
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.max_pings_without_data", 0),
+            ("grpc.max_receive_message_length", -1),
+        ]
+
+    @classmethod
+    def _criar_cliente(cls, credenciais) -> documentai.DocumentProcessorServiceClient:
+        transport_class = documentai.DocumentProcessorServiceClient.get_transport_class("grpc")
+        if settings.DOCUMENTAI_INSECURE:
+            # Servidor local de testes de carga (manage.py documentai_standin), sem TLS nem credenciais
+            canal = grpc.insecure_channel(settings.DOCUMENTAI_API_ENDPOINT, options=cls.opcoes_canal())
+        else:
+            canal = transport_class.create_channel(
+                settings.DOCUMENTAI_API_ENDPOINT,
+                credentials=credenciais,
+                options=cls.opcoes_canal(),
+            )
+        return documentai.DocumentProcessorServiceClient(transport=transport_class(channel=canal))
+
+    @classmethod
+    def inicializar(cls, tamanho: Optional[int] = None):
+        """Carrega as credenciais e abre os canais do pool (substitui um pool existente)."""
+        with cls._lock:
+            credenciais = None if settings.DOCUMENTAI_INSECURE else CredentialsLoader.loader_credentials()
+            if not credenciais and not settings.DOCUMENTAI_INSECURE:
+                raise ValueError("Não foi possível carregar as credenciais")
+
+            tamanho = max(1, tamanho or settings.DOCUMENTAI_POOL_SIZE)
+            cls._clientes = [cls._criar_cliente(credenciais) for _ in range(tamanho)]
+            cls._proximo = 0
+            logger.info(f"Pool do DocumentAI iniciado com {tamanho} cliente(s) em {settings.DOCUMENTAI_API_ENDPOINT}")
+
+    @classmethod
+    def obter_cliente(cls) -> documentai.DocumentProcessorServiceClient:
+        """Empresta um cliente do pool, inicializando-o na primeira chamada se necessário."""
+        with cls._lock:
+            if not cls._clientes:
+                cls.inicializar()
+            cliente = cls._clientes[cls._proximo % len(cls._clientes)]
+            cls._proximo += 1
+            return cliente
+
+
 # define a classe de extração de dados
 class DocumentAIProcessor:
     """Processa documentos PDF usando API Google DocumentAI"""   
     def __init__(self, client: Optional[documentai.DocumentProcessorServiceClient] = None):
-        self.credentials = CredentialsLoader.loader_credentials()
-        if self.credentials:
-            self.client = client or documentai.DocumentProcessorServiceClient(credentials=self.credentials)
-            print("Cliente DocumentAI iniciado com sucesso")
+        self.credentials = None if settings.DOCUMENTAI_INSECURE else CredentialsLoader.loader_credentials()
+        if self.credentials or settings.DOCUMENTAI_INSECURE:
+            self.client = client or DocumentAIClientPool.obter_cliente()
         else:
             raise ValueError("Não foi possível carregar as credenciais")
         
@@ -149,24 +219,128 @@ class DocumentAIProcessor:
 
     
     
+    @staticmethod
+    def extrair_entidades(document) -> List[Dict]:
+        """
+        Lê apenas as entidades do Document retornado pelo DocumentAI, no mesmo formato
+        que o MessageToJson produziria (type / mentionText / normalizedValue.text),
+        sem serializar páginas, tokens, layout e imagens do documento.
+        """
+        entidades = []
+        for entidade in document._pb.entities:
+            item = {"type": entidade.type}
+            if entidade.mention_text:
+                item["mentionText"] = entidade.mention_text
+            if entidade.HasField("normalized_value"):
+                item["normalizedValue"] = {"text": entidade.normalized_value.text}
+            entidades.append(item)
+        return entidades
+
+
+    @staticmethod
+    def opcoes_requisicao(processor_id: str, opcoes: Optional[Dict] = None) -> Dict:
+        """
+        Monta as opções do process_document para um processador.
+        Prioridade: opções do job > DOCUMENTAI_REQUEST_OPTIONS_POR_PROCESSADOR > DOCUMENTAI_REQUEST_OPTIONS.
+        """
+        combinadas = dict(getattr(settings, "DOCUMENTAI_REQUEST_OPTIONS", {}))
+        combinadas.update(getattr(settings, "DOCUMENTAI_REQUEST_OPTIONS_POR_PROCESSADOR", {}).get(processor_id, {}))
+        combinadas.update(opcoes or {})
+        return combinadas
+
+
+    @staticmethod
+    def contar_paginas(file_content: bytes) -> Optional[int]:
+        """Conta as páginas do PDF localmente; retorna None se o PDF não puder ser lido."""
+        try:
+            return len(PyPDF2.PdfReader(io.BytesIO(file_content)).pages)
+        except Exception as e:
+            logger.warning(f"Não foi possível contar as páginas do PDF: {e}")
+            return None
+
+
+    def montar_requisicao(self, name: str, file_content: bytes, opcoes: Dict) -> Dict:
+        """
+        Monta a requisição do process_document aplicando:
+        - field_mask: só os campos do Document que serão usados (ex.: "entities" ou "entities,text")
+        - paginas: processa só as N primeiras páginas (0 = todas)
+        """
+        document = {"content": file_content, "mime_type": "application/pdf"}
+        request = {"name": name, "raw_document": document}
+
+        field_mask = opcoes.get("field_mask")
+        if field_mask:
+            paths = field_mask.split(",") if isinstance(field_mask, str) else field_mask
+            request["field_mask"] = field_mask_pb2.FieldMask(paths=[p.strip() for p in paths if p.strip()])
+
+        paginas = int(opcoes.get("paginas") or 0)
+        if paginas > 0:
+            # Só restringe se o PDF tiver mais páginas: a API recusa páginas inexistentes
+            total_paginas = self.contar_paginas(file_content)
+            if total_paginas and total_paginas > paginas:
+                request["process_options"] = {
+                    "individual_page_selector": {"pages": list(range(1, paginas + 1))}
+                }
+
+        return request
+
+
+    # Erros de cota/disponibilidade do DocumentAI que valem nova tentativa
+    ERROS_COTA = (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable)
+    # Falhas transitórias que a tarefa retenta no nível do arquivo (não podem virar XML vazio)
+    ERROS_TRANSITORIOS = (google_exceptions.DeadlineExceeded, google_exceptions.InternalServerError)
+
+    def _process_document_com_backoff(self, project_id: str, location: str, request: Dict):
+        """
+        Chama o process_document respeitando o rate limiter do cluster e, em
+        RESOURCE_EXHAUSTED/UNAVAILABLE, retenta com backoff exponencial e jitter.
+        """
+        max_tentativas = settings.DOCUMENTAI_MAX_TENTATIVAS
+        for tentativa in range(1, max_tentativas + 1):
+            DocumentAIRateLimiter.aguardar_vez(project_id, location)
+            try:
+                return self.client.process_document(request=request)
+            except self.ERROS_COTA as e:
+                if tentativa == max_tentativas:
+                    logger.error(f"[DocumentAI] Cota/serviço indisponível após {tentativa} tentativas: {e}")
+                    raise
+                espera = calcular_backoff(tentativa, settings.DOCUMENTAI_BACKOFF_BASE, settings.DOCUMENTAI_BACKOFF_MAX)
+                logger.warning(
+                    f"[DocumentAI] {type(e).__name__} na tentativa {tentativa}/{max_tentativas}; "
+                    f"nova tentativa em {espera:.2f}s"
+                )
+                DocumentAIRateLimiter.registrar_backoff(espera)
+                time.sleep(espera)
+
+
     # método para processar o PDF carregado pelo usuário
-    def processar_pdf(self, project_id: str, location: str, processor_id: str, file_content: bytes) -> Dict:
+    def processar_pdf(self, project_id: str, location: str, processor_id: str, file_content: bytes,
+                      documento_completo: bool = False, opcoes: Optional[Dict] = None) -> Dict:
         
-        """Processa o PDF diretamente dos dados binários"""
+        """
+        Processa o PDF diretamente dos dados binários.
+        Por padrão retorna só {"entities": [...]}, que é o que mapear_campos usa.
+        Use documento_completo=True (ex.: para depuração) para obter o Document inteiro em JSON.
+        :param opcoes: sobrescreve field_mask/paginas para esta chamada (ver opcoes_requisicao)
+        """
         if not file_content:            
             logger.warning(f"O conteúdo não pode ser vazio")
             return {}
         
-        document = {"content": file_content, "mime_type": "application/pdf"}
         name = f"projects/{project_id}/locations/{location}/processors/{processor_id}"
-        request = {"name": name, "raw_document": document}
+        request = self.montar_requisicao(name, file_content, self.opcoes_requisicao(processor_id, opcoes))
 
         try:
-            result = self.client.process_document(request=request)
+            result = self._process_document_com_backoff(project_id, location, request)
             # logger.info(f"Documento processado com sucesso: {result.name}")
             document_obj = result.document
             # print(f"Aqui está o resultado: {document_obj.text}")
-            return json.loads(MessageToJson(document_obj._pb))
+            if documento_completo:
+                return json.loads(MessageToJson(document_obj._pb))
+            return {"entities": self.extrair_entidades(document_obj)}
+        except self.ERROS_COTA + self.ERROS_TRANSITORIOS:
+            # Não devolve {}: isso geraria um XML vazio sem nenhum aviso
+            raise
         except Exception as e:
             print(f"Erro ao processar o documento: {e}")
             return {}
@@ -282,81 +456,84 @@ class CidadeIBGELoader:
 class ExcelGenerator:
     """Gera um arquivo Excel com os dados extraídos."""
     
-    @staticmethod
-    def gerar_excel(arquivos_resultado: dict, nome_arquivo: str = "dados_nfse.xlsx") -> bytes:
+    NS = {"n": "http://www.abrasf.org.br/nfse.xsd"}  # namespace do XML
+
+    @classmethod
+    def extrair_linha(cls, nome_arquivo: str, xml_str: str) -> dict:
         """
-        Gera um arquivo Excel consolidado a partir do dicionário {nome_arquivo: xml}.
-        Extrai os campos do XML considerando namespace ABRASF.
+        Extrai a linha do relatório de um XML ABRASF.
+        Permite montar o relatório à medida que cada nota fica pronta, sem guardar os XMLs.
         """
-        if not arquivos_resultado:
-            raise ValueError("Nenhum dado fornecido para gerar o Excel")
-
-        ns = {"n": "http://www.abrasf.org.br/nfse.xsd"}  # namespace do XML
-        linhas = []
+        ns = cls.NS
+        try:
+            root = ET.fromstring(xml_str)
+
+            # busca com namespace
+            data_emissao = root.find(".//n:DataEmissao", ns)
+            numero = root.find(".//n:Numero", ns)
+            base_calculo = root.find(".//n:ValoresNfse/n:BaseCalculo", ns)
+            valor_total = root.find(".//n:Servico/n:Valores/n:ValorServicos", ns)
+            valor_iss = root.find(".//n:ValoresNfse/n:ValorIss", ns)
+            prestador_cnpj = root.find(".//n:PrestadorServico/n:IdentificacaoPrestador/n:CpfCnpj/n:Cnpj", ns)
+            prestador_razao = root.find(".//n:PrestadorServico/n:RazaoSocial", ns)
+            tomador_cnpj = root.find(".//n:Tomador/n:IdentificacaoTomador/n:CpfCnpj/n:Cnpj", ns)
+            tomador_razao = root.find(".//n:Tomador/n:RazaoSocial", ns)
+            valor_ir = root.find(".//n:Servico/n:Valores/n:ValorIr", ns)
+            valor_inss = root.find(".//n:Servico/n:Valores/n:ValorInss", ns)
+            valor_liquido = root.find(".//n:ValoresNfse/n:ValorLiquidoNfse", ns)
+            valor_deducoes = root.find(".//n:Servico/n:Valores/n:ValorDeducoes", ns)
+            valor_pis = root.find(".//n:Servico/n:Valores/n:ValorPis", ns)
+            valor_cofins = root.find(".//n:Servico/n:Valores/n:ValorCofins", ns)
+            item_lista_servico = root.find(".//n:Servico/n:ItemListaServico", ns)
+            descricao_servico = root.find(".//n:Servico/n:Discriminacao", ns)
+            codigo_municipio_prestador = root.find(".//n:PrestadorServico/n:Endereco/n:CodigoMunicipio", ns)
+            codigo_municipio_tomador = root.find(".//n:Tomador/n:Endereco/n:CodigoMunicipio", ns)
+            outras_retencoes = root.find(".//n:Servico/n:Valores/n:OutrasRetencoes", ns)
+            descontos_condicionados = root.find(".//n:Servico/n:Valores/n:DescontoCondicionado", ns)
+            descontos_incondicionados = root.find(".//n:Servico/n:Valores/n:DescontoIncondicional", ns)
+
+            linha = {
+                "Data Relatório": datetime.now(timezone.utc).astimezone().strftime("%d-%m-%Y %H:%M:%S"),
+                "Arquivo": nome_arquivo,
+                "Numero Nota": numero.text if numero is not None else "",
+                "Base de Cálculo": base_calculo.text if base_calculo is not None else "",
+                "Valor ISS": valor_iss.text if valor_iss is not None else "",
+                "Valor Total da Nota": valor_total.text if valor_total is not None else "",
+                "Prestador Razão Social": prestador_razao.text if prestador_razao is not None else "",
+                "Prestador CNPJ": prestador_cnpj.text if prestador_cnpj is not None else "",
+                "Tomador Razão Social": tomador_razao.text if tomador_razao is not None else "",
+                "Tomador CNPJ": tomador_cnpj.text if tomador_cnpj is not None else "",
+                "Data Emissão": data_emissao.text if data_emissao is not None else "",
+                "Valor IR": valor_ir.text if valor_ir is not None else "",
+                "Valor INSS": valor_inss.text if valor_inss is not None else "",
+                "Valor Líquido": valor_liquido.text if valor_liquido is not None else "",
+                "Valor Deduções": valor_deducoes.text if valor_deducoes is not None else "",
+                "Valor PIS": valor_pis.text if valor_pis is not None else "",
+                "Valor COFINS": valor_cofins.text if valor_cofins is not None else "",
+                "Item Lista Serviço": item_lista_servico.text if item_lista_servico is not None else "",
+                "Descricao Serviço": descricao_servico.text if descricao_servico is not None else "",
+                "Código Município Prestador": codigo_municipio_prestador.text if codigo_municipio_prestador is not None else "",
+                "Código Município Tomador": codigo_municipio_tomador.text if codigo_municipio_tomador is not None else "",
+                "Outras Retenções": outras_retencoes.text if outras_retencoes is not None else "",
+                "Descontos Condicionados": descontos_condicionados.text if descontos_condicionados is not None else "",
+                "Descontos Incondicionados": descontos_incondicionados.text if descontos_incondicionados is not None else "",
+            }
+
+            print(f"✅ Dados extraídos do arquivo {nome_arquivo}: {linha}")
+            return linha
 
-        for nome_arquivo, xml_str in arquivos_resultado.items():
-            try:
-                root = ET.fromstring(xml_str)
-
-                # busca com namespace
-                data_emissao = root.find(".//n:DataEmissao", ns)
-                numero = root.find(".//n:Numero", ns)
-                base_calculo = root.find(".//n:ValoresNfse/n:BaseCalculo", ns)
-                valor_total = root.find(".//n:Servico/n:Valores/n:ValorServicos", ns)
-                valor_iss = root.find(".//n:ValoresNfse/n:ValorIss", ns)
-                prestador_cnpj = root.find(".//n:PrestadorServico/n:IdentificacaoPrestador/n:CpfCnpj/n:Cnpj", ns)
-                prestador_razao = root.find(".//n:PrestadorServico/n:RazaoSocial", ns)
-                tomador_cnpj = root.find(".//n:Tomador/n:IdentificacaoTomador/n:CpfCnpj/n:Cnpj", ns)
-                tomador_razao = root.find(".//n:Tomador/n:RazaoSocial", ns)
-                valor_ir = root.find(".//n:Servico/n:Valores/n:ValorIr", ns)
-                valor_inss = root.find(".//n:Servico/n:Valores/n:ValorInss", ns)
-                valor_liquido = root.find(".//n:ValoresNfse/n:ValorLiquidoNfse", ns)
-                valor_deducoes = root.find(".//n:Servico/n:Valores/n:ValorDeducoes", ns)
-                valor_pis = root.find(".//n:Servico/n:Valores/n:ValorPis", ns)
-                valor_cofins = root.find(".//n:Servico/n:Valores/n:ValorCofins", ns)
-                item_lista_servico = root.find(".//n:Servico/n:ItemListaServico", ns)
-                descricao_servico = root.find(".//n:Servico/n:Discriminacao", ns)
-                codigo_municipio_prestador = root.find(".//n:PrestadorServico/n:Endereco/n:CodigoMunicipio", ns)
-                codigo_municipio_tomador = root.find(".//n:Tomador/n:Endereco/n:CodigoMunicipio", ns)
-                outras_retencoes = root.find(".//n:Servico/n:Valores/n:OutrasRetencoes", ns)
-                descontos_condicionados = root.find(".//n:Servico/n:Valores/n:DescontoCondicionado", ns)
-                descontos_incondicionados = root.find(".//n:Servico/n:Valores/n:DescontoIncondicional", ns)
-
-                linhas.append({
-                    "Data Relatório": datetime.now(timezone.utc).astimezone().strftime("%d-%m-%Y %H:%M:%S"),
-                    "Arquivo": nome_arquivo,
-                    "Numero Nota": numero.text if numero is not None else "",
-                    "Base de Cálculo": base_calculo.text if base_calculo is not None else "",
-                    "Valor ISS": valor_iss.text if valor_iss is not None else "",
-                    "Valor Total da Nota": valor_total.text if valor_total is not None else "",
-                    "Prestador Razão Social": prestador_razao.text if prestador_razao is not None else "",
-                    "Prestador CNPJ": prestador_cnpj.text if prestador_cnpj is not None else "",
-                    "Tomador Razão Social": tomador_razao.text if tomador_razao is not None else "",
-                    "Tomador CNPJ": tomador_cnpj.text if tomador_cnpj is not None else "",
-                    "Data Emissão": data_emissao.text if data_emissao is not None else "",
-                    "Valor IR": valor_ir.text if valor_ir is not None else "",
-                    "Valor INSS": valor_inss.text if valor_inss is not None else "",
-                    "Valor Líquido": valor_liquido.text if valor_liquido is not None else "",
-                    "Valor Deduções": valor_deducoes.text if valor_deducoes is not None else "",
-                    "Valor PIS": valor_pis.text if valor_pis is not None else "",
-                    "Valor COFINS": valor_cofins.text if valor_cofins is not None else "",
-                    "Item Lista Serviço": item_lista_servico.text if item_lista_servico is not None else "",
-                    "Descricao Serviço": descricao_servico.text if descricao_servico is not None else "",
-                    "Código Município Prestador": codigo_municipio_prestador.text if codigo_municipio_prestador is not None else "",
-                    "Código Município Tomador": codigo_municipio_tomador.text if codigo_municipio_tomador is not None else "",
-                    "Outras Retenções": outras_retencoes.text if outras_retencoes is not None else "",
-                    "Descontos Condicionados": descontos_condicionados.text if descontos_condicionados is not None else "",
-                    "Descontos Incondicionados": descontos_incondicionados.text if descontos_incondicionados is not None else "",
-                })
-
-                print(f"✅ Dados extraídos do arquivo {nome_arquivo}: {linhas[-1]}")
+        except Exception as e:
+            print(f"❌ Erro ao processar XML do arquivo {nome_arquivo}: {e}")
+            return {
+                "Arquivo": nome_arquivo,
+                "Numero Nota": "ERRO",
+            }
 
-            except Exception as e:
-                linhas.append({
-                    "Arquivo": nome_arquivo,
-                    "Numero Nota": "ERRO",
-                })
-                print(f"❌ Erro ao processar XML do arquivo {nome_arquivo}: {e}")
+    @staticmethod
+    def gerar_excel_linhas(linhas: list) -> bytes:
+        """Gera o Excel a partir de linhas já extraídas com extrair_linha."""
+        if not linhas:
+            raise ValueError("Nenhum dado fornecido para gerar o Excel")
 
         # Cria DataFrame com todas as colunas preenchidas
         df = pd.DataFrame(linhas)
@@ -366,12 +543,93 @@ class ExcelGenerator:
         df.to_excel(excel_buffer, index=False)
         excel_buffer.seek(0)
         return excel_buffer.getvalue()
-        
+
+    @classmethod
+    def gerar_excel(cls, arquivos_resultado: dict, nome_arquivo: str = "dados_nfse.xlsx") -> bytes:
+        """
+        Gera um arquivo Excel consolidado a partir do dicionário {nome_arquivo: xml}.
+        Extrai os campos do XML considerando namespace ABRASF.
+        """
+        if not arquivos_resultado:
+            raise ValueError("Nenhum dado fornecido para gerar o Excel")
+
+        linhas = [cls.extrair_linha(nome, xml_str) for nome, xml_str in arquivos_resultado.items()]
+        return cls.gerar_excel_linhas(linhas)
+
+
+
+class SchemaRegistry:
+    """
+    Esquemas XSD do ABRASF compilados uma vez e reaproveitados em todas as notas.
+    O XSD de cada versão é lido e parseado uma única vez por processo; o XMLSchema compilado
+    fica por thread, porque os validadores do lxml não podem ser usados por várias threads
+    ao mesmo tempo (processar_pdfs valida em paralelo no pool de threads).
+    """
+
+    _documentos: Dict[str, "etree._ElementTree"] = {}
+    _lock = threading.Lock()
+    _local = threading.local()
+
+    @staticmethod
+    def caminhos() -> Dict[str, Optional[str]]:
+        """Arquivo XSD de cada versão do ABRASF (ABRASF_XSD_VERSOES nas settings)."""
+        return settings.ABRASF_XSD_VERSOES
+
+    @classmethod
+    def _documento(cls, caminho: str):
+        documento = cls._documentos.get(caminho)
+        if documento is None:
+            with cls._lock:
+                documento = cls._documentos.get(caminho)
+                if documento is None:
+                    documento = etree.parse(caminho)
+                    cls._documentos[caminho] = documento
+        return documento
+
+    @classmethod
+    def obter_por_caminho(cls, caminho: str) -> etree.XMLSchema:
+        schemas = getattr(cls._local, "schemas", None)
+        if schemas is None:
+            schemas = cls._local.schemas = {}
+        schema = schemas.get(caminho)
+        if schema is None:
+            schema = etree.XMLSchema(cls._documento(caminho))
+            schemas[caminho] = schema
+        return schema
+
+    @classmethod
+    def disponivel(cls, versao: str) -> bool:
+        """Se há um arquivo XSD configurado e existente para a versão."""
+        caminho = cls.caminhos().get(versao)
+        return bool(caminho) and os.path.exists(caminho)
+
+    @classmethod
+    def obter(cls, versao: str) -> etree.XMLSchema:
+        caminho = cls.caminhos().get(versao)
+        if not caminho or not os.path.exists(caminho):
+            raise ValueError(f"XSD da versão {versao} do ABRASF não disponível")
+        return cls.obter_por_caminho(caminho)
 
 
 class ValidatorXSD:
     """Valida um XML contra um esquema XSD."""
-    
+
+    @staticmethod
+    def validar_elemento(elemento, versao: str) -> Tuple[bool, list]:
+        """
+        Valida a árvore lxml já montada, sem serializar e parsear de novo.
+        Os elementos precisam estar no namespace do ABRASF (ver XMLGenerator).
+        :return: (valido: bool, erros: list[str])
+        """
+        try:
+            schema = SchemaRegistry.obter(versao)
+            if schema.validate(elemento):
+                return True, []
+            return False, [f"linha {e.line}: {e.message}" if e.line else str(e.message) for e in schema.error_log]
+        except Exception as e:
+            logger.error(f"[XSD] Erro ao validar XML: {e}")
+            return False, [str(e)]
+
     @staticmethod
     def validar_xml_abrasf(xml_str: str, caminho_xsd: str) -> Tuple[bool, list]:
         """
@@ -383,9 +641,7 @@ class ValidatorXSD:
         """
         try:
             xml_doc = etree.fromstring(xml_str.encode("utf-8"))
-            with open(caminho_xsd, "rb") as f:
-                xsd_doc = etree.XML(f.read())
-            schema = etree.XMLSchema(xsd_doc)
+            schema = SchemaRegistry.obter_por_caminho(caminho_xsd)
 
             if schema.validate(xml_doc):
                 return True, []
@@ -570,32 +826,14 @@ class XMLGenerator:
         # print(f"[DEBUG] ufPrestador normalizado: {uf_normalizado}")
         # print(f"[DEBUG] chave_exata formada: {chave_exata}")
 
-        # Busca exata
-        if chave_exata in cidades_ibge.CIDADES_IBGE:
-            return cidades_ibge.CIDADES_IBGE[chave_exata]
-
-        # Busca parcial
-        for chave, codigo in cidades_ibge.CIDADES_IBGE.items():
-            try:
-                nome_dicionario, uf_dicionario = chave.split("-")
-            except ValueError:
-                continue
-
-            if nome_dicionario == nome_normalizado and uf_dicionario == uf_normalizado:
-                return codigo
-
-        for chave, codigo in cidades_ibge.CIDADES_IBGE.items():
-            if nome_normalizado in chave and f"-{uf_normalizado}" in chave:
-                logger.warning(f"[CodigoMunicipio] Correspondência parcial encontrada: '{chave}' para '{nome_municipio}-{uf}'")
-                return codigo
-
-        # Sugestão por similaridade
-        chaves_possiveis = list(cidades_ibge.CIDADES_IBGE.keys())
-        similares = get_close_matches(chave_exata, chaves_possiveis, n=1, cutoff=0.80)
-        if similares:
-            sugestao = similares[0]
-            logger.warning(f"[CodigoMunicipio] Sugestão de chave similar encontrada: '{sugestao}' para '{chave_exata}'")
-            return cidades_ibge.CIDADES_IBGE[sugestao]
+        # Busca indexada por UF (exata, parcial e por similaridade), memoizada por (nome, UF)
+        codigo, chave, tipo = cidades_ibge.resolver_codigo_municipio(nome_normalizado, uf_normalizado)
+        if tipo == "parcial":
+            logger.warning(f"[CodigoMunicipio] Correspondência parcial encontrada: '{chave}' para '{nome_municipio}-{uf}'")
+        elif tipo == "similar":
+            logger.warning(f"[CodigoMunicipio] Sugestão de chave similar encontrada: '{chave}' para '{chave_exata}'")
+        if codigo:
+            return codigo
 
         logger.warning(f"[CodigoMunicipio] Município '{nome_municipio}-{uf}' não encontrado na base IBGE.")
         return ""
@@ -604,12 +842,36 @@ class XMLGenerator:
 
         
     
+    @classmethod
+    def _qualificar(cls, root):
+        """
+        Coloca os elementos criados sem namespace no namespace do ABRASF. Com o namespace
+        padrão declarado na raiz, o XML serializado continua sem prefixos, e a árvore em
+        memória pode ser validada direto pelo XSD.
+        """
+        prefixo = f"{{{cls.NAMESPACE}}}"
+        for elemento in root.iter():
+            if isinstance(elemento.tag, str) and not elemento.tag.startswith("{"):
+                elemento.tag = prefixo + elemento.tag
+
     @classmethod
     def gerar_xml_abrasf(cls, dados: Dict) -> str:
+        """Gera o XML ABRASF da nota (ver gerar_xml_abrasf_validado)."""
+        return cls.gerar_xml_abrasf_validado(dados)[0]
+
+    @classmethod
+    def gerar_xml_abrasf_validado(cls, dados: Dict) -> Tuple[str, Optional[bool], list]:
+        """
+        Gera o XML ABRASF e o valida contra o XSD compilado (SchemaRegistry) da versão
+        XSD_VERSAO_GERADOR. Apesar do atributo versao="1.00", a estrutura gerada segue o layout
+        2.0x (ValoresNfse e DeclaracaoPrestacaoServico dentro de InfNfse). Com XSD_VERSAO_GERADOR
+        vazio a validação está desligada e o XML não é validado.
+        :return: (xml_str, valido (None se não validado), erros de validação)
+        """
         print(f"Dados recebidos para geração do XML: {json.dumps(dados, indent=4, ensure_ascii=False)}")
 
         # Criação dos elementos principais
-        root = etree.Element("CompNfse", xmlns="http://www.abrasf.org.br/nfse.xsd")
+        root = etree.Element(f"{{{cls.NAMESPACE}}}CompNfse", nsmap=cls.nsmap)
         nfse = etree.SubElement(root, "Nfse", versao="1.00")
         inf_nfse = etree.SubElement(nfse, "InfNfse", Id="")
 
@@ -1092,18 +1354,21 @@ class XMLGenerator:
             # Cria a tag XML apenas uma vez, com o valor final decidido
             etree.SubElement(valores_nfse, "ValorLiquidoNfse").text = f"{Decimal(valor_liquido_nfse):.2f}"
 
+        # Valida a própria árvore em memória, antes de serializar
+        cls._qualificar(root)
+        versao_xsd = settings.XSD_VERSAO_GERADOR
+        if not versao_xsd:
+            valido, erros = None, []
+        else:
+            valido, erros = ValidatorXSD.validar_elemento(root, versao_xsd)
+            if valido:
+                logger.info("XML gerado e validado com sucesso.")
+            else:
+                logger.warning(f"XML gerado fora do XSD ABRASF {versao_xsd}: {erros[:5]}")
+
         # Gerando o XML em formato string
         xml_str = etree.tostring(root, pretty_print=True, encoding="UTF-8").decode("utf-8")
-        # Valida o XML gerado
-        try:
-            validador = ValidatorXSD()
-            validador.validar_xml_abrasf(xml_str,
-                                         caminho_xsd="nfse.xsd")
-            logger.info("XML gerado e validado com sucesso.")
-        except Exception as e:
-            logger.error(f"Erro ao validar o XML gerado: {e}")
-            raise
 
         # Imprime o XML gerado
         print(f"XML gerado: {xml_str}")
-        return xml_str
\ No newline at end of file
+        return xml_str, valido, erros
\ No newline at end of file
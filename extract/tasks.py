@@ -1,23 +1,98 @@
 import os
 import io
 import zipfile
+import tempfile
 import base64
-from celery import shared_task
-from .services import DocumentAIProcessor
+from celery import shared_task, chord, chain
+from celery.signals import worker_process_init, before_task_publish, task_prerun, task_postrun
+from .services import DocumentAIProcessor, DocumentAIClientPool
 from .services import XMLGenerator, ExcelGenerator, EmailSender
-from .models import ArquivoZip, TaskStatusModel, FilesProccess
+from .models import ArquivoZip, TaskStatusModel, FilesProccess, ArquivoProcessado
 import logging
 import PyPDF2
-from extract.minio_service import download_file_from_minio
+from extract.minio_service import download_file_from_minio, upload_result_archive
 import json
 from django.conf import settings
 from datetime import datetime
 import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from collections import deque
+from django.db import connection
+from .ocr_cache import DocumentAICache, OCRSingleFlight
+from .text_layer import TextLayerExtractor
+from .layout_templates import LayoutTemplateStore
+from .pdf_preflight import PDFPreflight
+from .autoscaler import MetricasFilas
+from .progresso import ProgressoJob
+from .rate_limiter import calcular_backoff
+from google.api_core import exceptions as google_exceptions
+from botocore import exceptions as botocore_exceptions
+from nfse_abrasf.celery_config import FILA_PIPELINE_CPU
 
 
 
 logger = logging.getLogger(__name__)
 
+
+# Falhas transitórias (DocumentAI, S3, rede) em que o arquivo é processado de novo com backoff;
+# qualquer outro erro (PDF corrompido, XML inválido, ...) vai direto para a lista de falhas.
+# RESOURCE_EXHAUSTED/UNAVAILABLE ficam de fora: já são retentados com backoff na chamada ao
+# DocumentAI (DocumentAIProcessor._process_document_com_backoff) e chegam aqui esgotados
+ERROS_RETENTAVEIS = (
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    botocore_exceptions.EndpointConnectionError,
+    botocore_exceptions.ConnectionClosedError,
+    botocore_exceptions.ReadTimeoutError,
+    botocore_exceptions.ConnectTimeoutError,
+    ConnectionError,
+    TimeoutError,
+)
+# Códigos de erro do S3 que indicam indisponibilidade momentânea
+CODIGOS_S3_RETENTAVEIS = {"SlowDown", "InternalError", "ServiceUnavailable", "RequestTimeout", "500", "503"}
+
+
+@worker_process_init.connect
+def inicializar_pool_documentai(**kwargs):
+    """
+    Abre os canais gRPC do DocumentAI uma única vez por processo do worker.
+    Precisa rodar depois do fork: canais gRPC não podem ser herdados do processo pai.
+    """
+    try:
+        DocumentAIClientPool.inicializar()
+    except Exception as e:
+        # O pool é criado sob demanda na primeira tarefa se falhar aqui
+        logger.error(f"Erro ao iniciar o pool do DocumentAI: {e}", exc_info=True)
+
+
+@before_task_publish.connect
+def marcar_enfileiramento(headers=None, **kwargs):
+    """Carimba a hora de publicação, usada pelo autoscaler para medir a idade das mensagens na fila."""
+    if headers is not None:
+        headers.setdefault("enfileirado_em", time.time())
+
+
+# Início de cada tarefa em execução neste processo, para medir a duração no task_postrun
+_inicio_tarefas = {}
+
+
+@task_prerun.connect
+def marcar_inicio_tarefa(task_id=None, **kwargs):
+    _inicio_tarefas[task_id] = time.monotonic()
+
+
+@task_postrun.connect
+def registrar_duracao_tarefa(task_id=None, task=None, **kwargs):
+    """Registra a duração da tarefa na fila em que ela foi entregue (métrica do autoscaler)."""
+    inicio = _inicio_tarefas.pop(task_id, None)
+    if inicio is None or task is None:
+        return
+    fila = (task.request.delivery_info or {}).get("routing_key")
+    MetricasFilas.registrar_duracao(fila, time.monotonic() - inicio)
+
+
 def update_task_status(task_id, status, result=None):
     """
     Atualiza o status de uma tarefa no banco de dados.
@@ -132,81 +207,357 @@ def gerar_excel(self, files_data):
 
 
 
-@shared_task(bind=True)
-def processar_pdfs(self, file_keys, enable_duplicates=False):
+def _extrair_dados(processor, project_id, location, processor_id, file_key, opcoes_documentai=None):
     """
-    Processa múltiplos PDFs já enviados via presigned URL para o MinIO.
-    :param file_keys: lista de chaves (keys) no bucket, ex: ["uploads/20240823_arquivo1.pdf"]
+    Etapa de extração (predominantemente I/O): baixa o PDF do bucket e obtém os campos da nota.
+    PDFs já processados anteriormente (mesmo SHA-256) são atendidos pelo cache sem OCR,
+    e PDFs digitais com camada de texto confiável (regras genéricas ou template aprendido
+    da prefeitura) são extraídos localmente; os demais vão ao DocumentAI.
+    :return: dicionário de campos mapeados (entrada de XMLGenerator.gerar_xml_abrasf)
     """
-    update_task_status(self.request.id, 'PROCESSANDO')
+    file_name = file_key.split('/')[-1]
+
+    logger.info(f"Baixando arquivo do Addon Bucketeer: {file_key}")
+
+    # Baixa o arquivo do MinIO
+    pdf_bytes = download_file_from_minio(file_key)
+    logger.info(f"Arquivo baixado: {file_name}, tamanho: {len(pdf_bytes)} bytes")
+
+    # Gera uma hash SHA256 para identificar arquivos já processados; a chave do cache inclui o
+    # processador e as opções efetivas do DocumentAI, já que outro processador ou um job com
+    # field_mask/paginas reduzidos extrai campos diferentes do mesmo PDF
+    file_hash = DocumentAICache.calcular_hash(pdf_bytes)
+    chave_cache = DocumentAICache.calcular_chave(
+        file_hash, processor_id, DocumentAIProcessor.opcoes_requisicao(processor_id, opcoes_documentai),
+    )
+    dados_extraidos = DocumentAICache.obter(chave_cache)
+    if dados_extraidos is not None:
+        logger.info(f"Dados de {file_name} obtidos do cache sem chamar o DocumentAI ({file_hash})")
+        return dados_extraidos
+
+    # O mesmo PDF pode estar sendo extraído agora por outro job: espera o resultado dele
+    # em vez de repetir a chamada ao DocumentAI
+    token, dados_extraidos = OCRSingleFlight.adquirir_ou_aguardar(chave_cache)
+    if dados_extraidos is not None:
+        return dados_extraidos
     try:
-        processor = DocumentAIProcessor()
-        project_id = os.getenv("PROJECT_ID")
-        print(f"Project ID: {project_id}")
-        location = os.getenv("LOCATION")
-        print(f"Location: {location}")
-        processor_id = os.getenv("PROCESSOR_ID")
-        print(f"Processor ID: {processor_id}")
-
-        total_files = len(file_keys)
-        processed_files = 0
-        arquivos_resultado = {}  # Vai armazenar {nome_arquivo: xml_content_string}
-        erros = []
+        return _extrair_dados_novos(processor, project_id, location, processor_id, file_name, file_hash,
+                                    chave_cache, pdf_bytes, opcoes_documentai)
+    finally:
+        OCRSingleFlight.liberar(chave_cache, token)
 
-        # Criar ZIP em memória para download
-        zip_buffer = io.BytesIO()
 
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+def _extrair_dados_novos(processor, project_id, location, processor_id, file_name, file_hash, chave_cache,
+                         pdf_bytes, opcoes_documentai=None):
+    """
+    Extrai os campos de um PDF fora do cache (camada de texto, template aprendido ou DocumentAI)
+    e grava o resultado no DocumentAICache sob chave_cache (file_hash é o SHA-256 do PDF).
+    """
+    dados_extraidos = None
+    texto = None
+    if settings.TEXT_LAYER_ENABLED or settings.LAYOUT_TEMPLATES_ENABLED:
+        texto = TextLayerExtractor.extrair_texto(pdf_bytes)
+        if not TextLayerExtractor.possui_camada_texto(texto):
+            texto = None
+
+    if texto and settings.TEXT_LAYER_ENABLED:
+        # PDFs digitais das prefeituras trazem o texto embutido: tenta extrair sem OCR
+        dados_locais, confianca = TextLayerExtractor.extrair(pdf_bytes, texto=texto)
+        if confianca >= settings.TEXT_LAYER_MIN_CONFIANCA:
+            logger.info(f"Campos extraídos da camada de texto: {file_name} (confiança {confianca:.2f})")
+            dados_extraidos = dados_locais
+            DocumentAICache.salvar(chave_cache, file_name, dados_extraidos, file_hash)
+        else:
+            logger.info(f"Confiança da camada de texto insuficiente ({confianca:.2f}): {file_name}")
+
+    if dados_extraidos is None and texto and settings.LAYOUT_TEMPLATES_ENABLED:
+        # Layout já aprendido da prefeitura a partir de resultados anteriores do DocumentAI
+        dados_template, template_id, confianca = LayoutTemplateStore.extrair(texto)
+        if dados_template is not None and confianca >= settings.LAYOUT_TEMPLATE_MIN_CONFIANCA:
+            logger.info(f"Campos extraídos pelo template de layout {template_id}: {file_name}")
+            dados_extraidos = dados_template
+            LayoutTemplateStore.registrar_uso(template_id)
+            DocumentAICache.salvar(chave_cache, file_name, dados_extraidos, file_hash)
+        elif dados_template is not None:
+            LayoutTemplateStore.registrar_falha(
+                template_id, f"Confiança {confianca:.2f} ao extrair {file_name}"
+            )
+
+    if dados_extraidos is not None:
+        logger.info(f"Dados de {file_name} obtidos sem chamar o DocumentAI ({file_hash})")
+    else:
+        # Reduz o payload do OCR (páginas finais vazias, metadados, imagens acima do DPI configurado)
+        pdf_ocr, relatorio = PDFPreflight.otimizar(pdf_bytes)
+        logger.info(f"Preflight de {file_name}: {relatorio['bytes_economizados']} bytes economizados, "
+                    f"{relatorio['paginas_removidas']} página(s) removida(s), "
+                    f"{relatorio['imagens_reduzidas']} imagem(ns) reduzida(s)")
+
+        # Processa com DocumentAI
+        document_json = processor.processar_pdf(project_id, location, processor_id, pdf_ocr,
+                                                opcoes=opcoes_documentai)
+        logger.info(f"Documento processado: {file_name}")
+
+        # Mapeia campos e guarda no cache para reenvios do mesmo PDF
+        dados_extraidos = processor.mapear_campos(document_json)
+        DocumentAICache.salvar(chave_cache, file_name, dados_extraidos, file_hash)
+
+        # Resultados completos do DocumentAI alimentam o template da prefeitura
+        if (texto and settings.LAYOUT_TEMPLATES_ENABLED
+                and TextLayerExtractor.calcular_confianca(dados_extraidos) >= settings.LAYOUT_TEMPLATE_MIN_CONFIANCA):
             try:
-                for file_key in file_keys:
-                    # Define o nome do arquivo a partir da chave
-                    file_name = file_key.split('/')[-1]  # Definido fora do try
-
-                    
-                    logger.info(f"Baixando arquivo do Addon Bucketeer: {file_key}")
-                    
-                    # Baixa o arquivo do MinIO
-                    pdf_bytes = download_file_from_minio(file_key)
-                    logger.info(f"Arquivo baixado: {file_name}, tamanho: {len(pdf_bytes)} bytes")
-                    
-                
-                    # Processa com DocumentAI
-                    document_json = processor.processar_pdf(project_id, location, processor_id, pdf_bytes)
-                    logger.info(f"Documento processado: {file_name}")
+                LayoutTemplateStore.aprender(texto, dados_extraidos)
+            except Exception as e:
+                logger.warning(f"Não foi possível atualizar o template de layout com {file_name}: {e}")
+
+    return dados_extraidos
+
+
+def _gerar_xml(file_name, dados_extraidos):
+    """
+    Etapa de geração (CPU): monta o XML ABRASF a partir dos campos extraídos e o valida contra o XSD
+    da versão XSD_VERSAO_GERADOR, quando configurada.
+    O resultado da validação só é registrado (xml_valido em ArquivoProcessado), não rejeita o arquivo.
+    :return: (xml_str, {"valido": bool ou None se não validado, "erros": [...]})
+    """
+    # Gera XML usando XMLGenerator, já validado contra o schema compilado
+    xml_str, valido, erros = XMLGenerator.gerar_xml_abrasf_validado(dados_extraidos)
+    logger.info(f"XML gerado para {file_name}, tamanho: {len(xml_str)} chars, válido: {valido}")
 
-                    # Mapeia campos e converte para XML válido
-                    dados_extraidos = processor.mapear_campos(document_json)
-                    # Gera XML válido usando XMLGenerator
-                    xml_str = XMLGenerator.gerar_xml_abrasf(dados_extraidos)
-                    logger.info(f"XML gerado para {file_name}, tamanho: {len(xml_str)} chars")
+    # Verifica se o XML é válido (começa com <)
+    if not xml_str.strip().startswith('<'):
+        raise ValueError(f"XML inválido gerado para {file_name}: não começa com '<'")
 
-                    # Verifica se o XML é válido (começa com <)
-                    if not xml_str.strip().startswith('<'):
-                        raise ValueError(f"XML inválido gerado para {file_name}: não começa com '<'")
+    return xml_str, {"valido": valido, "erros": erros}
 
-                    # Armazena o XML como string
+
+def _processar_arquivo(processor, project_id, location, processor_id, file_key, opcoes_documentai=None):
+    """
+    Baixa um PDF do bucket, extrai os campos (cache, camada de texto, template ou DocumentAI)
+    e gera o XML ABRASF.
+    Executada nas threads do pool de processar_pdfs, por isso não toca no ZIP.
+    :return: (string do XML gerado, resultado da validação XSD)
+    """
+    try:
+        dados_extraidos = _extrair_dados(processor, project_id, location, processor_id, file_key,
+                                         opcoes_documentai)
+        return _gerar_xml(file_key.split('/')[-1], dados_extraidos)
+
+    finally:
+        # Cada thread do pool abre sua própria conexão com o banco (cache)
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+
+
+
+def _xml_do_checkpoint(task_id, file_key):
+    """XML já gerado para o arquivo neste job (execução anterior interrompida), ou None."""
+    return (
+        ArquivoProcessado.objects
+        .filter(task_id=task_id, chave_arquivo=file_key, status="SUCESSO")
+        .values_list("xml", flat=True)
+        .first()
+    )
+
+
+def _erro_retentavel(erro):
+    if isinstance(erro, botocore_exceptions.ClientError):
+        return erro.response.get("Error", {}).get("Code") in CODIGOS_S3_RETENTAVEIS
+    return isinstance(erro, ERROS_RETENTAVEIS)
+
+
+def _xml_erro(file_name, erro):
+    """XML incluído no ZIP (e guardado em ArquivoProcessado) no lugar da nota que falhou."""
+    return f'''<?xml version="1.0" encoding="UTF-8"?>
+                                <Erro>
+                                    <Arquivo>{file_name}</Arquivo>
+                                    <Mensagem>{str(erro)}</Mensagem>
+                                </Erro>'''
+
+
+def _com_retentativas(file_name, funcao, *args):
+    """
+    Executa funcao(*args) retentando erros transitórios (ERROS_RETENTAVEIS) com backoff,
+    até PROCESSAMENTO_MAX_TENTATIVAS vezes.
+    :return: (resultado, tentativas usadas); na falha definitiva a exceção é relançada
+             com o atributo `tentativas`
+    """
+    max_tentativas = settings.PROCESSAMENTO_MAX_TENTATIVAS
+    for tentativa in range(1, max_tentativas + 1):
+        try:
+            return funcao(*args), tentativa
+        except Exception as e:
+            if tentativa < max_tentativas and _erro_retentavel(e):
+                espera = calcular_backoff(tentativa, settings.PROCESSAMENTO_BACKOFF_BASE,
+                                          settings.PROCESSAMENTO_BACKOFF_MAX)
+                logger.warning(f"{type(e).__name__} ao processar {file_name} "
+                               f"(tentativa {tentativa}/{max_tentativas}); nova tentativa em {espera:.2f}s")
+                time.sleep(espera)
+                continue
+            e.tentativas = tentativa
+            raise
+
+
+def _processar_com_checkpoint(task_id, progresso, processor, project_id, location, processor_id, file_key,
+                              opcoes_documentai=None):
+    """
+    Executa _processar_arquivo com checkpoint por arquivo: o XML é gravado em ArquivoProcessado
+    assim que a nota termina, e uma reentrega da mesma tarefa (worker reiniciado, OOM, deploy)
+    reaproveita os arquivos já concluídos em vez de baixar e processar de novo.
+    Cada arquivo é isolado: erros transitórios (ERROS_RETENTAVEIS) são retentados até
+    PROCESSAMENTO_MAX_TENTATIVAS vezes com backoff; a falha definitiva é gravada como ERRO
+    (lista de falhas do job, reprocessável em /api/task-files/<task_id>/reprocessar/) e não
+    interrompe os demais arquivos.
+    Também registra início, duração e erro do arquivo no progresso do job.
+    """
+    file_name = file_key.split('/')[-1]
+    try:
+        xml_str = _xml_do_checkpoint(task_id, file_key)
+        if xml_str is not None:
+            logger.info(f"Checkpoint encontrado para {file_name}, reaproveitando o XML")
+            progresso.arquivo_concluido(file_name, 0.0, reaproveitado=True)
+            return xml_str
+
+        progresso.arquivo_iniciado(file_name)
+        inicio = time.monotonic()
+        try:
+            (xml_str, validacao), tentativas = _com_retentativas(file_name, _processar_arquivo, processor,
+                                                                 project_id, location, processor_id, file_key,
+                                                                 opcoes_documentai)
+        except Exception as e:
+            _registrar_arquivo(task_id, file_key, xml_str=_xml_erro(file_name, e), erro=e,
+                               tentativas=getattr(e, "tentativas", 1))
+            progresso.arquivo_concluido(file_name, time.monotonic() - inicio, erro=str(e))
+            raise
+
+        _registrar_arquivo(task_id, file_key, xml_str=xml_str, tentativas=tentativas, validacao=validacao)
+        progresso.arquivo_concluido(file_name, time.monotonic() - inicio)
+        return xml_str
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+
+
+def _config_documentai():
+    """Projeto, região e processador do DocumentAI configurados no ambiente."""
+    return os.getenv("PROJECT_ID"), os.getenv("LOCATION"), os.getenv("PROCESSOR_ID")
+
+
+def _resultados_em_ordem(executor, file_keys, janela, funcao):
+    """
+    Submete funcao(file_key) ao executor com no máximo `janela` arquivos pendentes e
+    consome os futuros na ordem de file_keys, gerando (file_key, xml, erro).
+    Cada futuro é descartado assim que consumido e o próximo arquivo só é submetido então,
+    de modo que no máximo `janela` XMLs ficam em memória, qualquer que seja o tamanho do lote.
+    Um arquivo com erro não interrompe os demais: cada um tem o seu resultado.
+    """
+    pendentes = deque()
+    chaves = iter(file_keys)
+    for file_key in chaves:
+        pendentes.append((file_key, executor.submit(funcao, file_key)))
+        if len(pendentes) >= janela:
+            break
+
+    while pendentes:
+        file_key, futuro = pendentes.popleft()
+        try:
+            resultado = (file_key, futuro.result(), None)
+        except Exception as e:
+            resultado = (file_key, None, e)
+        del futuro
+        proxima = next(chaves, None)
+        if proxima is not None:
+            pendentes.append((proxima, executor.submit(funcao, proxima)))
+        yield resultado
+
+
+def _salvar_zip(arquivo_zip_tmp, zip_filename):
+    """Envia o ZIP montado em disco ao bucket e registra chave, tamanho e checksum no ArquivoZip."""
+    s3_key = f"{settings.RESULTADOS_S3_PREFIXO}/{zip_filename}"
+    tamanho, checksum = upload_result_archive(arquivo_zip_tmp, s3_key)
+    return ArquivoZip.objects.create(
+        nome_arquivo=zip_filename,
+        s3_key=s3_key,
+        tamanho=tamanho,
+        checksum=checksum,
+    )
+
+
+def _registrar_arquivo(task_id, file_key, xml_str=None, erro=None, tentativas=1, validacao=None):
+    """
+    Grava o XML (ou o erro) de um arquivo do job, com o resultado da validação XSD,
+    e devolve o id usado como referência no resultado.
+    """
+    registro, _ = ArquivoProcessado.objects.update_or_create(
+        task_id=task_id,
+        chave_arquivo=file_key,
+        defaults={
+            "nome_arquivo": file_key.split('/')[-1],
+            "status": "SUCESSO" if erro is None else "ERRO",
+            "xml": xml_str,
+            "erro": None if erro is None else str(erro),
+            "tentativas": tentativas,
+            "xml_valido": None if validacao is None else validacao["valido"],
+            "erros_validacao": None if validacao is None else validacao["erros"],
+        },
+    )
+    return registro.id
+
+
+def _montar_saida(task_id, file_keys, resultados):
+    """
+    Monta o ZIP com os XMLs (e XMLs de erro), o relatório Excel e o registro ArquivoZip,
+    e atualiza o TaskStatusModel. Usado tanto pelo modo em threads quanto pelo callback do chord.
+    Cada nota é gravada no ZIP (em arquivo temporário, não em memória) e vira uma linha do
+    relatório assim que chega, então o consumo de memória não cresce com o lote.
+    :param resultados: iterável de (file_key, xml_str, erro) na ordem de file_keys
+    Os XMLs ficam em ArquivoProcessado (gravados por arquivo em _processar_com_checkpoint);
+    o resultado da tarefa leva apenas as referências.
+    :return: dicionário de resultado esperado pelo TaskStatusView/dashboard
+    """
+    total_files = len(file_keys)
+    processed_files = 0
+    arquivos = {}  # {nome_arquivo: id do ArquivoProcessado}
+    concluidos = []  # (nome_arquivo, chave) dos XMLs gravados por checkpoint
+    falhas = []  # (nome_arquivo, chave, xml de erro, erro) dos arquivos que falharam
+    linhas_relatorio = []
+    erros = []
+
+    # Nome do arquivo ZIP
+    zip_filename = f"xmls_processados_{task_id}.zip"
+
+    with tempfile.TemporaryFile(prefix="xmls_processados_", suffix=".zip",
+                                dir=settings.RESULTADOS_TMP_DIR) as arquivo_zip_tmp:
+        with zipfile.ZipFile(arquivo_zip_tmp, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            for file_key, xml_str, erro in resultados:
+                # Define o nome do arquivo a partir da chave
+                file_name = file_key.split('/')[-1]
+
+                if erro is None:
+                    # O XML já foi gravado em ArquivoProcessado (checkpoint); o id é lido no final
                     xml_filename = file_name.replace('.pdf', '.xml')
-                    arquivos_resultado[file_name] = xml_str  # STRING do XML, não dict                    
-                    # Adiciona ao ZIP
+                    concluidos.append((file_name, file_key))
+                    # Adiciona ao ZIP e ao relatório
                     zip_file.writestr(xml_filename, xml_str.encode('utf-8'))
+                    linhas_relatorio.append(ExcelGenerator.extrair_linha(file_name, xml_str))
+                    processed_files += 1
+                    continue
+
+                error_msg = f"Erro ao processar {file_name}: {str(erro)}"
+                logger.error(error_msg, exc_info=erro if isinstance(erro, BaseException) else None)
+                erros.append(error_msg)
 
-                    # Gera uma hash SHA256 para identificar arquivos únicos
-                    # file_hash = hashlib.sha256(pdf_bytes).hexdigest()
-                    # hash_register = FilesProccess.objects.create(
-                    #     hash=file_hash,
-                    #     filename=xml_filename                        
-                    # )
-                    
+                # Adiciona XML de erro (a falha já foi registrada por _processar_com_checkpoint)
+                error_xml = _xml_erro(file_name, erro)
+                falhas.append((file_name, file_key, error_xml, erro))
+                zip_file.writestr(file_name.replace('.pdf', '_ERROR.xml'), error_xml.encode('utf-8'))
 
+            if linhas_relatorio:
                 # Gera relatório Excel
-                excel_bytes = ExcelGenerator.gerar_excel(arquivos_resultado)
+                excel_bytes = ExcelGenerator.gerar_excel_linhas(linhas_relatorio)
                 zip_file.writestr(f"relatorio.xlsx", excel_bytes)
                 logger.info(f"Relatório Excel adicionado ao ZIP, tamanho: {len(excel_bytes)} bytes")
-                processed_files += 1
-                logger.info(f"Arquivo {file_name} processado com sucesso")
 
                 # envia o relatório Excel por email
-                # date = datetime.strftime("%Y%m%d")
                 email_sender = EmailSender()
                 email_sender.send_email(
                     destinatario="mvinicius.madeira@gmail.com",
@@ -215,70 +566,241 @@ def processar_pdfs(self, file_keys, enable_duplicates=False):
                     anexos=[(f"relatorio_de_conversoes.xlsx", excel_bytes)]
                 )
 
-            except Exception as e:
-                error_msg = f"Erro ao processar {file_name}: {str(e)}"
-                logger.error(error_msg, exc_info=True)
-                erros.append(error_msg)
-                
-                # Adiciona XML de erro
-                error_xml = f'''<?xml version="1.0" encoding="UTF-8"?>
-                                <Erro>
-                                    <Arquivo>{file_name}</Arquivo>
-                                    <Mensagem>{str(e)}</Mensagem>
-                                </Erro>'''
-                arquivos_resultado[file_name] = error_xml
-                zip_file.writestr(file_name.replace('.pdf', '_ERROR.xml'), error_xml.encode('utf-8'))
-
-        # Salva ZIP no banco de dados
-        zip_buffer.seek(0)
-        zip_bytes = zip_buffer.getvalue()        
-        # Nome do arquivo ZIP
-        zip_filename = f"xmls_processados_{self.request.id}.zip"
-        
-        # Cria registro no banco
-        arquivo_zip = ArquivoZip.objects.create(
-            zip_bytes=zip_bytes,
-            nome_arquivo=zip_filename  # Agora funciona com o novo campo
+        arquivo_zip = _salvar_zip(arquivo_zip_tmp, zip_filename)
+
+    ids_registrados = dict(
+        ArquivoProcessado.objects.filter(task_id=task_id).values_list("chave_arquivo", "id")
+    )
+    for file_name, file_key in concluidos:
+        arquivos[file_name] = ids_registrados.get(file_key)
+    ids_falhas = {}
+    for file_name, file_key, error_xml, erro in falhas:
+        # Erros anteriores ao processamento do arquivo (ex.: banco indisponível no checkpoint) não foram gravados
+        ids_falhas[file_name] = ids_registrados.get(file_key) or _registrar_arquivo(
+            task_id, file_key, xml_str=error_xml, erro=erro
         )
-        
-        logger.info(f"ZIP salvo no banco com ID: {arquivo_zip.id}")
-        logger.info(f"Nome do arquivo: {zip_filename}")
-        logger.info(f"Arquivos processados: {list(arquivos_resultado.keys())}")
-        logger.info(f"Dicionário de arquivos resultado: {list(arquivos_resultado.keys())}")
-
-        # Resultados do processamento
-        result = {
-            'success': True,
-            'arquivos_resultado': arquivos_resultado,  # Dict com XMLs como strings
-            'zip_id': str(arquivo_zip.id),
-            'processed_files': processed_files,
-            'total_files': total_files,
-            'erros': erros
-        }
-
-        # Atualiza o status da tarefa para COMPLETO
-        update_task_status(self.request.id, 'SUCESSO', json.dumps(result))
-
-        # # cria um relatório excel com os dados extraídos de todos os arquivos processados e adiciona ao zip
-        # excel_bytes = ExcelGenerator.gerar_excel(arquivos_resultado)
-        # print(f"Dicionário de arquivos resultado: {list(arquivos_resultado.keys())}")
-        # zip_file.writestr(f"relatorio.xlsx", excel_bytes)
-        # print(f"Relatório Excel adicionado ao ZIP, tamanho: {len(excel_bytes)} bytes")
-
-        # Retorna resultado estruturado
-        return result
-    
+    arquivos.update(ids_falhas)
+
+    logger.info(f"ZIP salvo com ID: {arquivo_zip.id}")
+    logger.info(f"Nome do arquivo: {zip_filename}")
+    logger.info(f"Arquivos processados: {processed_files}/{total_files}")
+
+    # Resultados do processamento (os XMLs são lidos em /api/task-files/<task_id>/)
+    result = {
+        'success': True,
+        'arquivos': arquivos,  # {nome_arquivo: id do ArquivoProcessado}
+        'zip_id': str(arquivo_zip.id),
+        'processed_files': processed_files,
+        'total_files': total_files,
+        'erros': erros,
+        'falhas': ids_falhas,  # lista de falhas do job, reprocessável sem reenviar o lote inteiro
+        # XMLs gerados fora do schema ABRASF (detalhes em erros_validacao de /api/task-files/<task_id>/)
+        'xmls_invalidos': ArquivoProcessado.objects.filter(task_id=task_id, xml_valido=False).count(),
+    }
+    if ids_falhas:
+        result['reprocessar_url'] = f"/api/task-files/{task_id}/reprocessar/"
+
+    # Atualiza o status da tarefa para COMPLETO
+    update_task_status(task_id, 'SUCESSO', json.dumps(result))
+    return result
+
+
+def _resultado_erro(task_id, file_keys, e):
+    logger.error(f"Erro geral no processamento: {str(e)}", exc_info=True)
+    resultado_erro = {
+        'success': False,
+        'error': str(e),
+        'arquivos': {},
+        'processed_files': 0,
+        'total_files': len(file_keys) if file_keys else 0
+    }
+    update_task_status(task_id, 'ERRO', json.dumps(resultado_erro))
+    return resultado_erro
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def processar_pdfs(self, file_keys, enable_duplicates=False, concorrencia=None, opcoes_documentai=None, modo=None):
+    """
+    Processa múltiplos PDFs já enviados via presigned URL para o MinIO.
+    :param file_keys: lista de chaves (keys) no bucket, ex: ["uploads/20240823_arquivo1.pdf"]
+    :param concorrencia: número máximo de arquivos processados em paralelo
+                         (padrão: settings.DOCUMENTAI_CONCURRENCY)
+    :param opcoes_documentai: sobrescreve field_mask/paginas do DocumentAI para este job,
+                              ex: {"paginas": 1}
+    :param modo: "threads" processa o lote neste worker; "chord" distribui um subtask por
+                 arquivo entre todos os workers; "pipeline" separa cada arquivo em uma etapa
+                 de I/O (pool de threads) e outra de CPU (prefork)
+                 (padrão: settings.PROCESSAR_PDFS_MODO; chord e pipeline só são usados a
+                 partir de PROCESSAR_PDFS_CHORD_MIN_ARQUIVOS arquivos)
+    """
+    # Com acks_late a mensagem só é confirmada no fim: se o worker cair no meio do lote a tarefa
+    # é reentregue com o mesmo id e retoma dos checkpoints gravados em ArquivoProcessado
+    update_task_status(self.request.id, 'PROCESSANDO')
+
+    modo = modo or settings.PROCESSAR_PDFS_MODO
+    if modo == "chord" and len(file_keys) >= settings.PROCESSAR_PDFS_CHORD_MIN_ARQUIVOS:
+        # Fan-out/fan-in: o callback herda o id desta tarefa, então o TaskStatusView
+        # e o dashboard continuam consultando o mesmo task_id e recebem o mesmo resultado
+        logger.info(f"Distribuindo {len(file_keys)} arquivo(s) em chord")
+        ProgressoJob(self.request.id).iniciar(len(file_keys))
+        cabecalho = [processar_arquivo_pdf.s(file_key, opcoes_documentai, self.request.id) for file_key in file_keys]
+        raise self.replace(chord(cabecalho, consolidar_pdfs.s(file_keys, self.request.id)))
+
+    if modo == "pipeline" and len(file_keys) >= settings.PROCESSAR_PDFS_CHORD_MIN_ARQUIVOS:
+        # Como o chord, mas cada arquivo passa por duas etapas em pools diferentes:
+        # extração (download/DocumentAI) na fila pipeline_io e geração do XML na pipeline_cpu
+        logger.info(f"Distribuindo {len(file_keys)} arquivo(s) no pipeline I/O -> CPU")
+        ProgressoJob(self.request.id).iniciar(len(file_keys))
+        cabecalho = [
+            chain(extrair_dados_pdf.s(file_key, opcoes_documentai, self.request.id),
+                  gerar_xml_pdf.s(self.request.id))
+            for file_key in file_keys
+        ]
+        callback = consolidar_pdfs.s(file_keys, self.request.id).set(queue=FILA_PIPELINE_CPU)
+        raise self.replace(chord(cabecalho, callback))
+
+    try:
+        processor = DocumentAIProcessor()
+        project_id, location, processor_id = _config_documentai()
+        print(f"Project ID: {project_id}")
+        print(f"Location: {location}")
+        print(f"Processor ID: {processor_id}")
+
+        total_files = len(file_keys)
+
+        # O tempo de cada arquivo é quase todo espera de rede (S3 + DocumentAI),
+        # então os arquivos são despachados em paralelo com concorrência limitada
+        concorrencia = max(1, min(int(concorrencia or settings.DOCUMENTAI_CONCURRENCY), total_files or 1))
+        logger.info(f"Processando {total_files} arquivo(s) com concorrência {concorrencia}")
+
+        # Progresso por arquivo (estado PROGRESS), publicado conforme os arquivos terminam
+        progresso = ProgressoJob(self.request.id)
+        progresso.iniciar(total_files, concorrencia)
+
+        with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+            # Consome os resultados na ordem de file_keys para manter a saída determinística;
+            # a janela (2x a concorrência) mantém as threads ocupadas sem acumular os XMLs do lote
+            resultados = _resultados_em_ordem(
+                executor, file_keys, concorrencia * 2,
+                lambda file_key: _processar_com_checkpoint(self.request.id, progresso, processor, project_id,
+                                                           location, processor_id, file_key, opcoes_documentai),
+            )
+            return _montar_saida(self.request.id, file_keys, resultados)
+
+    except Exception as e:
+        return _resultado_erro(self.request.id, file_keys, e)
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def processar_arquivo_pdf(self, file_key, opcoes_documentai=None, task_id=None):
+    """
+    Subtask do modo chord: processa um único PDF (download -> OCR -> mapeamento -> XML).
+    Erros são devolvidos no resultado em vez de levantados, para que o callback do chord
+    rode mesmo quando alguns arquivos falham. O XML fica no checkpoint (ArquivoProcessado)
+    e o resultado leva só a referência, sem passar pelo result backend.
+    :param task_id: id do job (processar_pdfs) cujo progresso é atualizado por este arquivo
+    """
+    try:
+        project_id, location, processor_id = _config_documentai()
+        task_id = task_id or self.request.id
+        _processar_com_checkpoint(task_id, ProgressoJob(task_id), DocumentAIProcessor(),
+                                  project_id, location, processor_id, file_key, opcoes_documentai)
+        return {"file_key": file_key}
+    except Exception as e:
+        logger.error(f"Erro ao processar {file_key}: {e}", exc_info=True)
+        return {"file_key": file_key, "erro": str(e)}
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def extrair_dados_pdf(self, file_key, opcoes_documentai=None, task_id=None):
+    """
+    Etapa de I/O do modo pipeline (fila pipeline_io, pool de threads): download, cache,
+    camada de texto/template ou DocumentAI, com as mesmas retentativas do modo em threads.
+    Entrega à etapa de CPU apenas os campos extraídos (alguns KB) pelo broker; o PDF não trafega.
+    Falhas são registradas na lista de falhas do job e repassadas no resultado.
+    """
+    task_id = task_id or self.request.id
+    file_name = file_key.split('/')[-1]
+    progresso = ProgressoJob(task_id)
+
+    if _xml_do_checkpoint(task_id, file_key) is not None:
+        return {"file_key": file_key, "checkpoint": True}
+
+    progresso.arquivo_iniciado(file_name)
+    inicio = time.time()
+    try:
+        project_id, location, processor_id = _config_documentai()
+        dados, tentativas = _com_retentativas(file_name, _extrair_dados, DocumentAIProcessor(), project_id,
+                                              location, processor_id, file_key, opcoes_documentai)
+        return {"file_key": file_key, "dados": dados, "tentativas": tentativas, "inicio": inicio}
+    except Exception as e:
+        logger.error(f"Erro ao processar {file_key}: {e}", exc_info=True)
+        _registrar_arquivo(task_id, file_key, xml_str=_xml_erro(file_name, e), erro=e,
+                           tentativas=getattr(e, "tentativas", 1))
+        progresso.arquivo_concluido(file_name, time.time() - inicio, erro=str(e))
+        return {"file_key": file_key, "erro": str(e)}
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def gerar_xml_pdf(self, extraido, task_id):
+    """
+    Etapa de CPU do modo pipeline (fila pipeline_cpu, prefork): gera o XML ABRASF e grava o
+    checkpoint em ArquivoProcessado. Devolve só a referência; o callback lê o XML do banco.
+    """
+    file_key = extraido["file_key"]
+    file_name = file_key.split('/')[-1]
+    progresso = ProgressoJob(task_id)
+
+    if extraido.get("erro") is not None:
+        return {"file_key": file_key, "erro": extraido["erro"]}
+    if extraido.get("checkpoint"):
+        progresso.arquivo_concluido(file_name, 0.0, reaproveitado=True)
+        return {"file_key": file_key}
+
+    try:
+        xml_str, validacao = _gerar_xml(file_name, extraido["dados"])
     except Exception as e:
-        logger.error(f"Erro geral no processamento: {str(e)}", exc_info=True)
-        resultado_erro = {
-            'success': False,
-            'error': str(e),
-            'arquivos_resultado': {},
-            'processed_files': 0,
-            'total_files': len(file_keys) if file_keys else 0
-        }
-        update_task_status(self.request.id, 'ERRO', json.dumps(resultado_erro))  # <-- Aqui
-        return resultado_erro
+        logger.error(f"Erro ao gerar o XML de {file_key}: {e}", exc_info=True)
+        _registrar_arquivo(task_id, file_key, xml_str=_xml_erro(file_name, e), erro=e,
+                           tentativas=extraido["tentativas"])
+        progresso.arquivo_concluido(file_name, time.time() - extraido["inicio"], erro=str(e))
+        return {"file_key": file_key, "erro": str(e)}
+
+    _registrar_arquivo(task_id, file_key, xml_str=xml_str, tentativas=extraido["tentativas"],
+                       validacao=validacao)
+    progresso.arquivo_concluido(file_name, time.time() - extraido["inicio"])
+    return {"file_key": file_key}
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def consolidar_pdfs(self, resultados, file_keys, task_id):
+    """
+    Callback do chord: monta ZIP, relatório e ArquivoZip com os resultados dos subtasks
+    (que chegam na mesma ordem de file_keys) e devolve o mesmo resultado de processar_pdfs.
+    Os subtasks devolvem só a referência; cada XML é lido de ArquivoProcessado quando entra no ZIP.
+    """
+    def itens():
+        for r in resultados:
+            if r.get("erro") is not None:
+                yield r["file_key"], None, r["erro"]
+                continue
+            xml_str = _xml_do_checkpoint(task_id, r["file_key"])
+            if xml_str is None:
+                yield r["file_key"], None, "XML não encontrado no checkpoint do arquivo"
+            else:
+                yield r["file_key"], xml_str, None
+
+    try:
+        return _montar_saida(task_id, file_keys, itens())
+    except Exception as e:
+        return _resultado_erro(task_id, file_keys, e)
+
+
+
+@shared_task()
+def limpar_cache_documentai():
+    """Remove entradas expiradas/excedentes do cache de resultados do DocumentAI."""
+    return DocumentAICache.limpar()
 
 
 
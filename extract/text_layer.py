@@ -0,0 +1,296 @@
+import io
+import logging
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import PyPDF2
+from dateutil.parser import parse
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+# Padrões de valores reaproveitados pelas regras
+CNPJ_CPF = r"(\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}|\d{3}\.?\d{3}\.?\d{3}-?\d{2})"
+VALOR = r"(?:R\$\s*)?(\d{1,3}(?:\.\d{3})*,\d{2}|\d+,\d{2})"
+DATA = r"(\d{2}/\d{2}/\d{4}(?:\s+(?:AS\s+)?\d{2}:\d{2}(?::\d{2})?)?)"
+SEPARADOR = r"[\s:.\-=]*"
+
+
+def normalizar_mantendo_posicoes(texto: str) -> str:
+    """
+    Remove acentos e converte para maiúsculas preservando o tamanho do texto,
+    para que as posições encontradas na versão normalizada valham no texto original.
+    """
+    return "".join(unicodedata.normalize("NFD", c)[0].upper()[0] for c in texto)
+
+
+def cnpj_cpf_valido(valor: str) -> bool:
+    """Confere os dígitos verificadores de um CPF (11 dígitos) ou CNPJ (14 dígitos)."""
+    digitos = [int(d) for d in re.sub(r"\D", "", valor or "")]
+
+    if len(digitos) == 11:
+        pesos = [list(range(10, 1, -1)), list(range(11, 1, -1))]
+    elif len(digitos) == 14:
+        pesos = [[5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2], [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]]
+    else:
+        return False
+
+    if len(set(digitos)) == 1:
+        return False
+
+    for peso in pesos:
+        base = digitos[:len(peso)]
+        resto = sum(d * p for d, p in zip(base, peso)) % 11
+        verificador = 0 if resto < 2 else 11 - resto
+        if digitos[len(peso)] != verificador:
+            return False
+    return True
+
+
+# Regras genéricas (ABRASF): campo de mapear_campos -> lista de (rótulo, padrão do valor).
+# Os rótulos são aplicados sobre o texto sem acentos e em maiúsculas.
+REGRAS_GERAIS = {
+    "numero-nota-fiscal": [
+        (r"NUMERO DA NOTA(?: FISCAL)?", r"(\d[\d./\-]*)"),
+        (r"(?:NUMERO|N[Oº°]\.?) DA NFS-?E", r"(\d[\d./\-]*)"),
+        (r"NFS-?E N[Oº°]?\.?", r"(\d[\d./\-]*)"),
+    ],
+    "codigoVerificacao": [
+        (r"CODIGO DE VERIFICACAO", r"([A-Z0-9]{4,}(?:-[A-Z0-9]{4,})*)"),
+    ],
+    "dataEmissao": [
+        (r"DATA (?:E HORA )?(?:DA |DE )?EMISSAO(?: DA NFS-?E)?", DATA),
+    ],
+    "valorServicos": [
+        (r"VALOR (?:TOTAL )?(?:DO|DOS) SERVICOS?(?: PRESTADOS?)?(?: \(R\$\))?", VALOR),
+        (r"VALOR TOTAL DA NOTA", VALOR),
+    ],
+    "valorTotalNota": [
+        (r"VALOR TOTAL DA NOTA", VALOR),
+    ],
+    "baseCalculo": [
+        (r"BASE DE CALCULO(?: DO ISS(?:QN)?)?(?: \(R\$\))?", VALOR),
+    ],
+    "aliquota": [
+        (r"ALIQUOTA(?: \(%\))?", r"(\d{1,2}(?:,\d{1,4})?)\s*%?"),
+    ],
+    "valorIss": [
+        (r"VALOR DO ISS(?:QN)?(?: \(R\$\))?", VALOR),
+    ],
+    "valorLiquido": [
+        (r"VALOR LIQUIDO(?: DA NOTA| DA NFS-?E)?(?: \(R\$\))?", VALOR),
+    ],
+    "valorPis": [(r"\bPIS(?:/PASEP)?(?: \(R\$\))?", VALOR)],
+    "valorCofins": [(r"\bCOFINS(?: \(R\$\))?", VALOR)],
+    "valorInss": [(r"\bINSS(?: \(R\$\))?", VALOR)],
+    "impostoRenda": [(r"\bIR(?:RF)?(?: \(R\$\))?", VALOR)],
+    "csll": [(r"\bCSLL(?: \(R\$\))?", VALOR)],
+    "item_lista_servico": [
+        (r"(?:ITEM DA LISTA(?: DE SERVICOS?)?|SUBITEM|CODIGO DO SERVICO)", r"(\d{1,2}\.\d{2})"),
+    ],
+    "prefeituraNota": [
+        (r"", r"(PREFEITURA (?:MUNICIPAL )?(?:DO MUNICIPIO )?DE [^\n]+)"),
+    ],
+}
+
+# Regras aplicadas dentro de cada bloco (prestador/tomador); o sufixo vira
+# "Prestador" ou "Tomador" no nome do campo.
+REGRAS_BLOCO = {
+    "cpfCnpj": [(r"(?:CPF/CNPJ|CNPJ/CPF|CNPJ|CPF)", CNPJ_CPF)],
+    "razaoSocial": [(r"(?:NOME/)?RAZAO SOCIAL|NOME EMPRESARIAL", r"([^\n]{3,})")],
+    "inscricaoMunicipal": [(r"INSCRICAO MUNICIPAL|INSC\. MUNICIPAL|I\.M\.", r"(\d[\d./\-]*)")],
+    "cep": [(r"CEP", r"(\d{5}-?\d{3}|\d{2}\.\d{3}-\d{3})")],
+    "email": [(r"E-?MAIL", r"([\w.+\-]+@[\w\-]+(?:\.[\w\-]+)+)")],
+    "telefone": [(r"TELEFONE|FONE", r"(\(?\d{2}\)?\s*\d{4,5}-?\d{4})")],
+}
+
+# Campos cuja presença (e validade) define a confiança da extração local
+CAMPOS_CRITICOS = (
+    "numero-nota-fiscal",
+    "codigoVerificacao",
+    "dataEmissao",
+    "cpfCnpjPrestador",
+    "valorServicos",
+    "municipioPrestador",
+    "ufPrestador",
+)
+
+# Layouts conhecidos: assinatura (regex sobre o texto normalizado) e regras que
+# sobrescrevem/complementam as gerais. O primeiro layout cuja assinatura casar é usado.
+LAYOUTS = [
+    {
+        "nome": "nfse_nacional",
+        "assinatura": r"DANFS-?E",
+        "blocos": (r"EMITENTE DA NFS-?E|PRESTADOR", r"TOMADOR DO SERVICO|TOMADOR"),
+        "regras": {
+            "numero-nota-fiscal": [(r"NUMERO DA NFS-?E", r"(\d[\d./\-]*)")],
+            "dataEmissao": [(r"DATA E HORA DA EMISSAO DA NFS-?E", DATA)],
+            "valorServicos": [(r"VALOR DO SERVICO", VALOR)],
+            "codigoVerificacao": [(r"CHAVE DE ACESSO DA NFS-?E", r"(\d{20,})")],
+        },
+    },
+    {
+        "nome": "sao_paulo",
+        "assinatura": r"PREFEITURA DO MUNICIPIO DE SAO PAULO",
+        "blocos": (r"PRESTADOR DE SERVICOS", r"TOMADOR DE SERVICOS"),
+        "regras": {
+            "valorServicos": [(r"VALOR TOTAL DO SERVICO", VALOR)],
+        },
+    },
+    {
+        "nome": "abrasf_generico",
+        "assinatura": r"",
+        "blocos": (r"PRESTADOR(?: DE| DO)? SERVICOS?|PRESTADOR", r"TOMADOR(?: DE| DO)? SERVICOS?|TOMADOR"),
+        "regras": {},
+    },
+]
+
+
+class TextLayerExtractor:
+    """
+    Extrai os campos da NFS-e diretamente da camada de texto do PDF (PDFs gerados
+    digitalmente pelas prefeituras), sem chamar o DocumentAI.
+    Produz o mesmo dicionário de mapear_campos e uma confiança entre 0 e 1.
+    """
+
+    @staticmethod
+    def extrair_texto(pdf_bytes: bytes, max_paginas: int = 2) -> str:
+        """Extrai o texto das primeiras páginas do PDF; string vazia se não houver camada de texto."""
+        try:
+            reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+            paginas = reader.pages[:max_paginas]
+            return "\n".join((pagina.extract_text() or "") for pagina in paginas)
+        except Exception as e:
+            logger.warning(f"[TextLayer] Não foi possível ler a camada de texto do PDF: {e}")
+            return ""
+
+    @staticmethod
+    def possui_camada_texto(texto: str) -> bool:
+        """Considera a camada utilizável se houver texto suficiente e majoritariamente legível."""
+        conteudo = re.sub(r"\s", "", texto or "")
+        if len(conteudo) < settings.TEXT_LAYER_MIN_CARACTERES:
+            return False
+        legiveis = sum(1 for c in conteudo if c.isalnum())
+        return legiveis / len(conteudo) >= 0.6
+
+    @staticmethod
+    def _buscar(texto: str, normalizado: str, regras: List[Tuple[str, str]],
+                inicio: int = 0, fim: Optional[int] = None) -> Optional[str]:
+        """Aplica as regras (rótulo + valor) no trecho e retorna o valor do texto original."""
+        fim = len(texto) if fim is None else fim
+        for rotulo, padrao_valor in regras:
+            padrao = re.compile(f"(?:{rotulo}){SEPARADOR}{padrao_valor}" if rotulo else padrao_valor)
+            match = padrao.search(normalizado, inicio, fim)
+            if match:
+                return texto[match.start(1):match.end(1)].strip()
+        return None
+
+    @staticmethod
+    def _municipio_uf(texto: str, normalizado: str, inicio: int, fim: int) -> Tuple[Optional[str], Optional[str]]:
+        """Procura 'Município: NOME - UF' (ou 'NOME/UF', 'UF: XX') dentro do bloco."""
+        padrao = re.compile(
+            rf"MUNICIPIO{SEPARADOR}([A-Z][A-Z' ]+?)\s*(?:-|/|\bUF\b:?)\s*([A-Z]{{2}})\b"
+        )
+        match = padrao.search(normalizado, inicio, fim)
+        if not match:
+            return None, None
+        return texto[match.start(1):match.end(1)].strip(), match.group(2)
+
+    @staticmethod
+    def _discriminacao(texto: str, normalizado: str) -> Optional[str]:
+        """Texto entre 'Discriminação dos Serviços' e o próximo bloco de valores."""
+        match = re.search(r"DISCRIMINACAO DOS? SERVICOS?[\s:]*\n?", normalizado)
+        if not match:
+            return None
+        fim = re.search(r"\n\s*(?:VALOR|CODIGO DO SERVICO|ITEM DA LISTA)", normalizado[match.end():])
+        trecho = texto[match.end():match.end() + fim.start()] if fim else texto[match.end():match.end() + 1000]
+        return re.sub(r"\s+", " ", trecho).strip() or None
+
+    @staticmethod
+    def identificar_layout(normalizado: str) -> Dict:
+        for layout in LAYOUTS:
+            if not layout["assinatura"] or re.search(layout["assinatura"], normalizado):
+                return layout
+        return LAYOUTS[-1]
+
+    @classmethod
+    def calcular_confianca(cls, dados: Dict) -> float:
+        """Fração dos campos críticos encontrados e com formato válido."""
+        validos = 0
+        for campo in CAMPOS_CRITICOS:
+            valor = dados.get(campo)
+            if not valor:
+                continue
+            if campo == "cpfCnpjPrestador" and not cnpj_cpf_valido(valor):
+                continue
+            if campo == "dataEmissao":
+                try:
+                    parse(valor.replace(" às ", " "), dayfirst=True)
+                except Exception:
+                    continue
+            validos += 1
+        return validos / len(CAMPOS_CRITICOS)
+
+    @classmethod
+    def extrair_campos(cls, texto: str) -> Tuple[Dict, str]:
+        """
+        Aplica as regras do layout identificado no texto.
+        :return: (dados no formato de mapear_campos, nome do layout)
+        """
+        normalizado = normalizar_mantendo_posicoes(texto)
+        layout = cls.identificar_layout(normalizado)
+        dados = {}
+
+        regras = dict(REGRAS_GERAIS)
+        regras.update(layout["regras"])
+        for campo, regras_campo in regras.items():
+            valor = cls._buscar(texto, normalizado, regras_campo)
+            if valor:
+                dados[campo] = valor
+
+        # Delimita os blocos do prestador e do tomador
+        rotulo_prestador, rotulo_tomador = layout["blocos"]
+        match_prestador = re.search(rotulo_prestador, normalizado)
+        match_tomador = re.compile(rotulo_tomador).search(normalizado, match_prestador.end() if match_prestador else 0)
+        inicio_prestador = match_prestador.end() if match_prestador else 0
+        inicio_tomador = match_tomador.end() if match_tomador else None
+        blocos = {"Prestador": (inicio_prestador, match_tomador.start() if match_tomador else len(texto))}
+        if inicio_tomador is not None:
+            fim_tomador = re.search(r"DISCRIMINACAO|SERVICO PRESTADO|INTERMEDIARIO", normalizado[inicio_tomador:])
+            blocos["Tomador"] = (inicio_tomador, inicio_tomador + fim_tomador.start() if fim_tomador else len(texto))
+
+        for sufixo, (inicio, fim) in blocos.items():
+            for prefixo, regras_campo in REGRAS_BLOCO.items():
+                valor = cls._buscar(texto, normalizado, regras_campo, inicio, fim)
+                if valor:
+                    dados[f"{prefixo}{sufixo}"] = valor
+            municipio, uf = cls._municipio_uf(texto, normalizado, inicio, fim)
+            if municipio:
+                dados[f"municipio{sufixo}"] = municipio
+                dados[f"uf{sufixo}"] = uf
+
+        discriminacao = cls._discriminacao(texto, normalizado)
+        if discriminacao:
+            dados["Discriminacao"] = discriminacao
+
+        return dados, layout["nome"]
+
+    @classmethod
+    def extrair(cls, pdf_bytes: bytes, texto: Optional[str] = None) -> Tuple[Optional[Dict], float]:
+        """
+        Tenta extrair a nota pela camada de texto.
+        :param texto: texto já extraído do PDF, para não ler o arquivo de novo
+        :return: (dados, confiança); dados é None se o PDF não tiver camada de texto utilizável
+        """
+        if texto is None:
+            texto = cls.extrair_texto(pdf_bytes)
+        if not cls.possui_camada_texto(texto):
+            return None, 0.0
+
+        dados, layout = cls.extrair_campos(texto)
+        confianca = cls.calcular_confianca(dados)
+        logger.info(f"[TextLayer] Layout '{layout}': {len(dados)} campo(s), confiança {confianca:.2f}")
+        return dados, confianca
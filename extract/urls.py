@@ -5,6 +5,9 @@ from .views import (
     UploadEProcessarPDFView,
     MergePDFsView,
     TaskStatusView,
+    TaskFilesView,
+    TaskFileXMLView,
+    ReprocessarFalhasView,
     DownloadZipView,
     StreamlitAppRedirectView,
     SendXMLToExternalAPIView,
@@ -37,6 +40,9 @@ urlpatterns = [
     path("upload-e-processar-pdf/", UploadEProcessarPDFView.as_view(), name="upload-e-processar-pdf"),
     path('merge_pdfs/', MergePDFsView.as_view(), name='merge_pdfs'),
     path("task-status/<str:task_id>/", TaskStatusView.as_view(), name="task-status"),
+    path("task-files/<str:task_id>/", TaskFilesView.as_view(), name="task-files"),
+    path("task-files/<str:task_id>/<int:arquivo_id>/", TaskFileXMLView.as_view(), name="task-file-xml"),
+    path("task-files/<str:task_id>/reprocessar/", ReprocessarFalhasView.as_view(), name="task-files-reprocessar"),
     path("download-zip/<uuid:task_id>/", DownloadZipView.as_view(), name="download-zip"),
     path("streamlit-dashboard/", StreamlitAppRedirectView.as_view(), name="streamlit-dashboard"),
     path("send-xml-to-external-api/", SendXMLToExternalAPIView.as_view(), name="send-xml-to-external-api"),
@@ -9,14 +9,16 @@ import uuid  # Adicionar import do uuid
 from celery.result import AsyncResult
 from django.contrib import messages
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
-from django.http import HttpResponseRedirect, JsonResponse
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.core.paginator import Paginator
+from django.db import transaction
 from django.shortcuts import render, redirect
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.http import FileResponse, Http404
-from .models import ArquivoZip, TaskStatusModel, ProfileModel
+from .models import ArquivoZip, TaskStatusModel, ProfileModel, ArquivoProcessado
 from django.http import FileResponse, Http404
 from io import BytesIO
 from .models import (ArquivoZip, UserCredits, SupportTicket, 
@@ -25,6 +27,8 @@ from .models import (ArquivoZip, UserCredits, SupportTicket,
 # Certifique-se de que esses imports estão corretos para o seu projeto
 from extract.services import DocumentAIProcessor
 from extract.tasks import processar_pdfs, merge_pdfs_task  # Removido processar_pdf_com_ai
+from nfse_abrasf.celery_config import fila_processamento
+from extract.idempotencia import IdempotenciaEnvio
 from extract.minio_service import upload_file_to_s3, get_s3_client    # Certifique-se de que este caminho está correto
 
 from django.conf import settings
@@ -32,7 +36,7 @@ from django.core.mail import send_mail
 from django.forms.models import model_to_dict
 from django.contrib.auth.models import User
 from extract.jwt_auth import JWTAuthenticationService
-from .minio_service import generate_presigned_upload_url
+from .minio_service import generate_presigned_upload_url, generate_presigned_download_url
 from django.core.mail import EmailMultiAlternatives
 from django.core.files.uploadhandler import TemporaryFileUploadHandler
 
@@ -84,6 +88,8 @@ class StreamlitAppRedirectView(View):
 @method_decorator(csrf_exempt, name='dispatch')
 class UploadEProcessarPDFView(View):
     def post(self, request):
+        chave_idempotencia = None
+        envio_confirmado = False
         try:
             logger = logging.getLogger(__name__)
             logger.info(f"UploadEProcessarPDFView - request.user: {request.user}")
@@ -102,7 +108,29 @@ class UploadEProcessarPDFView(View):
                     'error': 'Nenhum arquivo enviado',
                     'message': 'Por favor, envie pelo menos um arquivo PDF'
                 }, status=400)
-            
+
+            # Reenvios do mesmo lote (mesma Idempotency-Key ou mesmos PDFs) devolvem a tarefa já criada
+            merge_pdfs_param = request.POST.get('merge_pdfs', 'false').lower() == 'true'
+            chave_idempotencia = IdempotenciaEnvio.calcular_chave(
+                request.user.id, files, request.headers.get('Idempotency-Key'), merge=merge_pdfs_param
+            )
+            envio_novo, envio_existente = IdempotenciaEnvio.reservar(chave_idempotencia)
+            if not envio_novo:
+                chave_idempotencia = None  # a reserva pertence ao envio original
+                if envio_existente is None:
+                    return JsonResponse({
+                        'error': 'Envio duplicado em andamento',
+                        'message': 'Este lote já está sendo enviado; aguarde alguns segundos e consulte novamente'
+                    }, status=409)
+                logger.info(f"Envio duplicado de {request.user}: devolvendo a tarefa {envio_existente['task_id']}")
+                return JsonResponse({
+                    'success': True,
+                    'duplicado': True,
+                    'message': 'Lote já enviado anteriormente; nenhum crédito foi consumido',
+                    'credits_used': 0,
+                    **envio_existente,
+                })
+
             # Verifica créditos
             user_credits, created = UserCredits.objects.get_or_create(user=request.user)
             required_credits = len(files)
@@ -116,7 +144,6 @@ class UploadEProcessarPDFView(View):
                 }, status=402)
             
             # Verifica se deve fazer merge
-            merge_pdfs_param = request.POST.get('merge_pdfs', 'false').lower() == 'true'
             merge_id = uuid.uuid4()
             
             # Tenta processar os arquivos primeiro
@@ -146,8 +173,9 @@ class UploadEProcessarPDFView(View):
                         upload_file_to_s3(file, file_key)
                         file_keys.append(file_key)
                     
-                    # Inicia a task
-                    task = processar_pdfs.delay(file_keys, enable_duplicates=False)
+                    # Inicia a task na fila interactive ou bulk conforme o tamanho do lote
+                    fila = fila_processamento(len(files), sum(file.size for file in files))
+                    task = processar_pdfs.apply_async(args=[file_keys], kwargs={"enable_duplicates": False}, queue=fila)
                     TaskStatusModel.objects.create(
                         user=request.user,
                         task_id=task.id,
@@ -186,7 +214,13 @@ class UploadEProcessarPDFView(View):
                         'message': 'Houve um erro ao descontar os créditos'
                     }, status=500)
                 
-                # Se tudo deu certo, retorna a resposta
+                # Se tudo deu certo, registra a tarefa para reenvios e retorna a resposta
+                IdempotenciaEnvio.confirmar(chave_idempotencia, {
+                    'task_id': task_id,
+                    'merge_id': str(merge_id),
+                    'files_count': len(files),
+                })
+                envio_confirmado = True
                 return JsonResponse({
                     'success': True,
                     'task_id': task_id,
@@ -226,6 +260,10 @@ class UploadEProcessarPDFView(View):
                 'error': f'Erro no processamento: {str(e)}',
                 'message': 'Nenhum crédito foi consumido devido ao erro'
             }, status=500)
+        finally:
+            # Envios que não chegaram a criar a tarefa liberam a chave para uma nova tentativa
+            if chave_idempotencia and not envio_confirmado:
+                IdempotenciaEnvio.liberar(chave_idempotencia)
 
 # --- View para Verificar o Status da Tarefa Celery (API) ---
 @method_decorator(csrf_exempt, name='dispatch')
@@ -244,10 +282,10 @@ class TaskStatusView(View):
                 logger.info(f"[Celery Status] Task result type: {type(task_result)}")
                 logger.info(f"[Celery Status] Task result keys: {task_result.keys() if isinstance(task_result, dict) else 'Not a dict'}")
                 
-                # Estrutura esperada do result:
+                # Estrutura esperada do result (só referências; os XMLs vêm de TaskFilesView):
                 # {
                 #   'success': True,
-                #   'arquivos_resultado': {'arquivo.pdf': 'xml_string'},
+                #   'arquivos': {'arquivo.pdf': 123},
                 #   'zip_id': 'uuid',
                 #   'processed_files': 1,
                 #   'total_files': 1
@@ -255,12 +293,19 @@ class TaskStatusView(View):
                 
                 if isinstance(task_result, dict) and task_result.get('success'):
                     response_data["meta"] = {
-                        "arquivos_resultado": task_result.get('arquivos_resultado', {}),
+                        "arquivos": task_result.get('arquivos', {}),
+                        "arquivos_url": f"/api/task-files/{task_id}/",
                         "zip_id": task_result.get('zip_id'),
                         "processed_files": task_result.get('processed_files', 0),
                         "total_files": task_result.get('total_files', 0),
-                        "erros": task_result.get('erros', [])
+                        "erros": task_result.get('erros', []),
+                        "falhas": task_result.get('falhas', {}),
                     }
+                    if task_result.get('reprocessar_url'):
+                        response_data["meta"]["reprocessar_url"] = task_result['reprocessar_url']
+                    # Tarefas concluídas antes da mudança ainda trazem os XMLs no resultado
+                    if 'arquivos_resultado' in task_result:
+                        response_data["meta"]["arquivos_resultado"] = task_result['arquivos_resultado']
                 else:
                     response_data["meta"] = {
                         "error": task_result.get('error', 'Erro desconhecido') if isinstance(task_result, dict) else str(task_result)
@@ -270,6 +315,9 @@ class TaskStatusView(View):
 
             elif result.status == "FAILURE":
                 response_data["meta"] = {"error": str(result.result)}
+            elif result.status == "PROGRESS":
+                # Progresso por arquivo publicado por ProgressoJob (processados/total, arquivo atual, ETA)
+                response_data["meta"] = result.info if isinstance(result.info, dict) else {}
             else:
                 response_data["meta"] = {}
 
@@ -281,13 +329,122 @@ class TaskStatusView(View):
         
 
 
+class TaskFilesView(View):
+    """
+    Lista paginada dos arquivos de um job com os XMLs gerados.
+    Parâmetros: page (padrão 1), page_size (padrão 20, máximo 100), incluir_xml (padrão true),
+    status (SUCESSO ou ERRO; status=ERRO lista as falhas do job).
+    """
+
+    def get(self, request, task_id):
+        if not TaskStatusModel.objects.filter(task_id=task_id, user=request.user).exists():
+            raise Http404("Tarefa não encontrada.")
+
+        try:
+            page = max(1, int(request.GET.get("page", 1)))
+            page_size = min(100, max(1, int(request.GET.get("page_size", 20))))
+        except ValueError:
+            return JsonResponse({"error": "page e page_size devem ser inteiros"}, status=400)
+        incluir_xml = request.GET.get("incluir_xml", "true").lower() == "true"
+
+        campos = ["id", "nome_arquivo", "chave_arquivo", "status", "erro", "tentativas",
+                  "xml_valido", "erros_validacao", "reprocessado_em"] + (["xml"] if incluir_xml else [])
+        arquivos = ArquivoProcessado.objects.filter(task_id=task_id)
+        if request.GET.get("status"):
+            arquivos = arquivos.filter(status=request.GET["status"].upper())
+        arquivos = arquivos.order_by("id").values(*campos)
+        paginator = Paginator(arquivos, page_size)
+        pagina = paginator.get_page(page)
+
+        return JsonResponse({
+            "task_id": task_id,
+            "page": pagina.number,
+            "page_size": page_size,
+            "total": paginator.count,
+            "num_pages": paginator.num_pages,
+            "arquivos": list(pagina.object_list),
+        })
+
+
+class TaskFileXMLView(View):
+    """Retorna o XML de um único arquivo do job."""
+
+    def get(self, request, task_id, arquivo_id):
+        if not TaskStatusModel.objects.filter(task_id=task_id, user=request.user).exists():
+            raise Http404("Tarefa não encontrada.")
+        try:
+            arquivo = ArquivoProcessado.objects.get(task_id=task_id, id=arquivo_id)
+        except ArquivoProcessado.DoesNotExist:
+            raise Http404("Arquivo não encontrado.")
+
+        response = HttpResponse(arquivo.xml or "", content_type="application/xml; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="{arquivo.nome_arquivo.replace(".pdf", ".xml")}"'
+        return response
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ReprocessarFalhasView(View):
+    """
+    Reprocessa apenas os arquivos que falharam em um job (lista de falhas em ArquivoProcessado),
+    em uma nova tarefa. Os créditos desses arquivos já foram cobrados no envio original.
+    Cada falha é reprocessada uma única vez: a linha recebe o id da nova tarefa, e novas falhas
+    passam a ser reprocessadas a partir dela.
+    """
+
+    def post(self, request, task_id):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Usuário não autenticado'}, status=401)
+        if not TaskStatusModel.objects.filter(task_id=task_id, user=request.user).exists():
+            raise Http404("Tarefa não encontrada.")
+
+        falhas = ArquivoProcessado.objects.filter(task_id=task_id, status="ERRO")
+        novo_task_id = str(uuid.uuid4())
+        with transaction.atomic():
+            # Trava as falhas para que duas requisições simultâneas não reprocessem os mesmos arquivos
+            pendentes = falhas.select_for_update().filter(reprocessado_em__isnull=True).order_by("id")
+            file_keys = list(pendentes.values_list("chave_arquivo", flat=True))
+            if file_keys:
+                pendentes.update(reprocessado_em=novo_task_id)
+                TaskStatusModel.objects.create(user=request.user, task_id=novo_task_id, status='AGUARDANDO')
+
+        if not file_keys:
+            reprocessamentos = sorted(set(falhas.values_list("reprocessado_em", flat=True)))
+            if reprocessamentos:
+                return JsonResponse({
+                    "error": "As falhas desta tarefa já foram reprocessadas",
+                    "reprocessado_em": reprocessamentos,
+                }, status=409)
+            return JsonResponse({"error": "A tarefa não tem arquivos com falha para reprocessar"}, status=400)
+
+        try:
+            processar_pdfs.apply_async(args=[file_keys], kwargs={"enable_duplicates": False}, task_id=novo_task_id)
+        except Exception:
+            # Sem a tarefa na fila, as falhas voltam a ficar disponíveis para reprocessamento
+            falhas.filter(reprocessado_em=novo_task_id).update(reprocessado_em=None)
+            TaskStatusModel.objects.filter(task_id=novo_task_id).delete()
+            raise
+        logger.info(f"Reprocessando {len(file_keys)} arquivo(s) com falha da tarefa {task_id} na tarefa {novo_task_id}")
+
+        return JsonResponse({"task_id": novo_task_id, "origem_task_id": task_id, "total_files": len(file_keys)})
+
+
 # --- View para Download de ZIP (API - mantida, mas não usada no fluxo principal agora) ---
 @method_decorator(csrf_exempt, name='dispatch')
 class DownloadZipView(View):
     def get(self, request, task_id):
         try:
-            zip_model = ArquivoZip.objects.get(id=task_id)
+            zip_model = ArquivoZip.objects.defer("zip_bytes").get(id=task_id)
+
+            if zip_model.s3_key:
+                # O download sai direto do bucket; o worker do gunicorn não fica preso
+                url = generate_presigned_download_url(
+                    zip_model.s3_key,
+                    expires_in=settings.RESULTADOS_URL_EXPIRACAO,
+                    download_filename=f"{task_id}.zip",
+                )
+                return HttpResponseRedirect(url)
 
+            # Registros antigos, ainda não migrados com migrar_zips_para_s3
             if not zip_model.zip_bytes:
                 raise Http404("Arquivo ZIP não disponível no banco de dados.")
 
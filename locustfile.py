@@ -1,6 +1,73 @@
-from locust import HttpUser, task
+import os
+import time
+import uuid
+
+from locust import HttpUser, between, task
+
+# Teste de carga de ponta a ponta: login JWT -> upload -> acompanhamento da tarefa.
+# Para não gastar cota do DocumentAI, suba o stand-in e aponte os workers para ele:
+#   python manage.py documentai_standin --latencia-ms 1500 --taxa-erro 0.01 --qps 10
+#   DOCUMENTAI_API_ENDPOINT=localhost:50051 DOCUMENTAI_INSECURE=True \
+#   DOCUMENTAI_CACHE_ENABLED=False TEXT_LAYER_ENABLED=False LAYOUT_TEMPLATES_ENABLED=False \
+#   celery -A nfse_abrasf worker -Q interactive,bulk
+#   locust -f locustfile.py --host http://localhost:8000
+# Sem cache, camada de texto e templates todo arquivo passa pelo DocumentAI (stand-in); senão os
+# PDFs digitais e os já vistos são respondidos sem OCR e o teste não mede os workers.
+# Cada envio leva uma Idempotency-Key própria e cada PDF ganha um comentário único após o %%EOF
+# (o SHA-256 muda, o conteúdo não), para que a deduplicação de envios não devolva a tarefa anterior.
+# O usuário de teste precisa de créditos suficientes (1 por arquivo enviado).
+USUARIO = os.getenv("LOCUST_USERNAME", "loadtest")
+SENHA = os.getenv("LOCUST_PASSWORD", "loadtest")
+ARQUIVOS = os.getenv("LOCUST_PDFS", "uberaba.pdf").split(",")
+ARQUIVOS_POR_JOB = int(os.getenv("LOCUST_ARQUIVOS_POR_JOB", 1))
+INTERVALO_POLLING = float(os.getenv("LOCUST_INTERVALO_POLLING", 2))
+TIMEOUT_JOB = float(os.getenv("LOCUST_TIMEOUT_JOB", 600))
+
+
+def pdf_unico(conteudo: bytes) -> bytes:
+    """Acrescenta um comentário único ao fim do PDF: leitores ignoram, mas o hash do arquivo muda."""
+    return conteudo + f"\n%locust-{uuid.uuid4().hex}\n".encode("ascii")
+
 
 class UserBehavior(HttpUser):
+    wait_time = between(1, 3)
+
+    def on_start(self):
+        resposta = self.client.post("/api/auth/login/", json={"username": USUARIO, "password": SENHA})
+        token = resposta.json()["tokens"]["access_token"]
+        self.client.headers["Authorization"] = f"Bearer {token}"
+
     @task
     def envia_nfse(self):
-        self.client.post("/login", files={"arquivo": open("uberaba.pdf", "rb")})
\ No newline at end of file
+        inicio = time.time()
+        arquivos = []
+        for indice in range(ARQUIVOS_POR_JOB):
+            caminho = ARQUIVOS[indice % len(ARQUIVOS)]
+            with open(caminho, "rb") as f:
+                arquivos.append(("files[]", (f"{indice}_{os.path.basename(caminho)}", pdf_unico(f.read()),
+                                             "application/pdf")))
+
+        with self.client.post("/api/upload-e-processar-pdf/", files=arquivos,
+                              headers={"Idempotency-Key": uuid.uuid4().hex}, catch_response=True) as resposta:
+            if resposta.status_code != 200:
+                resposta.failure(f"Upload falhou: {resposta.status_code} {resposta.text[:200]}")
+                return
+            task_id = resposta.json()["task_id"]
+
+        # Acompanha a tarefa até o fim; o tempo total do job vira uma métrica própria no Locust
+        estado = None
+        while time.time() - inicio < TIMEOUT_JOB:
+            time.sleep(INTERVALO_POLLING)
+            resposta = self.client.get(f"/api/task-status/{task_id}/", name="/api/task-status/[task_id]/")
+            estado = resposta.json().get("state")
+            if estado in ("SUCCESS", "FAILURE"):
+                break
+
+        self.environment.events.request.fire(
+            request_type="JOB",
+            name=f"processar_pdfs ({ARQUIVOS_POR_JOB} arquivo(s))",
+            response_time=(time.time() - inicio) * 1000,
+            response_length=ARQUIVOS_POR_JOB,
+            exception=None if estado == "SUCCESS" else Exception(f"Tarefa terminou em {estado}"),
+            context={},
+        )
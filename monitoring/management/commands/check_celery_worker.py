@@ -1,6 +1,7 @@
 import subprocess
 from django.core.management.base import BaseCommand
-from monitoring.utils import send_whatsapp_alert
+from django.conf import settings
+from monitoring.utils import send_whatsapp_alert, units_inativas, filas_sem_consumidor
 import os
 import json
 
@@ -8,7 +9,8 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 STATE_FILE = os.path.join(BASE_DIR, "celery_status.json")
 
 class Command(BaseCommand):
-    help = "Verifica se o worker Celery está rodando e envia alerta via WhatsApp apenas se houver mudança de status"
+    help = ("Verifica se os workers Celery estão rodando e se todas as filas têm consumidor, "
+            "e envia alerta via WhatsApp apenas se houver mudança de status")
 
     def load_last_status(self):
         if os.path.exists(STATE_FILE):
@@ -28,17 +30,22 @@ class Command(BaseCommand):
     def handle(self, *args, **kwargs):
         last_status = self.load_last_status()
         try:
-            status = subprocess.run(
-                ["systemctl", "is-active", "--quiet", "celery-worker"],
-                check=False
-            )
-            current_status = status.returncode == 0
+            inativas = units_inativas(settings.CELERY_WORKER_UNITS)
+            # Com os workers parados o inspect não responde: só consulta as filas se as units estão de pé
+            filas = [] if inativas else filas_sem_consumidor()
+            current_status = not inativas and not filas
+
+            problemas = []
+            if inativas:
+                problemas.append(f"units paradas: {', '.join(inativas)}")
+            if filas:
+                problemas.append(f"filas sem worker: {', '.join(filas)}")
 
             # Só envia alerta se o status mudou
             if current_status != last_status:
                 if not current_status:
-                    send_whatsapp_alert("⚠️ O worker Celery caiu no servidor EC2!")
-                    self.stdout.write(self.style.ERROR("Worker Celery caiu! Alerta enviado."))
+                    send_whatsapp_alert(f"⚠️ Workers Celery com problema no servidor EC2 ({'; '.join(problemas)})!")
+                    self.stdout.write(self.style.ERROR(f"Workers Celery com problema ({'; '.join(problemas)})! Alerta enviado."))
                 else:
                     send_whatsapp_alert("✅ Worker Celery reiniciado com sucesso!")
                     self.stdout.write(self.style.SUCCESS("Worker Celery reiniciado! Alerta enviado."))
@@ -48,7 +55,7 @@ class Command(BaseCommand):
                 if current_status:
                     self.stdout.write(self.style.SUCCESS("Worker Celery rodando normalmente."))
                 else:
-                    self.stdout.write(self.style.WARNING("Worker Celery continua parado."))
+                    self.stdout.write(self.style.WARNING(f"Workers Celery continuam com problema ({'; '.join(problemas)})."))
 
             # Salva o estado atual
             self.save_status(current_status)
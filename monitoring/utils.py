@@ -1,4 +1,5 @@
 import os
+import subprocess
 from twilio.rest import Client
 
 def send_whatsapp_alert(message: str):
@@ -26,4 +27,23 @@ def send_whatsapp_alert(message: str):
         body=f"{message}{menu}",
         from_=from_whatsapp,
         to=to_whatsapp
-    )
\ No newline at end of file
+    )
+
+def units_inativas(units):
+    """Units do systemd (dos workers Celery) que não estão ativas."""
+    return [
+        unit for unit in units
+        if subprocess.run(["systemctl", "is-active", "--quiet", unit], check=False).returncode != 0
+    ]
+
+
+def filas_sem_consumidor():
+    """
+    Filas do Celery sem nenhum worker consumindo, segundo os próprios workers (inspect active_queues).
+    Detecta um worker de pé mas iniciado sem -Q, que só consome a fila padrão.
+    """
+    from nfse_abrasf.celery_config import app, FILAS
+
+    ativas = app.control.inspect(timeout=5).active_queues() or {}
+    consumidas = {fila["name"] for filas in ativas.values() for fila in filas}
+    return [fila for fila in FILAS if fila not in consumidas]
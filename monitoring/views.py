@@ -6,7 +6,7 @@ from django.utils.decorators import method_decorator
 from django.views import View
 from django.conf import settings
 from django.contrib.auth.models import User
-from monitoring.utils import send_whatsapp_alert
+from monitoring.utils import send_whatsapp_alert, filas_sem_consumidor
 import subprocess
 from twilio.twiml.messaging_response import MessagingResponse
 import sys
@@ -28,15 +28,25 @@ class WhatsAppWebhookView(View):
             reply = "✅ Menu enviado para o seu WhatsApp!"
             
         
+        # Um worker por fila ou um único worker de fallback, conforme CELERY_WORKER_UNITS
+        worker_units = " ".join(settings.CELERY_WORKER_UNITS)
+
         if body in ["status", "1"]:
-            result = subprocess.getoutput("systemctl status celery-worker --no-pager -l")
+            result = subprocess.getoutput(f"systemctl status {worker_units} --no-pager -l")
+            try:
+                filas = filas_sem_consumidor()
+            except Exception as e:
+                filas = [f"não foi possível consultar ({e})"]
+            if filas:
+                result = f"⚠️ Filas sem worker: {', '.join(filas)}\n{result}"
             reply = f"📊 Status do worker:\n{result[:500]}..."  # evita estourar limite de msg
 
         #############################################################################################
         
         elif body in ["logs worker", "2"]:
             try:
-                result = subprocess.getoutput("journalctl -u celery-worker --no-pager -n 50")
+                units = " ".join(f"-u {unit}" for unit in settings.CELERY_WORKER_UNITS)
+                result = subprocess.getoutput(f"journalctl {units} --no-pager -n 50")
                 reply = f"📜 Logs do worker:\n{result[:500]}..."
             except Exception as e:
                 reply = f"❌ Erro ao obter logs do worker: {str(e)}"
@@ -127,8 +137,8 @@ class WhatsAppWebhookView(View):
 
 
         elif body in ["restart", "7"]:
-            subprocess.run(["sudo", "systemctl", "restart", "celery-worker"])
-            reply = "♻️ Worker reiniciado com sucesso!"
+            subprocess.run(["sudo", "systemctl", "restart", *settings.CELERY_WORKER_UNITS])
+            reply = f"♻️ Worker(s) reiniciado(s) com sucesso: {worker_units}"
 
         # elif body in ["stop", "3"]:
         #     subprocess.run(["sudo", "systemctl", "stop", "celery-worker"])
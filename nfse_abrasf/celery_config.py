@@ -4,6 +4,7 @@ from celery import Celery
 import ssl
 
 from celery.schedules import crontab
+from django.conf import settings
 
 import logging
 
@@ -22,8 +23,10 @@ redis_url = os.getenv('REDIS_TLS_URL', os.getenv('REDIS_URL', 'redis://localhost
 app.conf.broker_url = redis_url
 app.conf.result_backend = redis_url
 
+# Tarefas com acks_late (processar_pdfs) são reentregues se não forem confirmadas dentro do
+# visibility_timeout: ele precisa ser maior que a duração do maior lote
 app.conf.broker_transport_options = {
-    "visibility_timeout": 3600,
+    "visibility_timeout": int(os.getenv("CELERY_VISIBILITY_TIMEOUT", 3600)),
     "socket_keepalive": True,
     "retry_on_timeout": True,
     "socket_connect_timeout": 30,   # tenta reconectar mais rápido
@@ -31,15 +34,70 @@ app.conf.broker_transport_options = {
 }
 app.conf.broker_connection_retry_on_startup = True
 app.conf.broker_heartbeat = 30  # envia sinal a cada 30s para manter conexão viva
+# Cada processo reserva uma tarefa por vez: com acks_late, um worker que cai só devolve à fila o que estava executando
+app.conf.worker_prefetch_multiplier = 1
 
 # Descobre tasks automaticamente em apps instalados
 app.autodiscover_tasks()
 
+# Filas dedicadas, cada uma com seu pool de workers (ver Procfile):
+# conversões pequenas não esperam atrás de lotes grandes, do merge ou das tarefas periódicas
+FILA_INTERATIVA = "interactive"
+FILA_BULK = "bulk"
+FILA_MERGE = "merge"
+FILA_HOUSEKEEPING = "housekeeping"
+# Modo pipeline de processar_pdfs: etapa de I/O em pool de threads, etapa de CPU em prefork
+FILA_PIPELINE_IO = "pipeline_io"
+FILA_PIPELINE_CPU = "pipeline_cpu"
+# Fila padrão antiga do Celery: mensagens publicadas antes da divisão em filas ficam nela
+# até serem drenadas (consumida pelo worker de housekeeping e pelo worker de fallback)
+FILA_LEGADA = "celery"
+FILAS = (FILA_INTERATIVA, FILA_BULK, FILA_MERGE, FILA_PIPELINE_IO, FILA_PIPELINE_CPU, FILA_HOUSEKEEPING, FILA_LEGADA)
+
+ROTAS_FIXAS = {
+    "extract.tasks.merge_pdfs_task": FILA_MERGE,
+    # Subtasks e callback do modo chord só existem em lotes grandes
+    "extract.tasks.processar_arquivo_pdf": FILA_BULK,
+    "extract.tasks.consolidar_pdfs": FILA_BULK,
+    "extract.tasks.extrair_dados_pdf": FILA_PIPELINE_IO,
+    "extract.tasks.gerar_xml_pdf": FILA_PIPELINE_CPU,
+    "extract.tasks.heartbeat_task": FILA_HOUSEKEEPING,
+    "extract.tasks.limpar_cache_documentai": FILA_HOUSEKEEPING,
+}
+
+
+def fila_processamento(qtd_arquivos, total_bytes=0):
+    """Fila de processar_pdfs conforme o tamanho do lote (FILA_BULK_MIN_ARQUIVOS / FILA_BULK_MIN_BYTES)."""
+    if qtd_arquivos >= settings.FILA_BULK_MIN_ARQUIVOS or total_bytes >= settings.FILA_BULK_MIN_BYTES:
+        return FILA_BULK
+    return FILA_INTERATIVA
+
+
+def rotear_tarefa(name, args, kwargs, options, task=None, **kw):
+    """
+    Router do Celery. processar_pdfs é roteado pela quantidade de arquivos; quem conhece o
+    tamanho dos PDFs (upload) passa queue=fila_processamento(qtd, bytes), que tem precedência.
+    """
+    if name in ROTAS_FIXAS:
+        return {"queue": ROTAS_FIXAS[name]}
+    if name == "extract.tasks.processar_pdfs":
+        file_keys = args[0] if args else (kwargs or {}).get("file_keys", [])
+        return {"queue": fila_processamento(len(file_keys or []))}
+    return None
+
+
+app.conf.task_default_queue = FILA_INTERATIVA
+app.conf.task_routes = (rotear_tarefa,)
+
 app.conf.beat_schedule = {
     "heartbeat-task-every-minute": {
         "task": "extract.tasks.heartbeat_task",
         "schedule": crontab(minute="*"),  # todo minuto
     },
+    "limpar-cache-documentai-every-hour": {
+        "task": "extract.tasks.limpar_cache_documentai",
+        "schedule": crontab(minute=0),  # de hora em hora
+    },
 }
 
 if redis_url.startswith("rediss://"):
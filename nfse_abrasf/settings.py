@@ -16,8 +16,6 @@ from dotenv import load_dotenv
 import dj_database_url
 import ssl
 import json
-import unicodedata
-import re
 from decouple import config
 
 load_dotenv()
@@ -218,31 +216,8 @@ DEFAULT_FILE_STORAGE = "django.core.files.storage.FileSystemStorage"
 print(f"O base dir é: {BASE_DIR}")
 
 
-# with open(Path(BASE_DIR) / "municipios.json", encoding="utf-8") as f:
-#     CIDADES_IBGE = json.load(f)
-def normalizar(texto):
-    texto = unicodedata.normalize("NFD", texto)
-    texto = texto.encode("ascii", "ignore").decode("utf-8")
-    texto = re.sub(r'[^a-zA-Z0-9\s]', '', texto)
-    return texto.upper().strip()
-
-
-with open(Path(BASE_DIR) / "municipios.json", encoding="utf-8") as f:
-    municipios_raw = json.load(f)
-
-
-UF_POR_CODIGO = {
-    11: "RO", 12: "AC", 13: "AM", 14: "RR", 15: "PA", 16: "AP", 17: "TO",
-    21: "MA", 22: "PI", 23: "CE", 24: "RN", 25: "PB", 26: "PE", 27: "AL", 28: "SE", 29: "BA",
-    31: "MG", 32: "ES", 33: "RJ", 35: "SP", 41: "PR", 42: "SC", 43: "RS",
-    50: "MS", 51: "MT", 52: "GO", 53: "DF"
-}
-
-CIDADES_IBGE = {
-    f"{normalizar(m['nome'])}-{UF_POR_CODIGO.get(m['codigo_uf'], '')}": str(m["codigo_ibge"])
-    for m in municipios_raw
-    if "nome" in m and "codigo_ibge" in m and "codigo_uf" in m
-}
+# Os códigos IBGE dos municípios ficam no índice compacto de cidades_ibge.py (cidades_ibge.idx),
+# aberto sob demanda; para regenerar a partir de municipios.json: python cidades_ibge.py
 
 
 CSRF_TRUSTED_ORIGINS = [
@@ -294,4 +269,142 @@ SUPPORT_EMAIL = os.getenv("SUPPORT_EMAIL")
 AWS_ACCESS_KEY_ID = config("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = config("AWS_SECRET_ACCESS_KEY")
 AWS_STORAGE_BUCKET_NAME = config("AWS_STORAGE_BUCKET_NAME")
-AWS_S3_REGION_NAME = config("AWS_S3_REGION_NAME", "sa-east-1")  # região padrão
\ No newline at end of file
+AWS_S3_REGION_NAME = config("AWS_S3_REGION_NAME", "sa-east-1")  # região padrão
+
+
+# Processamento de PDFs com Document AI
+# Número de arquivos baixados/processados em paralelo dentro de processar_pdfs
+DOCUMENTAI_CONCURRENCY = int(os.getenv("DOCUMENTAI_CONCURRENCY", 4))
+
+# Cache do resultado do DocumentAI por SHA-256 do PDF (extract/ocr_cache.py)
+DOCUMENTAI_CACHE_ENABLED = os.getenv("DOCUMENTAI_CACHE_ENABLED", "True").lower() == "true"
+DOCUMENTAI_CACHE_TTL_DIAS = int(os.getenv("DOCUMENTAI_CACHE_TTL_DIAS", 90))
+DOCUMENTAI_CACHE_MAX_ENTRADAS = int(os.getenv("DOCUMENTAI_CACHE_MAX_ENTRADAS", 100000))
+
+# Opções de cada chamada process_document do DocumentAI
+# field_mask: campos do Document devolvidos pela API (vazio = documento completo)
+# paginas: processa apenas as N primeiras páginas do PDF (0 = todas)
+DOCUMENTAI_REQUEST_OPTIONS = {
+    "field_mask": os.getenv("DOCUMENTAI_FIELD_MASK", "entities"),
+    "paginas": int(os.getenv("DOCUMENTAI_MAX_PAGINAS", 0)),
+}
+# Sobrescritas por processor_id, ex: '{"a1b2c3": {"paginas": 1}}'
+DOCUMENTAI_REQUEST_OPTIONS_POR_PROCESSADOR = json.loads(os.getenv("DOCUMENTAI_REQUEST_OPTIONS_POR_PROCESSADOR", "{}"))
+
+# Pool de clientes gRPC do DocumentAI por processo do worker (extract/services.py)
+DOCUMENTAI_API_ENDPOINT = os.getenv("DOCUMENTAI_API_ENDPOINT", "documentai.googleapis.com:443")
+# True apenas para o servidor local de testes de carga (python manage.py documentai_standin)
+DOCUMENTAI_INSECURE = os.getenv("DOCUMENTAI_INSECURE", "False").lower() == "true"
+DOCUMENTAI_POOL_SIZE = int(os.getenv("DOCUMENTAI_POOL_SIZE", 2))
+DOCUMENTAI_KEEPALIVE_TIME_MS = int(os.getenv("DOCUMENTAI_KEEPALIVE_TIME_MS", 30000))
+DOCUMENTAI_KEEPALIVE_TIMEOUT_MS = int(os.getenv("DOCUMENTAI_KEEPALIVE_TIMEOUT_MS", 10000))
+
+# Rate limiter do DocumentAI compartilhado entre workers (extract/rate_limiter.py)
+# Dimensione DOCUMENTAI_QPS pela cota de requisições do projeto/processador
+DOCUMENTAI_RATE_LIMIT_ENABLED = os.getenv("DOCUMENTAI_RATE_LIMIT_ENABLED", "True").lower() == "true"
+DOCUMENTAI_QPS = float(os.getenv("DOCUMENTAI_QPS", 5))
+DOCUMENTAI_BURST = float(os.getenv("DOCUMENTAI_BURST", 5))
+# Backoff em RESOURCE_EXHAUSTED/UNAVAILABLE (segundos)
+DOCUMENTAI_MAX_TENTATIVAS = int(os.getenv("DOCUMENTAI_MAX_TENTATIVAS", 6))
+DOCUMENTAI_BACKOFF_BASE = float(os.getenv("DOCUMENTAI_BACKOFF_BASE", 1))
+DOCUMENTAI_BACKOFF_MAX = float(os.getenv("DOCUMENTAI_BACKOFF_MAX", 32))
+
+# Extração local pela camada de texto do PDF, antes do DocumentAI (extract/text_layer.py)
+# MIN_CONFIANCA: fração dos campos críticos válidos exigida para dispensar o OCR (0 a 1)
+TEXT_LAYER_ENABLED = os.getenv("TEXT_LAYER_ENABLED", "True").lower() == "true"
+TEXT_LAYER_MIN_CONFIANCA = float(os.getenv("TEXT_LAYER_MIN_CONFIANCA", 1.0))
+TEXT_LAYER_MIN_CARACTERES = int(os.getenv("TEXT_LAYER_MIN_CARACTERES", 200))
+
+# Templates de layout por prefeitura aprendidos dos resultados do DocumentAI (extract/layout_templates.py)
+# MIN_AMOSTRAS: extrações do DocumentAI necessárias antes de ativar o template
+# MIN_CONCORDANCIA: fração das amostras em que a âncora de um campo precisa se repetir
+# MIN_CONFIANCA: abaixo disso o arquivo vai para o DocumentAI e conta como falha do template
+# MAX_FALHAS_CONSECUTIVAS: falhas seguidas que desativam o template (as âncoras são mantidas para reavaliação)
+# CABECALHO_LINHAS: linhas do início do texto em que o nome da prefeitura precisa aparecer
+LAYOUT_TEMPLATES_ENABLED = os.getenv("LAYOUT_TEMPLATES_ENABLED", "True").lower() == "true"
+LAYOUT_TEMPLATE_MIN_AMOSTRAS = int(os.getenv("LAYOUT_TEMPLATE_MIN_AMOSTRAS", 5))
+LAYOUT_TEMPLATE_MIN_CONCORDANCIA = float(os.getenv("LAYOUT_TEMPLATE_MIN_CONCORDANCIA", 0.8))
+LAYOUT_TEMPLATE_MIN_CONFIANCA = float(os.getenv("LAYOUT_TEMPLATE_MIN_CONFIANCA", 1.0))
+LAYOUT_TEMPLATE_CACHE_SEGUNDOS = int(os.getenv("LAYOUT_TEMPLATE_CACHE_SEGUNDOS", 60))
+LAYOUT_TEMPLATE_MAX_FALHAS_CONSECUTIVAS = int(os.getenv("LAYOUT_TEMPLATE_MAX_FALHAS_CONSECUTIVAS", 3))
+LAYOUT_TEMPLATE_CABECALHO_LINHAS = int(os.getenv("LAYOUT_TEMPLATE_CABECALHO_LINHAS", 15))
+
+# Preflight do PDF antes do envio ao DocumentAI (extract/pdf_preflight.py)
+# PREFLIGHT_MAX_DPI: imagens acima dessa resolução são reduzidas (0 = não reduz)
+PREFLIGHT_ENABLED = os.getenv("PREFLIGHT_ENABLED", "True").lower() == "true"
+PREFLIGHT_MAX_DPI = int(os.getenv("PREFLIGHT_MAX_DPI", 300))
+PREFLIGHT_JPEG_QUALIDADE = int(os.getenv("PREFLIGHT_JPEG_QUALIDADE", 85))
+
+# Execução de processar_pdfs (extract/tasks.py)
+# "threads": o lote inteiro roda em um worker, com DOCUMENTAI_CONCURRENCY threads
+# "chord": um subtask por arquivo distribuído entre todos os workers e um callback que monta o ZIP
+# "pipeline": como o chord, mas cada arquivo passa pela fila pipeline_io (download/DocumentAI,
+#             pool de threads) e depois pela pipeline_cpu (XML, ZIP e Excel, prefork)
+PROCESSAR_PDFS_MODO = os.getenv("PROCESSAR_PDFS_MODO", "threads")
+PROCESSAR_PDFS_CHORD_MIN_ARQUIVOS = int(os.getenv("PROCESSAR_PDFS_CHORD_MIN_ARQUIVOS", 20))
+
+# Diretório dos ZIPs de resultado enquanto são montados (None = diretório temporário do sistema)
+RESULTADOS_TMP_DIR = os.getenv("RESULTADOS_TMP_DIR") or None
+# ZIPs de resultado no bucket: prefixo das chaves e validade da URL de download (segundos)
+RESULTADOS_S3_PREFIXO = os.getenv("RESULTADOS_S3_PREFIXO", "resultados")
+RESULTADOS_URL_EXPIRACAO = int(os.getenv("RESULTADOS_URL_EXPIRACAO", 300))
+
+# Progresso por arquivo dos jobs de processar_pdfs (extract/progresso.py)
+# Intervalos mínimos entre publicações no result backend (estado PROGRESS) e no TaskStatusModel;
+# PROGRESSO_JANELA: quantas conclusões recentes entram no cálculo do ETA
+PROGRESSO_INTERVALO_SEGUNDOS = float(os.getenv("PROGRESSO_INTERVALO_SEGUNDOS", 2))
+PROGRESSO_INTERVALO_DB_SEGUNDOS = float(os.getenv("PROGRESSO_INTERVALO_DB_SEGUNDOS", 10))
+PROGRESSO_JANELA = int(os.getenv("PROGRESSO_JANELA", 20))
+
+# Retentativas por arquivo em processar_pdfs (falhas transitórias de DocumentAI/S3/rede)
+# Backoff exponencial com jitter entre as tentativas; esgotadas, o arquivo vai para a lista de falhas do job
+PROCESSAMENTO_MAX_TENTATIVAS = int(os.getenv("PROCESSAMENTO_MAX_TENTATIVAS", 3))
+PROCESSAMENTO_BACKOFF_BASE = float(os.getenv("PROCESSAMENTO_BACKOFF_BASE", 2))
+PROCESSAMENTO_BACKOFF_MAX = float(os.getenv("PROCESSAMENTO_BACKOFF_MAX", 30))
+
+# Roteamento de processar_pdfs entre as filas interactive e bulk (nfse_abrasf/celery_config.py)
+# Lotes a partir desse número de arquivos ou desse total de bytes vão para a fila bulk
+FILA_BULK_MIN_ARQUIVOS = int(os.getenv("FILA_BULK_MIN_ARQUIVOS", 10))
+FILA_BULK_MIN_BYTES = int(os.getenv("FILA_BULK_MIN_BYTES", 20 * 1024 * 1024))
+
+# Units do systemd dos workers Celery verificadas e reiniciadas pelo monitoramento
+# (check_celery_worker e webhook do WhatsApp). Um único "celery-worker" só cobre todas as filas se
+# for o worker de fallback, com -Q interactive,bulk,merge,pipeline_io,pipeline_cpu,housekeeping,celery;
+# com um worker por fila, liste todas as units, ex: "celery-worker-interactive,celery-worker-bulk,..."
+CELERY_WORKER_UNITS = [
+    unit.strip() for unit in os.getenv("CELERY_WORKER_UNITS", "celery-worker").split(",") if unit.strip()
+]
+
+# Deduplicação de envios ao upload (extract/idempotencia.py): por quanto tempo um reenvio
+# do mesmo lote (ou da mesma Idempotency-Key) devolve a tarefa já criada
+IDEMPOTENCIA_TTL_SEGUNDOS = int(os.getenv("IDEMPOTENCIA_TTL_SEGUNDOS", 3600))
+
+# Single-flight da extração por PDF (extract/ocr_cache.py): jobs concorrentes com o mesmo PDF
+# esperam o resultado do primeiro em vez de chamar o DocumentAI de novo
+# TTL: validade da trava (precisa cobrir o OCR com retentativas); ESPERA_MAX: espera máxima de quem não tem a trava
+OCR_SINGLEFLIGHT_ENABLED = os.getenv("OCR_SINGLEFLIGHT_ENABLED", "True").lower() == "true"
+OCR_SINGLEFLIGHT_TTL = int(os.getenv("OCR_SINGLEFLIGHT_TTL", 300))
+OCR_SINGLEFLIGHT_ESPERA_MAX = float(os.getenv("OCR_SINGLEFLIGHT_ESPERA_MAX", 300))
+OCR_SINGLEFLIGHT_INTERVALO = float(os.getenv("OCR_SINGLEFLIGHT_INTERVALO", 1))
+
+# Autoscaler dos workers Celery (python manage.py autoscale_workers, extract/autoscaler.py)
+# AUTOSCALER_FILAS: {fila: [mínimo, máximo]} de processos somando os workers de cada fila
+# ALVO_SEGUNDOS: prazo para esvaziar a fila; IDADE_MAX: idade da mensagem mais antiga que força crescimento
+# CICLOS_OCIOSOS: amostras seguidas com sobra antes de reduzir
+AUTOSCALER_FILAS = json.loads(os.getenv(
+    "AUTOSCALER_FILAS",
+    '{"interactive": [2, 8], "bulk": [1, 8], "merge": [1, 2], "pipeline_cpu": [1, 4]}'
+))
+AUTOSCALER_INTERVALO = float(os.getenv("AUTOSCALER_INTERVALO", 15))
+AUTOSCALER_ALVO_SEGUNDOS = float(os.getenv("AUTOSCALER_ALVO_SEGUNDOS", 60))
+AUTOSCALER_IDADE_MAX = float(os.getenv("AUTOSCALER_IDADE_MAX", 30))
+AUTOSCALER_CICLOS_OCIOSOS = int(os.getenv("AUTOSCALER_CICLOS_OCIOSOS", 4))
+
+# Esquemas XSD do ABRASF por versão, compilados uma vez por processo (extract/services.py, SchemaRegistry)
+# O XMLGenerator emite o layout 2.0x; o XSD da 2.04 não acompanha o projeto e vem de ABRASF_XSD_2_04
+# XSD_VERSAO_GERADOR: versão usada para validar os XMLs gerados. Vazio desliga a validação (xml_valido
+# fica vazio); se apontar para uma versão sem XSD existente, a aplicação não sobe (extract/apps.py)
+ABRASF_XSD_VERSOES = {
+    "2.04": os.getenv("ABRASF_XSD_2_04"),
+}
+XSD_VERSAO_GERADOR = os.getenv("XSD_VERSAO_GERADOR", "")